@@ -0,0 +1,549 @@
+"""Stand-in msgpack-rpc server for benchmarking the client without Nvim.
+
+`FakeNvim` implements `vim_get_api_info` and the `vim_*`, `buffer_*`,
+`window_*` and `tabpage_*` functions used by `neovim.api`, on in-memory
+buffers, windows, tabpages, variables and options. The API metadata is
+generated from the implemented functions. Vimscript is not available, so
+`vim_command` does nothing and `vim_eval` only understands numbers and
+variable names(eg: `g:foo`).
+
+Every request can be delayed by a fixed latency, and the initial buffer
+size is configurable, which makes client throughput measurements
+deterministic.
+
+The server can be started in-process:
+
+    >>> address = start('socket', lines=1000)     # doctest: +SKIP
+    >>> nvim = neovim.Nvim.from_session(neovim.socket_session(address))
+
+or as a separate process, in which case it can also be used by the test
+suite and the other benchmarks through the usual environment variables:
+
+    python benchmark/fake_nvim.py --socket /tmp/fake-nvim [--latency MS]
+    NVIM_SPAWN_ARGV='["python", "benchmark/fake_nvim.py", "--stdio"]'
+"""
+import inspect
+import optparse
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from msgpack import ExtType, Packer, Unpacker, packb, unpackb
+
+
+IS_PYTHON3 = sys.version_info >= (3, 0)
+
+TYPES = ('Buffer', 'Window', 'Tabpage')
+
+
+class FakeError(Exception):
+
+    """Error returned to the client."""
+
+
+def to_str(value):
+    """Decode `value` if it's a byte string."""
+    if IS_PYTHON3 and isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+class Handle(object):
+
+    """Buffer, window or tabpage."""
+
+    def __init__(self, type_id, handle, **attributes):
+        self.type_id = type_id
+        self.handle = handle
+        self.vars = {}
+        self.options = {}
+        self.__dict__.update(attributes)
+
+    def ext(self):
+        return ExtType(self.type_id, packb(self.handle))
+
+
+class FakeNvim(object):
+
+    """In-memory implementation of the Nvim API functions used by clients.
+
+    `lines` and `line_length` set the size of the initial buffer, and
+    `latency` is the time(in seconds) taken by each request.
+    """
+
+    def __init__(self, lines=0, line_length=80, latency=0):
+        self.latency = latency
+        self.objects = {}
+        self.vars = {}
+        self.vvars = {b'version': 0}
+        self.options = {b'encoding': b'utf-8', b'runtimepath': b''}
+        self.subscriptions = set()
+        self.next_channel_id = 1
+        self.next_handle = 1
+        line = b'x' * line_length
+        buf = self._new(0, lines=[line] * lines or [b''], name=b'',
+                        marks={})
+        win = self._new(1, buffer=buf, cursor=[1, 0], height=50, width=80,
+                        position=[0, 0])
+        tab = self._new(2, windows=[win])
+        win.tabpage = tab
+        self.current = {0: buf, 1: win, 2: tab}
+        self.current_line = 0
+        self.metadata = self._metadata()
+
+    def _new(self, type_id, **attributes):
+        obj = Handle(type_id, self.next_handle, **attributes)
+        self.objects[(type_id, obj.handle,)] = obj
+        self.next_handle += 1
+        return obj
+
+    def _metadata(self):
+        functions = []
+        for name, method in inspect.getmembers(self, inspect.ismethod):
+            if name.split('_', 1)[0] not in ('vim', 'buffer', 'window',
+                                              'tabpage'):
+                continue
+            params = _parameter_names(method)
+            prefix = name.split('_', 1)[0].capitalize()
+            parameters = []
+            for i, param in enumerate(params):
+                type_name = prefix if i == 0 and prefix in TYPES else 'Object'
+                parameters.append([type_name, param])
+            functions.append({'name': name, 'parameters': parameters,
+                              'return_type': 'Object', 'can_fail': True})
+        return {
+            'types': dict((name, {'id': i}) for i, name in enumerate(TYPES)),
+            'functions': functions,
+        }
+
+    def dispatch(self, method, args):
+        """Call the API function `method` with `args`, return the result."""
+        method = to_str(method)
+        function = getattr(self, method, None)
+        if method.split('_', 1)[0] not in ('vim', 'buffer', 'window',
+                                            'tabpage') or not function:
+            raise FakeError('Invalid method name')
+        if self.latency:
+            time.sleep(self.latency)
+        args = [self._decode(arg) for arg in args]
+        try:
+            return self._encode(function(*args))
+        except TypeError as err:
+            raise FakeError('Wrong number of arguments: {0}'.format(err))
+
+    def _decode(self, obj):
+        if isinstance(obj, ExtType):
+            handle = (obj.code, unpackb(obj.data),)
+            if handle not in self.objects:
+                raise FakeError('Invalid object')
+            return self.objects[handle]
+        if isinstance(obj, list):
+            return [self._decode(o) for o in obj]
+        if isinstance(obj, dict):
+            return dict((self._decode(k), self._decode(v))
+                        for k, v in obj.items())
+        if not IS_PYTHON3 and isinstance(obj, unicode):  # NOQA
+            return obj.encode('utf-8')
+        if isinstance(obj, str) and IS_PYTHON3:
+            return obj.encode('utf-8')
+        return obj
+
+    def _encode(self, obj):
+        if isinstance(obj, Handle):
+            return obj.ext()
+        if isinstance(obj, (list, tuple)):
+            return [self._encode(o) for o in obj]
+        return obj
+
+    def _index(self, buf, index, insert=False):
+        count = len(buf.lines)
+        if index < 0:
+            index += count + (1 if insert else 0)
+        if index < 0 or index > count or (not insert and index == count):
+            raise FakeError('Index out of bounds')
+        return index
+
+    def _slice(self, buf, start, end, include_start, include_end):
+        count = len(buf.lines)
+        if start < 0:
+            start += count
+        if end < 0:
+            end += count
+        start += not include_start
+        end += include_end
+        return max(0, start), min(count, end)
+
+    @staticmethod
+    def _set(mapping, name, value):
+        old = mapping.get(name)
+        if value is None:
+            mapping.pop(name, None)
+        else:
+            mapping[name] = value
+        return old
+
+    @staticmethod
+    def _get(mapping, name):
+        if name not in mapping:
+            raise FakeError('Key not found: {0}'.format(to_str(name)))
+        return mapping[name]
+
+    # vim_* functions
+    def vim_get_api_info(self):
+        channel_id = self.next_channel_id
+        self.next_channel_id += 1
+        return [channel_id, self.metadata]
+
+    def vim_command(self, command):
+        return None
+
+    def vim_eval(self, expr):
+        expr = expr.strip()
+        try:
+            return int(expr)
+        except ValueError:
+            pass
+        scope, _, name = expr.partition(b':')
+        if scope == b'g':
+            return self._get(self.vars, name)
+        if scope == b'v':
+            return self._get(self.vvars, name)
+        if scope in (b'b', b'w', b't'):
+            obj = self.current[b'bwt'.index(scope)]
+            return self._get(obj.vars, name)
+        raise FakeError('Cannot evaluate: {0}'.format(to_str(expr)))
+
+    def vim_feedkeys(self, keys, mode, escape_csi):
+        return None
+
+    def vim_replace_termcodes(self, string, from_part, do_lt, special):
+        return string
+
+    def vim_strwidth(self, string):
+        return len(string.decode('utf-8'))
+
+    def vim_list_runtime_paths(self):
+        return []
+
+    def vim_change_directory(self, directory):
+        return None
+
+    def vim_get_current_line(self):
+        buf = self.current[0]
+        return buf.lines[min(self.current_line, len(buf.lines) - 1)]
+
+    def vim_set_current_line(self, line):
+        buf = self.current[0]
+        buf.lines[min(self.current_line, len(buf.lines) - 1)] = line
+
+    def vim_get_var(self, name):
+        return self._get(self.vars, name)
+
+    def vim_set_var(self, name, value):
+        return self._set(self.vars, name, value)
+
+    def vim_get_vvar(self, name):
+        return self._get(self.vvars, name)
+
+    def vim_get_option(self, name):
+        return self._get(self.options, name)
+
+    def vim_set_option(self, name, value):
+        self.options[name] = value
+
+    def vim_out_write(self, string):
+        return None
+
+    def vim_err_write(self, string):
+        return None
+
+    def vim_get_buffers(self):
+        return self._all(0)
+
+    def vim_get_windows(self):
+        return self._all(1)
+
+    def vim_get_tabpages(self):
+        return self._all(2)
+
+    def _all(self, type_id):
+        return sorted((o for o in self.objects.values()
+                       if o.type_id == type_id), key=lambda o: o.handle)
+
+    def vim_get_current_buffer(self):
+        return self.current[0]
+
+    def vim_set_current_buffer(self, buf):
+        self.current[0] = buf
+        self.current[1].buffer = buf
+
+    def vim_get_current_window(self):
+        return self.current[1]
+
+    def vim_set_current_window(self, win):
+        self.current[1] = win
+        self.current[0] = win.buffer
+        self.current[2] = win.tabpage
+
+    def vim_get_current_tabpage(self):
+        return self.current[2]
+
+    def vim_set_current_tabpage(self, tab):
+        self.vim_set_current_window(tab.windows[0])
+
+    def vim_subscribe(self, event):
+        self.subscriptions.add(event)
+
+    def vim_unsubscribe(self, event):
+        self.subscriptions.discard(event)
+
+    def vim_register_provider(self, feature):
+        return None
+
+    # buffer_* functions
+    def buffer_line_count(self, buf):
+        return len(buf.lines)
+
+    def buffer_get_line(self, buf, index):
+        return buf.lines[self._index(buf, index)]
+
+    def buffer_set_line(self, buf, index, line):
+        buf.lines[self._index(buf, index)] = line
+
+    def buffer_del_line(self, buf, index):
+        del buf.lines[self._index(buf, index)]
+        if not buf.lines:
+            buf.lines.append(b'')
+
+    def buffer_get_line_slice(self, buf, start, end, include_start,
+                              include_end):
+        start, end = self._slice(buf, start, end, include_start, include_end)
+        return buf.lines[start:end]
+
+    def buffer_set_line_slice(self, buf, start, end, include_start,
+                              include_end, replacement):
+        start, end = self._slice(buf, start, end, include_start, include_end)
+        buf.lines[start:max(start, end)] = replacement
+        if not buf.lines:
+            buf.lines.append(b'')
+
+    def buffer_insert(self, buf, lnum, lines):
+        index = self._index(buf, lnum, insert=True)
+        buf.lines[index:index] = lines
+
+    def buffer_get_var(self, buf, name):
+        return self._get(buf.vars, name)
+
+    def buffer_set_var(self, buf, name, value):
+        return self._set(buf.vars, name, value)
+
+    def buffer_get_option(self, buf, name):
+        return self._get(buf.options, name)
+
+    def buffer_set_option(self, buf, name, value):
+        buf.options[name] = value
+
+    def buffer_get_name(self, buf):
+        return buf.name
+
+    def buffer_set_name(self, buf, name):
+        buf.name = name
+
+    def buffer_get_number(self, buf):
+        return buf.handle
+
+    def buffer_get_mark(self, buf, name):
+        return buf.marks.get(name, [0, 0])
+
+    def buffer_is_valid(self, buf):
+        return True
+
+    # window_* functions
+    def window_get_buffer(self, win):
+        return win.buffer
+
+    def window_get_cursor(self, win):
+        return win.cursor
+
+    def window_set_cursor(self, win, pos):
+        win.cursor = pos
+
+    def window_get_height(self, win):
+        return win.height
+
+    def window_set_height(self, win, height):
+        win.height = height
+
+    def window_get_width(self, win):
+        return win.width
+
+    def window_set_width(self, win, width):
+        win.width = width
+
+    def window_get_var(self, win, name):
+        return self._get(win.vars, name)
+
+    def window_set_var(self, win, name, value):
+        return self._set(win.vars, name, value)
+
+    def window_get_option(self, win, name):
+        return self._get(win.options, name)
+
+    def window_set_option(self, win, name, value):
+        win.options[name] = value
+
+    def window_get_position(self, win):
+        return win.position
+
+    def window_get_tabpage(self, win):
+        return win.tabpage
+
+    def window_is_valid(self, win):
+        return True
+
+    # tabpage_* functions
+    def tabpage_get_windows(self, tab):
+        return tab.windows
+
+    def tabpage_get_var(self, tab, name):
+        return self._get(tab.vars, name)
+
+    def tabpage_set_var(self, tab, name, value):
+        return self._set(tab.vars, name, value)
+
+    def tabpage_get_window(self, tab):
+        if self.current[2] is tab:
+            return self.current[1]
+        return tab.windows[0]
+
+    def tabpage_is_valid(self, tab):
+        return True
+
+
+def _parameter_names(method):
+    if hasattr(inspect, 'signature'):
+        return list(inspect.signature(method).parameters)
+    # python 2, `getargspec` includes `self`
+    return inspect.getargspec(method).args[1:]
+
+
+def serve(nvim, read, write):
+    """Serve msgpack-rpc requests for `nvim` until `read` returns nothing.
+
+    `read()` returns chunks of data from the client and `write(data)` sends
+    data to it.
+    """
+    unpacker = Unpacker()
+    packer = Packer(use_bin_type=False)
+    while True:
+        data = read()
+        if not data:
+            return
+        unpacker.feed(data)
+        for msg in unpacker:
+            if msg[0] != 0:
+                # notifications and responses are ignored
+                continue
+            try:
+                response = [1, msg[1], None, nvim.dispatch(msg[2], msg[3])]
+            except FakeError as err:
+                response = [1, msg[1], [0, str(err)], None]
+            write(packer.pack(response))
+
+
+def serve_connection(nvim, conn):
+    try:
+        serve(nvim, lambda: conn.recv(65536), conn.sendall)
+    except socket.error:
+        pass
+    finally:
+        conn.close()
+
+
+def serve_stdio(nvim):
+    """Serve requests on stdin/stdout."""
+    serve(nvim, lambda: os.read(0, 65536), lambda data: os.write(1, data))
+
+
+def listen(nvim, transport, address=None):
+    """Listen on a 'socket' path or 'tcp' port, serve each client in a thread.
+
+    Return the listening socket and the address. If `address` is None, a
+    temporary socket path or a free port is used.
+    """
+    if transport == 'tcp':
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(('127.0.0.1', address or 0))
+        address = listener.getsockname()[1]
+    else:
+        if address is None:
+            address = os.path.join(tempfile.mkdtemp(), 'fake-nvim')
+        elif os.path.exists(address):
+            os.unlink(address)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(address)
+    listener.listen(5)
+    return listener, address
+
+
+def accept_loop(nvim, listener):
+    """Accept clients forever, serving each one in a daemon thread."""
+    while True:
+        conn, _ = listener.accept()
+        thread = threading.Thread(target=serve_connection, args=(nvim, conn))
+        thread.daemon = True
+        thread.start()
+
+
+def start(transport='socket', address=None, **kwargs):
+    """Start a `FakeNvim` server in a daemon thread of this process.
+
+    Keyword arguments are passed to `FakeNvim`. Return the socket path or
+    tcp port.
+    """
+    nvim = FakeNvim(**kwargs)
+    listener, address = listen(nvim, transport, address)
+    thread = threading.Thread(target=accept_loop, args=(nvim, listener))
+    thread.daemon = True
+    thread.start()
+    return address
+
+
+def main():
+    parser = optparse.OptionParser(
+        usage='%prog (--stdio|--socket PATH|--tcp PORT) [options]')
+    parser.add_option('--stdio', action='store_true',
+                      help='serve a single client on stdin/stdout')
+    parser.add_option('--socket', help='unix socket path')
+    parser.add_option('--tcp', type='int', help='tcp port')
+    parser.add_option('--latency', type='float', default=0,
+                      help='delay of each request in milliseconds')
+    parser.add_option('--lines', type='int', default=0,
+                      help='number of lines in the initial buffer')
+    parser.add_option('--line-length', type='int', default=80,
+                      help='length of each line in the initial buffer')
+    options, _ = parser.parse_args()
+    nvim = FakeNvim(lines=options.lines, line_length=options.line_length,
+                    latency=options.latency / 1000.0)
+    if options.stdio:
+        serve_stdio(nvim)
+        return
+    if options.tcp:
+        listener, address = listen(nvim, 'tcp', options.tcp)
+    elif options.socket:
+        listener, address = listen(nvim, 'socket', options.socket)
+    else:
+        parser.error('one of --stdio, --socket or --tcp is required')
+    sys.stderr.write('listening on {0}\n'.format(address))
+    try:
+        accept_loop(nvim, listener)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+"""Memory benchmark for receiving large messages.
+
+Each case runs in a child process and reports the growth of its peak
+resident set size(measured on linux) while receiving a response of `--size`
+megabytes(default 100) made of 80 byte lines, along with the size of the
+unpacked lines:
+
+- `stream_bytes`: fed to `MsgpackStream` in 64k `bytes` chunks, like the
+  uv event loop does
+- `stream_readinto`: read with `readinto` into a preallocated buffer and fed
+  as memoryviews, like the asyncio event loop does on python 3.7+
+- `stream_oversized`: like `stream_bytes`, with a `max_buffer_size` of a
+  tenth of the message, which must fail without buffering the message
+- `stream_send`: a request to set `--size` megabytes of lines, sent by a
+  `MsgpackStream`(the lines are allocated before measuring)
+- `<backend>_buffer_get`: `Buffer[:]` from a `fake_nvim.py` server running
+  in another process, for each available event loop backend
+
+    python benchmark/memory.py [--size MB] [--read-size BYTES] [case...]
+"""
+import io
+import json
+import optparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    # windows
+    resource = None
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from msgpack import packb  # NOQA
+from neovim.api import Nvim  # NOQA
+from neovim.msgpack_rpc import AsyncSession, MsgpackStream, Session  # NOQA
+from suite import backends  # NOQA
+
+
+LINE = b'x' * 80
+CHUNK_SIZE = 65536
+STREAM_CASES = ('stream_bytes', 'stream_readinto', 'stream_oversized')
+
+
+def reset_peak_rss():
+    """Reset the peak resident set size of this process(linux only)."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except (IOError, OSError):
+        pass
+
+
+def peak_rss():
+    """Return the peak resident set size of this process in bytes."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes, except on OS X
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def current_rss():
+    """Return the resident set size of this process in bytes.
+
+    Only available on linux, elsewhere the peak is returned instead, so
+    results are only meaningful on linux.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError):
+        return peak_rss()
+
+
+def line_count(size):
+    return size * 1024 * 1024 // len(LINE)
+
+
+class NullLoop(object):
+
+    """Event loop stand-in for feeding a `MsgpackStream` directly."""
+
+    def send(self, data):
+        pass
+
+    def stop(self):
+        pass
+
+
+def case_stream(name, size, read_size):
+    data = packb([1, 1, None, [LINE] * line_count(size)], use_bin_type=True)
+    max_buffer_size = len(data) // 10 if name == 'stream_oversized' else 0
+    stream = MsgpackStream(NullLoop(), max_buffer_size)
+    received = []
+    stream._message_cb = received.append
+    reset_peak_rss()
+    baseline = current_rss()
+    started = time.time()
+    if name == 'stream_readinto':
+        f = io.BytesIO(data)
+        view = memoryview(bytearray(read_size))
+        while True:
+            nbytes = f.readinto(view)
+            if not nbytes:
+                break
+            stream._on_data(view[:nbytes])
+    else:
+        for i in range(0, len(data), CHUNK_SIZE):
+            stream._on_data(data[i:i + CHUNK_SIZE])
+            if stream._error is not None:
+                break
+    elapsed = time.time() - started
+    return {
+        'peak': peak_rss() - baseline,
+        'time': elapsed,
+        'lines': received[0][3] if received else [],
+        'error': str(stream._error) if stream._error else None,
+    }
+
+
+def case_stream_send(size):
+    lines = [LINE] * line_count(size)
+    stream = MsgpackStream(NullLoop())
+    reset_peak_rss()
+    baseline = current_rss()
+    started = time.time()
+    stream.send([0, 1, 'buffer_set_line_slice', [0, 0, -1, True, True,
+                                                 lines]])
+    elapsed = time.time() - started
+    return {
+        'peak': peak_rss() - baseline,
+        'time': elapsed,
+        'lines': [],
+        'error': None,
+    }
+
+
+def case_buffer_get(name, size, read_size):
+    loop_class = backends()[name.split('_')[0]]
+    path = os.path.join(tempfile.mkdtemp(), 'fake-nvim')
+    server = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, 'benchmark', 'fake_nvim.py'),
+        '--socket', path, '--lines', str(line_count(size)),
+        '--line-length', str(len(LINE))])
+    try:
+        while not os.path.exists(path):
+            time.sleep(0.05)
+        loop = loop_class('socket', path, read_size=read_size)
+        session = Session(AsyncSession(MsgpackStream(loop, 0)))
+        buf = Nvim.from_session(session).current.buffer
+        reset_peak_rss()
+        baseline = current_rss()
+        started = time.time()
+        lines = buf[:]
+        elapsed = time.time() - started
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        'peak': peak_rss() - baseline,
+        'time': elapsed,
+        'lines': lines,
+        'error': None,
+    }
+
+
+def run_child(name, size, read_size):
+    if name == 'stream_send':
+        result = case_stream_send(size)
+    elif name in STREAM_CASES:
+        result = case_stream(name, size, read_size)
+    else:
+        result = case_buffer_get(name, size, read_size)
+    lines = result.pop('lines')
+    result['result'] = sys.getsizeof(lines) + sum(sys.getsizeof(line)
+                                                  for line in lines)
+    print(json.dumps(result))
+
+
+def run_case(name, size, read_size):
+    output = subprocess.check_output([
+        sys.executable, os.path.abspath(__file__), '--child', name,
+        '--size', str(size), '--read-size', str(read_size)])
+    return json.loads(output.decode('utf-8').splitlines()[-1])
+
+
+def report(name, result):
+    mb = 1024.0 * 1024
+    line = '{0:<24} peak {1:8.1f}MB  lines {2:8.1f}MB  overhead {3:8.1f}MB' \
+           '  {4:7.3f}s'
+    print(line.format(name, result['peak'] / mb, result['result'] / mb,
+                      (result['peak'] - result['result']) / mb,
+                      result['time']))
+    if result['error']:
+        print('    {0}'.format(result['error']))
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] [case...]')
+    parser.add_option('--size', type='int', default=100,
+                      help='size of the response in megabytes')
+    parser.add_option('--read-size', type='int', default=256 * 1024,
+                      help='size of the reads into a preallocated buffer')
+    parser.add_option('--child', help=optparse.SUPPRESS_HELP)
+    options, only = parser.parse_args()
+    if options.child:
+        run_child(options.child, options.size, options.read_size)
+        return
+    cases = list(STREAM_CASES) + ['stream_send']
+    cases.extend('{0}_buffer_get'.format(backend)
+                 for backend in sorted(backends()))
+    for name in cases:
+        if only and name not in only:
+            continue
+        report(name, run_case(name, options.size, options.read_size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Benchmark `:pydo` on a large buffer.
+
+A python host is started from this checkout(like the script host tests do),
+the current buffer is filled with `lines` lines(default 1000000) and a few
+`:pydo` commands are timed, changing none, some or all of the lines.
+
+The Nvim instance is selected like in the test suite, with either the
+`NVIM_SPAWN_ARGV` or the `NVIM_LISTEN_ADDRESS` environment variable:
+
+    NVIM_SPAWN_ARGV='["nvim", "-u", "NONE", "--embed"]' \\
+        python benchmark/pydo.py [lines] [samples]
+"""
+import json
+import os
+import sys
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = [
+    ('unchanged', 'return None'),
+    ('same text', 'return line'),
+    ('sparse', 'return line.upper() if linenr % 100 == 0 else None'),
+    ('all', 'return line.upper()'),
+]
+
+
+def connect():
+    # make the host spawned by Nvim import this checkout
+    os.environ['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [p for p in os.environ.get('PYTHONPATH', '').split(os.pathsep)
+                  if p])
+    sys.path.insert(0, ROOT)
+    import neovim
+    if 'NVIM_SPAWN_ARGV' in os.environ:
+        session = neovim.spawn_session(json.loads(
+            os.environ['NVIM_SPAWN_ARGV']))
+    else:
+        session = neovim.socket_session(os.environ['NVIM_LISTEN_ADDRESS'])
+    return neovim.Nvim.from_session(session)
+
+
+def start_host(vim):
+    vim.command('let g:pydo_bench_host = rpcstart({0}, ["-c", {1}])'.format(
+        json.dumps(sys.executable),
+        json.dumps('import neovim; neovim.start_host()')))
+    # wait for the host to register its handlers
+    vim.eval('rpcrequest(g:pydo_bench_host, "python_eval", "1")')
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    samples = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    vim = connect()
+    start_host(vim)
+    original = ['line number {0} of the pydo benchmark'.format(i)
+                for i in range(count)]
+    print('{0} lines, {1} samples'.format(count, samples))
+    try:
+        for name, code in CASES:
+            times = []
+            for _ in range(samples):
+                vim.current.buffer[:] = original
+                t = time.time()
+                vim.command('%pydo ' + code)
+                times.append(time.time() - t)
+            times.sort()
+            print('{0:<10} min {1:8.2f}ms  median {2:8.2f}ms'.format(
+                name, times[0] * 1000, times[len(times) // 2] * 1000))
+    finally:
+        vim.command('call rpcstop(g:pydo_bench_host)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""Replay traffic recorded with `NVIM_PYTHON_RECORD_FILE`.
+
+Recordings are created by running any client(eg: the python plugin host)
+with `NVIM_PYTHON_RECORD_FILE` set(see `neovim.msgpack_rpc.recorder`). This
+script has three commands:
+
+    python benchmark/replay.py info RECORDING
+
+Print the number of frames, bytes and messages per method in each
+direction.
+
+    python benchmark/replay.py client [--speed N] [--repeat N] RECORDING
+
+Feed the data received from Nvim through the `MsgpackStream`,
+`AsyncSession` and `Session` layers of this checkout, with handlers that
+return immediately, and report the time taken. This measures the decoding
+and dispatch paths. Responses sent by the handlers are discarded.
+
+    python benchmark/replay.py server [--speed N] (--socket PATH|--tcp PORT)
+        RECORDING
+
+Act as a stand-in for Nvim: for each client that connects, send the data
+received from Nvim in the recording and discard whatever the client sends.
+As long as the client is deterministic, the responses match its requests.
+
+`--speed` scales the delays between frames: 1 reproduces the original
+timing, 10 replays ten times faster and 0(the default) replays without
+delays.
+"""
+import optparse
+import os
+import socket
+import sys
+import threading
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from neovim.msgpack_rpc import AsyncSession, MsgpackStream, Session  # NOQA
+from neovim.msgpack_rpc.recorder import IN, OUT, read_recording  # NOQA
+
+
+def load(path):
+    """Return the frames of a recording as a list."""
+    return list(read_recording(path))
+
+
+def paced(frames, speed, direction=IN):
+    """Yield the data of `frames` in `direction`, delayed according to speed.
+
+    The delays are relative to the first yielded frame.
+    """
+    start = None
+    for frame_direction, timestamp, data in frames:
+        if frame_direction != direction:
+            continue
+        if speed:
+            if start is None:
+                start = (time.time(), timestamp)
+            delay = (timestamp - start[1]) / speed - (time.time() - start[0])
+            if delay > 0:
+                time.sleep(delay)
+        yield data
+
+
+def info(frames):
+    from msgpack import Unpacker
+    for direction, name in ((IN, 'received'), (OUT, 'sent')):
+        unpacker = Unpacker()
+        count = size = 0
+        methods = {}
+        for frame_direction, _, data in frames:
+            if frame_direction != direction:
+                continue
+            count += 1
+            size += len(data)
+            unpacker.feed(data)
+            for msg in unpacker:
+                if msg[0] == 1:
+                    key = 'response'
+                else:
+                    key = msg[2] if msg[0] == 0 else msg[1]
+                    if isinstance(key, bytes) and not isinstance(key, str):
+                        key = key.decode('utf-8', 'replace')
+                methods[key] = methods.get(key, 0) + 1
+        print('{0}: {1} frames, {2} bytes'.format(name, count, size))
+        for method, count in sorted(methods.items(), key=lambda i: -i[1]):
+            print('  {0:<40} {1}'.format(method, count))
+    if frames:
+        print('duration: {0:.3f}s'.format(frames[-1][1] - frames[0][1]))
+
+
+class ReplayLoop(object):
+
+    """Stand-in event loop that feeds recorded data to a `MsgpackStream`."""
+
+    def __init__(self, frames, speed):
+        self.frames = frames
+        self.speed = speed
+        self.sent = 0
+        self.session = None
+
+    def run(self, data_cb):
+        for data in paced(self.frames, self.speed):
+            data_cb(data)
+        self.session.stop()
+
+    def send(self, data):
+        self.sent += len(data)
+
+    def stop(self):
+        pass
+
+    def interrupt(self):
+        pass
+
+
+class IgnoredResponses(dict):
+
+    """Pending requests map that ignores responses to unknown requests.
+
+    The handlers don't send the requests that were originally sent, so the
+    recorded responses have nothing to match.
+    """
+
+    def pop(self, key, *default):
+        return dict.pop(self, key, lambda err, rv: None)
+
+
+def client(frames, speed, repeat):
+    counts = {'request': 0, 'notification': 0}
+
+    def on_request(name, args):
+        counts['request'] += 1
+
+    def on_notification(name, args):
+        counts['notification'] += 1
+
+    times = []
+    for _ in range(repeat):
+        loop = ReplayLoop(frames, speed)
+        async_session = AsyncSession(MsgpackStream(loop))
+        async_session._pending_requests = IgnoredResponses()
+        loop.session = session = Session(async_session)
+        t = time.time()
+        session.run(on_request, on_notification)
+        times.append(time.time() - t)
+    times.sort()
+    size = sum(len(data) for direction, _, data in frames if direction == IN)
+    print('{0} requests, {1} notifications, {2} bytes per run'.format(
+        counts['request'] // repeat, counts['notification'] // repeat, size))
+    print('min {0:8.2f}ms  median {1:8.2f}ms  ({2:.1f}MB/s)'.format(
+        times[0] * 1000, times[len(times) // 2] * 1000,
+        size / max(times[0], 1e-9) / 1e6))
+
+
+def server(frames, speed, address):
+    if isinstance(address, int):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(('127.0.0.1', address))
+    else:
+        if os.path.exists(address):
+            os.unlink(address)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(address)
+    listener.listen(1)
+    print('listening on {0}'.format(address))
+    while True:
+        conn, _ = listener.accept()
+        reader = threading.Thread(target=discard, args=(conn,))
+        reader.daemon = True
+        reader.start()
+        t = time.time()
+        try:
+            for data in paced(frames, speed):
+                conn.sendall(data)
+        except socket.error as err:
+            print('client disconnected: {0}'.format(err))
+        finally:
+            conn.shutdown(socket.SHUT_WR)
+            reader.join()
+            conn.close()
+        print('replayed in {0:.2f}ms'.format((time.time() - t) * 1000))
+
+
+def discard(conn):
+    while True:
+        try:
+            if not conn.recv(65536):
+                return
+        except socket.error:
+            return
+
+
+def main():
+    parser = optparse.OptionParser(
+        usage='%prog (info|client|server) [options] RECORDING')
+    parser.add_option('--speed', type='float', default=0,
+                      help='timing scale, 0 to replay without delays')
+    parser.add_option('--repeat', type='int', default=5,
+                      help='number of client runs')
+    parser.add_option('--socket', help='unix socket path for the server')
+    parser.add_option('--tcp', type='int', help='tcp port for the server')
+    options, args = parser.parse_args()
+    if len(args) != 2 or args[0] not in ('info', 'client', 'server'):
+        parser.error('expected a command and a recording file')
+    frames = load(args[1])
+    if args[0] == 'info':
+        info(frames)
+    elif args[0] == 'client':
+        client(frames, options.speed, options.repeat)
+    else:
+        address = options.tcp or options.socket
+        if not address:
+            parser.error('server requires --socket or --tcp')
+        try:
+            server(frames, options.speed, address)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Benchmark the time taken by `Nvim.from_session` in short-lived processes.
+
+Each sample runs in a fresh python process that connects to Nvim, calls
+`Nvim.from_session` and then reads `nvim.metadata`(which is decoded on first
+access).
+
+The Nvim instance is selected like in the test suite, with either the
+`NVIM_SPAWN_ARGV` or the `NVIM_LISTEN_ADDRESS` environment variable:
+
+    NVIM_SPAWN_ARGV='["nvim", "-u", "NONE", "--embed"]' \\
+        python benchmark/startup.py [samples]
+"""
+import json
+import os
+import subprocess
+import sys
+
+
+SAMPLE = r'''
+import json, os, time
+t0 = time.time()
+import neovim
+t1 = time.time()
+if 'NVIM_SPAWN_ARGV' in os.environ:
+    session = neovim.spawn_session(json.loads(os.environ['NVIM_SPAWN_ARGV']))
+else:
+    session = neovim.socket_session(os.environ['NVIM_LISTEN_ADDRESS'])
+t2 = time.time()
+nvim = neovim.Nvim.from_session(session)
+t3 = time.time()
+nvim.metadata['functions']
+t4 = time.time()
+print(json.dumps({'import': t1 - t0, 'connect': t2 - t1,
+                  'from_session': t3 - t2, 'metadata': t4 - t3}))
+'''
+
+
+def run_samples(count):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))
+    samples = []
+    for _ in range(count):
+        out = subprocess.check_output([sys.executable, '-c', SAMPLE], env=env)
+        samples.append(json.loads(out.decode('utf-8').splitlines()[-1]))
+    return samples
+
+
+def summarize(name, samples):
+    print(name)
+    for key in ['import', 'connect', 'from_session', 'metadata']:
+        values = sorted(s[key] for s in samples)
+        print('  {0:<14} min {1:8.2f}ms  median {2:8.2f}ms'.format(
+            key, values[0] * 1000, values[len(values) // 2] * 1000))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    summarize('startup', run_samples(count))
+
+
+if __name__ == '__main__':
+    main()
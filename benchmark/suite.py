@@ -0,0 +1,321 @@
+"""Benchmark suite for the client stack.
+
+Session benchmarks run against the in-process fake server from
+`fake_nvim.py`, once for each available event loop backend(uv and
+asyncio):
+
+- `pack`/`unpack`: `MsgpackStream` throughput for requests with 1000 lines
+- `walk_decode`/`walk_ext`: `common.walk` with `DecodeHook` and `ExtHook`
+- `request_blocking`: `Session.request` round trips outside of the loop
+- `request_yielding`: `Session.request` from a greenlet handler
+- `post_threads`: notifications posted by 4 threads with `Session.post`
+- `buffer_get_N`/`buffer_set_N`: `Buffer[:]` for N lines, 1k to 1M
+
+Each benchmark is repeated and the minimum and median times are reported.
+Results can be saved as JSON and compared with a previous run, in which
+case the script exits with status 1 if any median got slower than the
+threshold:
+
+    python benchmark/suite.py --output baseline.json
+    python benchmark/suite.py --baseline baseline.json [--threshold 10]
+"""
+import json
+import optparse
+import os
+import sys
+import threading
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_nvim  # NOQA
+from msgpack import ExtType, packb  # NOQA
+from neovim.api import DecodeHook, Nvim  # NOQA
+from neovim.api.common import walk  # NOQA
+from neovim.api.nvim import ExtHook  # NOQA
+from neovim.msgpack_rpc import AsyncSession, MsgpackStream, Session  # NOQA
+
+
+LINE = b'x' * 80
+BUFFER_SIZES = (1000, 10000, 100000, 1000000)
+
+
+def backends():
+    """Return a dict mapping backend names to available event loop classes."""
+    rv = {}
+    try:
+        from neovim.msgpack_rpc.event_loop.uv import UvEventLoop
+        rv['uv'] = UvEventLoop
+    except ImportError:
+        pass
+    try:
+        from neovim.msgpack_rpc.event_loop.asyncio import AsyncioEventLoop
+        rv['asyncio'] = AsyncioEventLoop
+    except ImportError:
+        pass
+    return rv
+
+
+def connect(loop_class, address):
+    loop = loop_class('socket', address)
+    return Session(AsyncSession(MsgpackStream(loop)))
+
+
+class NullLoop(object):
+
+    """Event loop that discards sent data, for the stream benchmarks."""
+
+    def send(self, data):
+        pass
+
+
+# Benchmarks. Each one is a function that receives the benchmark context
+# and returns a function that runs one iteration, which returns the number
+# of operations it performed.
+
+def bench_pack(ctx):
+    stream = MsgpackStream(NullLoop())
+    msg = [0, 1, 'buffer_set_line_slice', [0, 0, -1, True, True,
+                                           [LINE] * 1000]]
+
+    def run():
+        for _ in range(100):
+            stream.send(msg)
+        return 100
+    return run
+
+
+def bench_unpack(ctx):
+    stream = MsgpackStream(NullLoop())
+    stream._message_cb = lambda msg: None
+    data = packb([1, 1, None, [LINE] * 1000], use_bin_type=True) * 100
+
+    def run():
+        # feed in chunks like the event loop does
+        for i in range(0, len(data), 65536):
+            stream._on_data(data[i:i + 65536])
+        return 100
+    return run
+
+
+def bench_walk_decode(ctx):
+    hook = DecodeHook()
+    obj = [[LINE] * 1000, {b'key': [LINE, 1, 2.0]}]
+
+    def run():
+        for _ in range(100):
+            walk(hook.from_nvim, obj, None, None, None)
+        return 100
+    return run
+
+
+def bench_walk_ext(ctx):
+    from neovim.api import Buffer
+    hook = ExtHook({0: Buffer})
+    obj = [ExtType(0, packb(i)) for i in range(1000)]
+
+    def run():
+        for _ in range(100):
+            walk(hook.from_nvim, obj, None, None, None)
+        return 100
+    return run
+
+
+def bench_request_blocking(ctx):
+    session = ctx['session']
+    session.request('vim_set_var', 'bench', 1)
+
+    def run():
+        for _ in range(1000):
+            session.request('vim_get_var', 'bench')
+        return 1000
+    return run
+
+
+def bench_request_yielding(ctx):
+    session = ctx['session']
+    session.request('vim_set_var', 'bench', 1)
+
+    def on_notification(name, args):
+        for _ in range(1000):
+            session.request('vim_get_var', 'bench')
+        session.stop()
+
+    def run():
+        session.post('bench')
+        session.run(None, on_notification)
+        return 1000
+    return run
+
+
+def bench_post_threads(ctx):
+    session = ctx['session']
+    threads, count = 4, 2500
+    received = [0]
+
+    def post():
+        for _ in range(count):
+            session.post('bench')
+
+    def on_notification(name, args):
+        received[0] += 1
+        if received[0] == threads * count:
+            session.stop()
+
+    def run():
+        received[0] = 0
+        workers = [threading.Thread(target=post) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        session.run(None, on_notification)
+        for worker in workers:
+            worker.join()
+        return threads * count
+    return run
+
+
+def bench_buffer_get(size):
+    def bench(ctx):
+        buf = ctx['nvim'].current.buffer
+        buf[:] = [LINE] * size
+
+        def run():
+            buf[:]
+            return size
+        return run
+    return bench
+
+
+def bench_buffer_set(size):
+    def bench(ctx):
+        buf = ctx['nvim'].current.buffer
+        lines = [LINE] * size
+
+        def run():
+            buf[:] = lines
+            return size
+        return run
+    return bench
+
+
+def benchmarks(sizes):
+    """Return `(name, needs_session, function)` for each benchmark."""
+    rv = [
+        ('pack', False, bench_pack),
+        ('unpack', False, bench_unpack),
+        ('walk_decode', False, bench_walk_decode),
+        ('walk_ext', False, bench_walk_ext),
+        ('request_blocking', True, bench_request_blocking),
+        ('request_yielding', True, bench_request_yielding),
+        ('post_threads', True, bench_post_threads),
+    ]
+    for size in sizes:
+        rv.append(('buffer_get_{0}'.format(size), True,
+                   bench_buffer_get(size)))
+        rv.append(('buffer_set_{0}'.format(size), True,
+                   bench_buffer_set(size)))
+    return rv
+
+
+def measure(run, repeat):
+    times = []
+    ops = 0
+    for _ in range(repeat):
+        t = time.time()
+        ops = run()
+        times.append(time.time() - t)
+    times.sort()
+    median = times[len(times) // 2]
+    return {
+        'min': times[0],
+        'median': median,
+        'ops': ops,
+        'ops_per_sec': ops / max(median, 1e-9),
+    }
+
+
+def run_suite(backend_names, repeat, sizes, only=None):
+    """Run the benchmarks, return results keyed by `<backend>.<name>`."""
+    results = {}
+    address = fake_nvim.start('socket')
+    loops = backends()
+    for backend in backend_names:
+        if backend not in loops:
+            sys.stderr.write('backend {0} not available\n'.format(backend))
+            continue
+        session = connect(loops[backend], address)
+        ctx = {'session': session, 'nvim': Nvim.from_session(session)}
+        for name, needs_session, bench in benchmarks(sizes):
+            if only and name not in only:
+                continue
+            # the stream/walk benchmarks don't depend on the backend
+            key = '{0}.{1}'.format(backend if needs_session else 'local',
+                                   name)
+            if key in results:
+                continue
+            results[key] = measure(bench(ctx), repeat)
+            report(key, results[key])
+    return results
+
+
+def report(key, result):
+    line = '{0:<36} min {1:10.3f}ms  median {2:10.3f}ms  {3:12.0f} ops/s'
+    print(line.format(key, result['min'] * 1000, result['median'] * 1000,
+                      result['ops_per_sec']))
+
+
+def compare(results, baseline, threshold):
+    """Print the change of each median, return the regressed keys."""
+    regressions = []
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        old, new = baseline[key]['median'], results[key]['median']
+        change = (new - old) / max(old, 1e-9) * 100
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(key)
+        print('{0:<36} {1:+8.1f}%{2}'.format(key, change, flag))
+    return regressions
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] [benchmark...]')
+    parser.add_option('--backend', default='all',
+                      help='uv, asyncio or all(default)')
+    parser.add_option('--repeat', type='int', default=5)
+    parser.add_option('--max-lines', type='int', default=BUFFER_SIZES[-1],
+                      help='largest buffer size for the buffer benchmarks')
+    parser.add_option('--output', help='save the results as JSON')
+    parser.add_option('--baseline', help='compare with saved results')
+    parser.add_option('--threshold', type='float', default=10,
+                      help='slowdown(in percent) flagged as a regression')
+    options, only = parser.parse_args()
+    if options.backend == 'all':
+        backend_names = ['uv', 'asyncio']
+    else:
+        backend_names = [options.backend]
+    sizes = [s for s in BUFFER_SIZES if s <= options.max_lines]
+    results = run_suite(backend_names, options.repeat, sizes, only)
+    data = {
+        'python': sys.version.split()[0],
+        'time': time.time(),
+        'results': results,
+    }
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)['results']
+        print('')
+        if compare(results, baseline, options.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
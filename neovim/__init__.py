@@ -12,7 +12,7 @@ from .plugins import PluginHost, ScriptHost
 
 
 __all__ = ('tcp_session', 'socket_session', 'stdio_session', 'spawn_session',
-           'start_host', 'DecodeHook', 'Nvim', 'SessionHook')
+           'start_host', 'setup_logging', 'DecodeHook', 'Nvim', 'SessionHook')
 
 
 def start_host(session=None):
@@ -26,13 +26,59 @@ def start_host(session=None):
     `session`. That means print statements probably won't work as expected
     while this function doesn't return.
 
+    If the `NVIM_PYTHON_WORKERS` environment variable is set, plugins are run
+    in worker processes(see `neovim.plugins.workers.WorkerPool`). It can be
+    'plugin' for one process per plugin module, or the number of processes.
+
+    If the `NVIM_PYTHON_PROFILE` environment variable is set to a directory,
+    request and notification handlers are profiled, and the profiles are
+    written to the directory by the 'python_host_profile' request.
+
+    If `NVIM_PYTHON_HOST_STATS` is set, the 'host_stats' request returns the
+    resources used by each plugin(see `neovim.plugins.stats.PluginStats`).
+    If `NVIM_PYTHON_HOST_STATS_MEMORY` is set, memory allocations are also
+    traced with `tracemalloc`.
+
+    If `NVIM_PYTHON_TRACE` is set, the last msgpack-rpc messages are kept
+    (see `neovim.msgpack_rpc.trace`) and returned by the 'python_host_trace'
+    request.
+
     This function is normally called at program startup and could have been
     defined as a separate executable. It is exposed as a library function for
     testing purposes only.
     """
+    setup_logging()
+    if not session:
+        session = stdio_session()
+    nvim = Nvim.from_session(session)
+    workers = os.environ.get('NVIM_PYTHON_WORKERS', '').strip() or None
+    profile = os.environ.get('NVIM_PYTHON_PROFILE', '').strip() or None
+    memory_stats = bool(
+        os.environ.get('NVIM_PYTHON_HOST_STATS_MEMORY', '').strip())
+    stats = memory_stats or bool(
+        os.environ.get('NVIM_PYTHON_HOST_STATS', '').strip())
+    with PluginHost(nvim, preloaded=[ScriptHost], workers=workers,
+                    profile=profile, stats=stats,
+                    memory_stats=memory_stats) as host:
+        host.run()
+
+
+def setup_logging(name=None):
+    """Setup logging according to environment variables.
+
+    If `NVIM_PYTHON_LOG_FILE` is set, log records are written to it, with the
+    level in `NVIM_PYTHON_LOG_LEVEL`(default INFO). If `name` is passed, the
+    process id and `name` are appended to the file name, so several processes
+    can log at the same time.
+
+    Messages are not logged individually, even at the DEBUG level. Set
+    `NVIM_PYTHON_TRACE` to 'log' to log an event for each message.
+    """
     logger = logging.getLogger(__name__)
     if 'NVIM_PYTHON_LOG_FILE' in os.environ:
         logfile = os.environ['NVIM_PYTHON_LOG_FILE'].strip()
+        if name:
+            logfile = '{0}_{1}_{2}'.format(logfile, name, os.getpid())
         handler = logging.FileHandler(logfile, 'w')
         handler.formatter = logging.Formatter(
             '%(asctime)s [%(levelname)s @ '
@@ -46,11 +92,6 @@ def start_host(session=None):
             if isinstance(l, int):
                 level = l
         logger.setLevel(level)
-    if not session:
-        session = stdio_session()
-    nvim = Nvim.from_session(session)
-    with PluginHost(nvim, preloaded=[ScriptHost]) as host:
-        host.run()
 
 
 # Required for python 2.6
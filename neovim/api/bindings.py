@@ -0,0 +1,110 @@
+"""API bindings built from Nvim metadata.
+
+For every function in `metadata['functions']`, a method is exposed on the
+bindings of its prefix(`vim_`, `buffer_`, `window_` or `tabpage_`), with the
+prefix stripped. For example, `buffer_get_line(buffer, index)` becomes
+`buffer.api.get_line(index)` and `vim_command(str)` becomes
+`nvim.api.command(str)`.
+
+The function table is built once per `Nvim.from_session`(instances created
+with `with_hook` and remote objects share it). Methods check the number of
+arguments against the parameters of the API function before sending the
+request.
+"""
+
+
+__all__ = ('ApiBindings', 'ApiObject')
+
+
+PREFIXES = ('vim', 'buffer', 'window', 'tabpage')
+
+
+class ApiBindings(object):
+
+    """Lazily built function tables for one API metadata version."""
+
+    def __init__(self, metadata):
+        """Initialize with a metadata dict or a function returning it."""
+        self._metadata = metadata
+        self._functions = None
+
+    def functions(self, prefix):
+        """Return a dict mapping method names to `(name, arity)` pairs.
+
+        `arity` is the number of arguments passed to the method, which
+        excludes the remote object for prefixes other than `vim`.
+        """
+        if self._functions is None:
+            metadata = self._metadata
+            if callable(metadata):
+                metadata = metadata()
+            self._functions = _function_tables(metadata['functions'])
+        return self._functions[prefix]
+
+    def bind(self, prefix, session, obj=None):
+        """Return an `ApiObject` for `session` and remote object `obj`."""
+        return ApiObject(self.functions(prefix), session, obj)
+
+
+class ApiObject(object):
+
+    """Bindings of one prefix to a session and remote object.
+
+    Except for the `vim` prefix, the remote object is passed as first
+    argument of every request.
+    """
+
+    __slots__ = ('_functions', '_session', '_obj', '_methods',)
+
+    def __init__(self, functions, session, obj=None):
+        """Bind the `functions` table to `session` and `obj`."""
+        self._functions = functions
+        self._session = session
+        self._obj = obj
+        self._methods = {}
+
+    def __getattr__(self, name):
+        """Return the method calling the API function for `name`."""
+        try:
+            return self._methods[name]
+        except KeyError:
+            pass
+        try:
+            function_name, arity = self._functions[name]
+        except KeyError:
+            raise AttributeError(name)
+        method = self._methods[name] = self._method(name, function_name,
+                                                    arity)
+        return method
+
+    def __dir__(self):
+        """Return the names of the available methods."""
+        return sorted(self._functions)
+
+    def _method(self, name, function_name, arity):
+        session = self._session
+        prefix_args = () if self._obj is None else (self._obj,)
+
+        def method(*args):
+            if len(args) != arity:
+                raise TypeError('{0}() takes {1} arguments ({2} given)'.format(
+                    name, arity, len(args)))
+            return session.request(function_name, *(prefix_args + args))
+        method.__name__ = str(name)
+        method.__doc__ = 'Call `{0}`.'.format(function_name)
+        return method
+
+
+def _function_tables(functions):
+    tables = dict((prefix, {}) for prefix in PREFIXES)
+    for function in functions:
+        name = function['name']
+        prefix = name.split('_', 1)[0]
+        if prefix not in tables or name == prefix:
+            continue
+        arity = len(function['parameters'])
+        if prefix != 'vim':
+            # The first parameter is the object that owns the bindings
+            arity -= 1
+        tables[prefix][name[len(prefix) + 1:]] = (name, arity,)
+    return tables
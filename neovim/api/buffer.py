@@ -14,14 +14,18 @@ class Buffer(Remote):
 
     """A remote Nvim buffer."""
 
-    def __init__(self, session, code_data):
+    _api_prefix = 'buffer'
+
+    def __init__(self, session, code_data, bindings=None):
         """Initialize from session and code_data immutable object.
 
         The `code_data` contains serialization information required for
         msgpack-rpc calls. It must be immutable for Buffer equality to work.
+        `bindings` are the `ApiBindings` used by the `api` property.
         """
         self._session = session
         self.code_data = code_data
+        self._bindings = bindings
         self.vars = RemoteMap(session, 'buffer_get_var', 'buffer_set_var',
                               self)
         self.options = RemoteMap(session, 'buffer_get_option',
@@ -1,6 +1,10 @@
 """Code shared between the API classes."""
 
 
+class NvimError(Exception):
+    pass
+
+
 class Remote(object):
 
     """Base class for Nvim objects(buffer/window/tabpage).
@@ -8,8 +12,27 @@ class Remote(object):
     Each type of object has it's own specialized class with API wrappers around
     the msgpack-rpc session. This implements equality which takes the remote
     object handle into consideration.
+
+    Subclasses set `_api_prefix` to the prefix of the API functions that
+    receive the object as first argument, which are exposed through the `api`
+    bindings(see `neovim.api.bindings`).
     """
 
+    _api_prefix = None
+    _bindings = None
+
+    @property
+    def api(self):
+        """Return the API bindings for this object."""
+        api = self.__dict__.get('_api')
+        if api is None:
+            if self._bindings is None:
+                raise AttributeError(
+                    'api is only available for objects created with bindings')
+            api = self._api = self._bindings.bind(self._api_prefix,
+                                                  self._session, self)
+        return api
+
     def __eq__(self, other):
         """Return True if `self` and `other` are the same object."""
         return (hasattr(other, 'code_data') and
@@ -25,39 +48,147 @@ class RemoteMap(object):
     structures present in Nvim.
 
     It is used to provide a dict-like API to vim variables and options.
+
+    In write-behind mode(see `set_write_behind`), sets and deletes are only
+    recorded locally and sent as a single pipelined batch when the running
+    handler ends or `flush` is called. Until then, reads of the modified keys
+    are served from the local copy.
     """
 
+    _missing = object()
+
     def __init__(self, session, get_method, set_method, self_obj=None):
         """Initialize a RemoteMap with session, getter/setter and self_obj."""
+        self._session = session
+        self._get_method = get_method
+        self._set_method = set_method
+        self._self_obj = self_obj
         self._get = _wrap(session, get_method, self_obj)
         self._set = None
         if set_method:
             self._set = _wrap(session, set_method, self_obj)
+        self._write_behind = False
+        self._dirty = {}
+        self._flush_scheduled = False
 
     def __getitem__(self, key):
         """Return a map value by key."""
+        if key in self._dirty:
+            return self._get_dirty(key)
         return self._get(key)
 
     def __setitem__(self, key, value):
         """Set a map value by key(if the setter was provided)."""
         if not self._set:
             raise TypeError('This dict is read-only')
+        if self._write_behind:
+            self._set_dirty(key, value)
+            return
         self._set(key, value)
 
     def __delitem__(self, key):
         """Delete a map value by associating None with the key."""
         if not self._set:
             raise TypeError('This dict is read-only')
+        if self._write_behind:
+            self._set_dirty(key, None)
+            return
         return self._set(key, None)
 
     def __contains__(self, key):
         """Check if key is present in the map."""
+        if key in self._dirty:
+            return self._dirty[key] is not None
         try:
             self._get(key)
             return True
         except:
             return False
 
+    def get_many(self, keys, default=_missing):
+        """Return a dict with the values of `keys`, using one round trip.
+
+        All requests are pipelined. If `default` is passed, it is used as the
+        value of keys that couldn't be retrieved, otherwise the first error is
+        raised.
+        """
+        rv = {}
+        remote = []
+        for key in keys:
+            if key not in self._dirty:
+                remote.append(key)
+                continue
+            value = self._dirty[key]
+            if value is None:
+                if default is RemoteMap._missing:
+                    raise NvimError('Key not found')
+                value = default
+            rv[key] = value
+        keys = remote
+        calls = [(self._get_method, _args(self._self_obj, key))
+                 for key in keys]
+        for key, (err, value) in zip(keys, self._session.pipeline(calls)):
+            if err:
+                if default is RemoteMap._missing:
+                    raise err
+                value = default
+            rv[key] = value
+        return rv
+
+    def set_many(self, mapping):
+        """Set all key/value pairs of `mapping`, using one round trip.
+
+        All requests are pipelined and processed by Nvim even if some of them
+        fail, in which case the first error is raised after the batch is
+        complete.
+        """
+        if not self._set:
+            raise TypeError('This dict is read-only')
+        if self._write_behind:
+            for key, value in mapping.items():
+                self._set_dirty(key, value)
+            return
+        self._send(mapping)
+
+    def set_write_behind(self, enabled=True):
+        """Enable or disable write-behind mode.
+
+        Pending writes are flushed when write-behind mode is disabled.
+        """
+        if not self._set:
+            raise TypeError('This dict is read-only')
+        self._write_behind = enabled
+        if not enabled:
+            self.flush()
+
+    def flush(self):
+        """Send all pending writes to Nvim in a single round trip."""
+        dirty = self._dirty
+        self._dirty = {}
+        self._flush_scheduled = False
+        if dirty:
+            self._send(dirty)
+
+    def _send(self, mapping):
+        calls = [(self._set_method, _args(self._self_obj, key, value))
+                 for key, value in mapping.items()]
+        for err, _ in self._session.pipeline(calls):
+            if err:
+                raise err
+
+    def _get_dirty(self, key):
+        value = self._dirty[key]
+        if value is None:
+            # Same error as Nvim raises for missing keys
+            raise NvimError('Key not found')
+        return value
+
+    def _set_dirty(self, key, value):
+        # Repeated writes to the same key are collapsed into the last one
+        self._dirty[key] = value
+        if not self._flush_scheduled:
+            self._flush_scheduled = self._session.defer(self.flush)
+
 
 class RemoteSequence(object):
 
@@ -121,6 +252,7 @@ class SessionHook(object):
         - 'request' for requests coming from Nvim
         - 'notification' for notifications coming from Nvim
         - 'out-request' for requests going to Nvim
+        - 'out-notification' for notifications going to Nvim
 
     Whatever is returned from the function is used as a replacement for `obj`.
 
@@ -196,6 +328,7 @@ class SessionFilter(object):
         # recursively
         self._in = self._hook.from_nvim
         self._out = self._hook.to_nvim
+        self._notification_wrappers = {}
 
     def post(self, name, *args):
         """Wrapper for Session.post."""
@@ -212,8 +345,32 @@ class SessionFilter(object):
         return walk(self._in, self._session.request(name, *args), self, name,
                     'out-request')
 
+    def notify(self, name, *args):
+        """Wrapper for Session.notify."""
+        args = walk(self._out, args, self, name, 'out-notification')
+        self._session.notify(name, *args)
+
+    def pipeline(self, calls):
+        """Wrapper for Session.pipeline."""
+        calls = [(name, walk(self._out, args, self, name, 'out-request'),)
+                 for name, args in calls]
+        rv = []
+        for (name, _), (err, result) in zip(calls,
+                                            self._session.pipeline(calls)):
+            rv.append((err, walk(self._in, result, self, name,
+                                 'out-request'),))
+        return rv
+
     def run(self, request_cb, notification_cb):
         """Wrapper for Session.run."""
+        self._session.run(*self.filter_callbacks(request_cb, notification_cb))
+
+    def filter_callbacks(self, request_cb, notification_cb):
+        """Return `request_cb`/`notification_cb` wrapped with the hook.
+
+        The returned pair can be passed to the `run` method of the
+        `wrapped_session`.
+        """
         def filter_request_cb(name, args):
             result = request_cb(self._in(name, self, name, 'request'),
                                 walk(self._in, args, self, name, 'request'))
@@ -223,7 +380,95 @@ class SessionFilter(object):
             notification_cb(self._in(name, self, name, 'notification'),
                             walk(self._in, args, self, name, 'notification'))
 
-        self._session.run(filter_request_cb, filter_notification_cb)
+        return filter_request_cb, filter_notification_cb
+
+    def filter_result(self, name, result):
+        """Apply the hook to `result`, as if returned by a `name` request."""
+        return walk(self._in, result, self, name, 'out-request')
+
+    @property
+    def wrapped_session(self):
+        """Return the Session wrapped by this filter."""
+        return self._session
+
+    @property
+    def metrics(self):
+        """Wrapper for Session.metrics."""
+        return self._session.metrics
+
+    def enable_metrics(self, metrics=None):
+        """Wrapper for Session.enable_metrics."""
+        return self._session.enable_metrics(metrics)
+
+    def disable_metrics(self):
+        """Wrapper for Session.disable_metrics."""
+        self._session.disable_metrics()
+
+    @property
+    def watchdog(self):
+        """Wrapper for Session.watchdog."""
+        return self._session.watchdog
+
+    def enable_watchdog(self, threshold=0.5, report=None):
+        """Wrapper for Session.enable_watchdog."""
+        return self._session.enable_watchdog(threshold, report)
+
+    def disable_watchdog(self):
+        """Wrapper for Session.disable_watchdog."""
+        self._session.disable_watchdog()
+
+    @property
+    def profiler(self):
+        """Wrapper for Session.profiler."""
+        return self._session.profiler
+
+    def enable_profiler(self, profiler=None):
+        """Wrapper for Session.enable_profiler."""
+        return self._session.enable_profiler(profiler)
+
+    def disable_profiler(self):
+        """Wrapper for Session.disable_profiler."""
+        self._session.disable_profiler()
+
+    @property
+    def tracer(self):
+        """Wrapper for Session.tracer."""
+        return self._session.tracer
+
+    def enable_tracer(self, tracer=None):
+        """Wrapper for Session.enable_tracer."""
+        return self._session.enable_tracer(tracer)
+
+    def disable_tracer(self):
+        """Wrapper for Session.disable_tracer."""
+        self._session.disable_tracer()
+
+    def add_notification_handler(self, name, callback):
+        """Wrapper for Session.add_notification_handler."""
+        self._session.add_notification_handler(
+            name, self._filter_notification_handler(name, callback))
+
+    def remove_notification_handler(self, name, callback):
+        """Wrapper for Session.remove_notification_handler."""
+        self._session.remove_notification_handler(
+            name, self._filter_notification_handler(name, callback))
+
+    def _filter_notification_handler(self, name, callback):
+        # Cache the wrapper so it can be found again by
+        # `remove_notification_handler`
+        key = (name, callback,)
+        if key not in self._notification_wrappers:
+            self._notification_wrappers[key] = lambda args: callback(
+                walk(self._in, args, self, name, 'notification'))
+        return self._notification_wrappers[key]
+
+    def defer(self, callback):
+        """Wrapper for Session.defer."""
+        return self._session.defer(callback)
+
+    def handler_data(self):
+        """Wrapper for Session.handler_data."""
+        return self._session.handler_data()
 
     def stop(self):
         """Wrapper for Session.stop."""
@@ -231,15 +476,37 @@ class SessionFilter(object):
 
 
 def walk(fn, obj, *args):
-    """Recursively walk an object graph applying `fn`/`args` to objects."""
-    if type(obj) in [list, tuple]:
-        return list(walk(fn, o, *args) for o in obj)
-    if type(obj) is dict:
+    """Recursively walk an object graph applying `fn`/`args` to objects.
+
+    Lists are only copied if `fn` changed some of their items, so hooks that
+    leave most objects alone(like encoding hooks on lists of lines) don't
+    duplicate large lists. Tuples are always converted to lists.
+    """
+    obj_type = type(obj)
+    if obj_type is list or obj_type is tuple:
+        rv = None
+        for i, o in enumerate(obj):
+            item = walk(fn, o, *args)
+            if rv is not None:
+                rv.append(item)
+            elif item is not o:
+                rv = list(obj[:i])
+                rv.append(item)
+        if rv is None:
+            return obj if obj_type is list else list(obj)
+        return rv
+    if obj_type is dict:
         return dict((walk(fn, k, *args), walk(fn, v, *args)) for k, v in
                     obj.items())
     return fn(obj, *args)
 
 
+def _args(self_obj, *args):
+    if self_obj is not None:
+        return [self_obj] + list(args)
+    return list(args)
+
+
 def _wrap(session, method, self_obj):
     if self_obj is not None:
         return (lambda *args: session.request(method, self_obj, *args))
@@ -0,0 +1,153 @@
+"""Memoization of vimscript expressions evaluated through `vim_eval`."""
+from copy import deepcopy
+
+from ..compat import OrderedDict
+
+
+__all__ = ('EvalCache')
+
+
+class EvalCache(object):
+
+    """LRU cache of `vim_eval` results.
+
+    Expressions are cached until evicted, explicitly invalidated or until one
+    of the autocmd events they were cached with is triggered in Nvim.
+
+    The autocmds that notify this channel of the events are installed in the
+    'nvim-python-eval-cache' augroup, together with the evaluation of each
+    expression that isn't cached(in the same round trip), so invalidation
+    doesn't require any request when looking up a cached expression. If the
+    augroup is cleared(for example by `:autocmd!`), the autocmds are restored
+    by the next evaluation, but expressions cached before that are not
+    invalidated by events until `invalidate` is called.
+
+    The pseudo-event 'changedtick' stands for the events triggered when the
+    text of the current buffer changes or another buffer becomes current
+    (`changedtick_events`). Nvim triggers `TextChanged` once it is back in its
+    main loop, so changes made by the same handler through the API are not
+    seen by cached expressions until `invalidate('changedtick')` is called.
+
+    Values are cached as returned by the wrapped `Session`, before the hooks of
+    any `SessionFilter` are applied, so a single cache can be shared by all
+    `Nvim` instances of a session(see `Nvim.eval_cache`).
+
+    Lists and dicts are copied when returned, so the cached values can't be
+    modified by the caller.
+
+    Only expressions without side effects, whose values depend exclusively on
+    the listed events, should be cached.
+    """
+
+    group = 'nvim-python-eval-cache'
+    notification = 'nvim-python-eval-cache-invalidate'
+    changedtick = 'changedtick'
+    changedtick_events = ('TextChanged', 'TextChangedI', 'BufEnter',)
+
+    def __init__(self, nvim, max_size=256):
+        """Initialize with a Nvim instance and the maximum entry count."""
+        self.max_size = max_size
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'invalidations': 0,
+        }
+        self._session = getattr(nvim.session, 'wrapped_session', nvim.session)
+        self._channel_id = nvim.channel_id
+        self._entries = OrderedDict()
+        self._by_event = {}
+        self._session.add_notification_handler(self.notification,
+                                               self._on_invalidate)
+
+    def __len__(self):
+        """Return the number of cached expressions."""
+        return len(self._entries)
+
+    def eval(self, expr, invalidate_on=None):
+        """Evaluate `expr`, returning the cached value if available."""
+        if expr in self._entries:
+            self.stats['hits'] += 1
+            value, events = self._entries[expr] = self._entries.pop(expr)
+            return _copy(value)
+        self.stats['misses'] += 1
+        events = []
+        for event in self._expand(invalidate_on or ()):
+            if event not in events:
+                events.append(event)
+        calls = []
+        if events:
+            # Restore the group if it was deleted
+            calls.append(('vim_command',
+                          ['augroup {0} | augroup END'.format(self.group)]))
+        for event in events:
+            # Watch the events before evaluating so no change is missed
+            calls.append(('vim_command',
+                          ['autocmd! {0} {1}'.format(self.group, event)]))
+            calls.append(('vim_command', [
+                'autocmd {0} {1} * call rpcnotify({2}, "{3}", "{1}")'.format(
+                    self.group, event, self._channel_id, self.notification)]))
+        calls.append(('vim_eval', [expr]))
+        results = self._session.pipeline(calls)
+        for err, _ in results:
+            if err:
+                raise err
+        result = results[-1][1]
+        self._entries[expr] = (result, events,)
+        for event in events:
+            self._by_event.setdefault(event, set()).add(expr)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+            self.stats['evictions'] += 1
+        return _copy(result)
+
+    def invalidate(self, event=None):
+        """Invalidate expressions cached with `event`, or all of them."""
+        if event is None:
+            exprs = list(self._entries)
+        else:
+            exprs = set()
+            for name in self._expand((event,)):
+                exprs.update(self._by_event.get(name, ()))
+        for expr in exprs:
+            if expr in self._entries:
+                self._remove(expr)
+                self.stats['invalidations'] += 1
+
+    def close(self):
+        """Clear the cache, delete the augroup and stop invalidations."""
+        self._session.remove_notification_handler(self.notification,
+                                                  self._on_invalidate)
+        self._entries.clear()
+        self._by_event.clear()
+        if getattr(self._session, 'eval_cache', None) is self:
+            self._session.eval_cache = None
+        self._session.pipeline([
+            ('vim_command', ['silent! autocmd! {0}'.format(self.group)]),
+            ('vim_command', ['silent! augroup! {0}'.format(self.group)]),
+        ])
+
+    def _expand(self, events):
+        for event in events:
+            if event == self.changedtick:
+                for name in self.changedtick_events:
+                    yield name
+            else:
+                yield event
+
+    def _remove(self, expr):
+        _, events = self._entries.pop(expr)
+        for event in events:
+            self._by_event[event].discard(expr)
+
+    def _on_invalidate(self, args):
+        event = args[0]
+        if isinstance(event, bytes):
+            event = event.decode('utf-8')
+        self.invalidate(event)
+
+
+def _copy(value):
+    if isinstance(value, (list, dict)):
+        return deepcopy(value)
+    return value
@@ -0,0 +1,54 @@
+"""Lazy decoding of Nvim API metadata.
+
+`Nvim.from_session` only needs the type ids from the metadata returned by
+`vim_get_api_info`. The remaining metadata is only decoded(walked with
+`DecodeHook` on python3) when first accessed.
+"""
+import os
+
+from .common import DecodeHook, walk
+from ..compat import IS_PYTHON3
+
+
+__all__ = ('cache_directory', 'lazy_metadata', 'metadata_key')
+
+
+def cache_directory():
+    """Return the directory used for persistent caches, or None.
+
+    The directory is `$NVIM_PYTHON_CACHE_DIR`, falling back to
+    `$XDG_CACHE_HOME/nvim-python` or `~/.cache/nvim-python`. Setting
+    `$NVIM_PYTHON_CACHE_DIR` to an empty string disables persistent caches.
+    """
+    if 'NVIM_PYTHON_CACHE_DIR' in os.environ:
+        return os.environ['NVIM_PYTHON_CACHE_DIR'].strip() or None
+    base = os.environ.get('XDG_CACHE_HOME',
+                          os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'nvim-python')
+
+
+def metadata_key(metadata, name):
+    """Return `metadata[name]` whether or not `metadata` was decoded."""
+    if IS_PYTHON3 and name.encode('utf-8') in metadata:
+        return metadata[name.encode('utf-8')]
+    return metadata[name]
+
+
+def lazy_metadata(raw_metadata):
+    """Return a function that returns the decoded `raw_metadata`.
+
+    The metadata is decoded when the function is first called, later calls
+    return the same metadata.
+    """
+    loaded = []
+
+    def load():
+        if not loaded:
+            metadata = raw_metadata
+            if IS_PYTHON3:
+                hook = DecodeHook()
+                metadata = walk(hook.from_nvim, raw_metadata, None, None,
+                                None)
+            loaded.append(metadata)
+        return loaded[0]
+    return load
@@ -1,12 +1,15 @@
 """Main Nvim interface."""
 import os
+from collections import namedtuple
 
 from msgpack import ExtType
 
+from .bindings import ApiBindings
 from .buffer import Buffer
-from .common import (DecodeHook, Remote, RemoteMap, RemoteSequence,
-                     SessionFilter, SessionHook, walk)
-from ..compat import IS_PYTHON3
+from .common import (NvimError, Remote, RemoteMap, RemoteSequence,
+                     SessionFilter, SessionHook)
+from .eval_cache import EvalCache
+from .metadata import lazy_metadata, metadata_key
 from .tabpage import Tabpage
 from .window import Window
 
@@ -46,24 +49,32 @@ class Nvim(object):
         session.error_wrapper = lambda e: NvimError(e[1])
         channel_id, metadata = session.request('vim_get_api_info')
 
-        if IS_PYTHON3:
-            hook = DecodeHook()
-            # decode all metadata strings for python3
-            metadata = walk(hook.from_nvim, metadata, None, None, None)
-
+        # Only the type ids are needed now, the remaining metadata is decoded
+        # lazily(see `lazy_metadata`)
+        raw_types = metadata_key(metadata, 'types')
         types = {
-            metadata['types']['Buffer']['id']: Buffer,
-            metadata['types']['Window']['id']: Window,
-            metadata['types']['Tabpage']['id']: Tabpage,
+            metadata_key(metadata_key(raw_types, 'Buffer'), 'id'): Buffer,
+            metadata_key(metadata_key(raw_types, 'Window'), 'id'): Window,
+            metadata_key(metadata_key(raw_types, 'Tabpage'), 'id'): Tabpage,
         }
+        metadata = lazy_metadata(metadata)
+        # Shared by all instances and remote objects of the session
+        bindings = ApiBindings(metadata)
+
+        return cls(session, channel_id, metadata, bindings).with_hook(
+            ExtHook(types, bindings))
 
-        return cls(session, channel_id, metadata).with_hook(ExtHook(types))
+    def __init__(self, session, channel_id, metadata, bindings=None):
+        """Initialize a new Nvim instance. This method is module-private.
 
-    def __init__(self, session, channel_id, metadata):
-        """Initialize a new Nvim instance. This method is module-private."""
+        `metadata` may be a function returning the metadata dict, in which case
+        it is only called when the `metadata` property is first accessed.
+        """
         self._session = session
         self.channel_id = channel_id
-        self.metadata = metadata
+        self._metadata = metadata
+        self._bindings = bindings or ApiBindings(metadata)
+        self._api = None
         self.vars = RemoteMap(session, 'vim_get_var', 'vim_set_var')
         self.vvars = RemoteMap(session, 'vim_get_vvar', None)
         self.options = RemoteMap(session, 'vim_get_option', 'vim_set_option')
@@ -76,7 +87,30 @@ class Nvim(object):
     def with_hook(self, hook):
         """Initialize a new Nvim instance."""
         return Nvim(SessionFilter(self.session, hook), self.channel_id,
-                    self.metadata)
+                    self._metadata, self._bindings)
+
+    @property
+    def metadata(self):
+        """Return the API metadata, decoding it on first access."""
+        if callable(self._metadata):
+            self._metadata = self._metadata()
+        return self._metadata
+
+    @property
+    def api(self):
+        """Return the bindings of all `vim_*` API functions.
+
+        For example, `nvim.api.get_current_line()` calls
+        `vim_get_current_line`. See `neovim.api.bindings`.
+        """
+        if self._api is None:
+            self._api = self._bindings.bind('vim', self._session)
+        return self._api
+
+    @property
+    def bindings(self):
+        """Return the `ApiBindings` shared by the instances of the session."""
+        return self._bindings
 
     @property
     def session(self):
@@ -99,10 +133,52 @@ class Nvim(object):
         """Execute a single ex command."""
         return self._session.request('vim_command', string)
 
+    def commands(self, strings):
+        """Execute a sequence of ex commands in a single round trip.
+
+        All commands are executed even if some fail. Return a list with the
+        error(or None) of each command.
+        """
+        return [err for err, _ in self._session.pipeline(
+            [('vim_command', [string]) for string in strings])]
+
+    def batch(self):
+        """Return a `Batch` for pipelining requests inside a `with` block.
+
+        >>> with nvim.batch() as batch:       # doctest: +SKIP
+        ...     batch.command('set number')
+        ...     batch.request('vim_set_var', 'foo', 1)
+        >>> batch.errors                      # doctest: +SKIP
+        []
+        """
+        return Batch(self._session)
+
     def eval(self, string):
         """Evaluate a vimscript expression."""
         return self._session.request('vim_eval', string)
 
+    def eval_cached(self, string, invalidate_on=None):
+        """Evaluate a vimscript expression, memoizing the result.
+
+        The result is served locally until one of the autocmd events in
+        `invalidate_on` is triggered(see `EvalCache`), so `string` must be
+        free of side effects.
+        """
+        rv = self.eval_cache.eval(string, invalidate_on)
+        return self._session.filter_result('vim_eval', rv)
+
+    @property
+    def eval_cache(self):
+        """Return the `EvalCache` used by `eval_cached`.
+
+        The cache is shared by all `Nvim` instances of the session and created
+        on first use. `EvalCache.close` removes it.
+        """
+        session = getattr(self._session, 'wrapped_session', self._session)
+        if getattr(session, 'eval_cache', None) is None:
+            session.eval_cache = EvalCache(self)
+        return session.eval_cache
+
     def strwidth(self, string):
         """Return the number of display cells `string` occupies.
 
@@ -176,6 +252,59 @@ class Nvim(object):
         return self._session.request('vim_err_write', msg)
 
 
+class Batch(object):
+
+    """Queue of requests sent to Nvim in a single round trip.
+
+    Requests are queued by `request` and `command` and sent, with all
+    responses collected, when `send` is called or the `with` block exits
+    normally. A failed request doesn't prevent the others from running.
+    """
+
+    def __init__(self, session):
+        """Initialize with a Session or SessionFilter."""
+        self._session = session
+        self._calls = []
+        self.results = []
+
+    def __enter__(self):
+        """Return the batch for queueing requests."""
+        return self
+
+    def __exit__(self, type, value, traceback):
+        """Send the queued requests unless the block raised an exception."""
+        if type is None:
+            self.send()
+
+    def request(self, method, *args):
+        """Queue a request for `method` with `args`."""
+        self._calls.append((method, args,))
+
+    def command(self, string):
+        """Queue a single ex command."""
+        self.request('vim_command', string)
+
+    def send(self):
+        """Send all queued requests and wait for the responses.
+
+        Return a list of `(error, result)` pairs in the order the requests
+        were queued, which is also stored in the `results` attribute.
+        """
+        calls = self._calls
+        self._calls = []
+        self.results = self._session.pipeline(calls)
+        return self.results
+
+    @property
+    def errors(self):
+        """Return the errors of the last `send`."""
+        return [err for err, _ in self.results if err]
+
+
+CurrentSnapshot = namedtuple('CurrentSnapshot',
+                             'line buffer window tabpage')
+
+
 class Current(object):
 
     """Helper class for emulating vim.current from python-vim."""
@@ -183,6 +312,43 @@ class Current(object):
     def __init__(self, session):
         self._session = session
 
+    def snapshot(self):
+        """Fetch all current-* values in a single round trip.
+
+        Return an immutable `CurrentSnapshot` with the `line`, `buffer`,
+        `window` and `tabpage` fields. The values are not updated if Nvim
+        state changes after the snapshot was taken.
+        """
+        calls = [('vim_get_current_line', []),
+                 ('vim_get_current_buffer', []),
+                 ('vim_get_current_window', []),
+                 ('vim_get_current_tabpage', [])]
+        values = []
+        for err, rv in self._session.pipeline(calls):
+            if err:
+                raise err
+            values.append(rv)
+        return CurrentSnapshot(*values)
+
+    @property
+    def attached(self):
+        """Return the snapshot attached to the running handler, if any.
+
+        Plugin hosts may take a snapshot before invoking notification
+        handlers, which can then read it without any extra round trip. The
+        snapshot is attached to the session, so it is seen by all `Nvim`
+        instances created with `with_hook`.
+        """
+        return self._session.handler_data().get('current_snapshot')
+
+    def attach(self, snapshot):
+        """Attach `snapshot` to the running handler."""
+        self._session.handler_data()['current_snapshot'] = snapshot
+
+    def detach(self):
+        """Remove the snapshot attached to the running handler."""
+        self._session.handler_data().pop('current_snapshot', None)
+
     @property
     def line(self):
         return self._session.request('vim_get_current_line')
@@ -217,22 +383,19 @@ class Current(object):
 
 
 class ExtHook(SessionHook):
-    def __init__(self, types):
+    def __init__(self, types, bindings=None):
         self.types = types
+        self.bindings = bindings
         super(ExtHook, self).__init__(from_nvim=self.from_ext,
                                       to_nvim=self.to_ext)
 
     def from_ext(self, obj, session, method, kind):
         if type(obj) is ExtType:
             cls = self.types[obj.code]
-            return cls(session, (obj.code, obj.data))
+            return cls(session, (obj.code, obj.data), self.bindings)
         return obj
 
     def to_ext(self, obj, session, method, kind):
         if isinstance(obj, Remote):
             return ExtType(*obj.code_data)
         return obj
-
-
-class NvimError(Exception):
-    pass
@@ -9,14 +9,18 @@ class Tabpage(Remote):
 
     """A remote Nvim tabpage."""
 
-    def __init__(self, session, code_data):
+    _api_prefix = 'tabpage'
+
+    def __init__(self, session, code_data, bindings=None):
         """Initialize from session and code_data immutable object.
 
         The `code_data` contains serialization information required for
         msgpack-rpc calls. It must be immutable for Tabpage equality to work.
+        `bindings` are the `ApiBindings` used by the `api` property.
         """
         self._session = session
         self.code_data = code_data
+        self._bindings = bindings
         self.windows = RemoteSequence(session, 'tabpage_get_windows', self)
         self.vars = RemoteMap(session, 'tabpage_get_var', 'tabpage_set_var',
                               self)
@@ -9,14 +9,18 @@ class Window(Remote):
 
     """A remote Nvim window."""
 
-    def __init__(self, session, code_data):
+    _api_prefix = 'window'
+
+    def __init__(self, session, code_data, bindings=None):
         """Initialize from session and code_data immutable object.
 
         The `code_data` contains serialization information required for
         msgpack-rpc calls. It must be immutable for Window equality to work.
+        `bindings` are the `ApiBindings` used by the `api` property.
         """
         self._session = session
         self.code_data = code_data
+        self._bindings = bindings
         self.vars = RemoteMap(session, 'window_get_var', 'window_set_var',
                               self)
         self.options = RemoteMap(session, 'window_get_option',
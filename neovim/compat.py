@@ -3,4 +3,14 @@
 import sys
 
 
+__all__ = ('IS_PYTHON3', 'OrderedDict')
+
+
 IS_PYTHON3 = sys.version_info >= (3, 0)
+
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    # python 2.6
+    from ordereddict import OrderedDict
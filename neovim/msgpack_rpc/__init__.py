@@ -4,23 +4,47 @@ This package implements a msgpack-rpc client. While it was designed for
 handling some Nvim particularities(server->client requests for example), the
 code here should work with other msgpack-rpc servers.
 """
+import os
+
 from .async_session import AsyncSession
 from .event_loop import EventLoop
-from .msgpack_stream import MsgpackStream
+from .msgpack_stream import DEFAULT_MAX_BUFFER_SIZE, MsgpackStream
+from .recorder import recorder_from_environment
 from .session import Session
+from .trace import tracer_from_environment
 
 
 __all__ = ('tcp_session', 'socket_session', 'stdio_session', 'spawn_session')
 
 
 def session(transport_type='stdio', *args, **kwargs):
+    # maximum size of received messages and size of the reads, in bytes
+    max_buffer_size = kwargs.pop(
+        'max_buffer_size',
+        _environ_int('NVIM_PYTHON_MAX_BUFFER_SIZE', DEFAULT_MAX_BUFFER_SIZE))
+    read_size = _environ_int('NVIM_PYTHON_READ_SIZE', None)
+    if read_size:
+        kwargs.setdefault('read_size', read_size)
     loop = EventLoop(transport_type, *args, **kwargs)
-    msgpack_stream = MsgpackStream(loop)
+    msgpack_stream = MsgpackStream(loop, max_buffer_size)
+    msgpack_stream.set_recorder(recorder_from_environment())
     async_session = AsyncSession(msgpack_stream)
+    async_session.set_tracer(tracer_from_environment())
     session = Session(async_session)
+    if os.environ.get('NVIM_PYTHON_METRICS', '').strip():
+        session.enable_metrics()
+    watchdog = os.environ.get('NVIM_PYTHON_WATCHDOG', '').strip()
+    if watchdog:
+        # threshold in milliseconds
+        session.enable_watchdog(float(watchdog) / 1000)
     return session
 
 
+def _environ_int(name, default):
+    value = os.environ.get(name, '').strip()
+    return int(value) if value else default
+
+
 def tcp_session(address, port=7450):
     """Create a msgpack-rpc session from a tcp address/port."""
     return session('tcp', address, port)
@@ -22,6 +22,9 @@ class AsyncSession(object):
         self._next_request_id = 1
         self._pending_requests = {}
         self._request_cb = self._notification_cb = None
+        self._metrics = None
+        self._watchdog = None
+        self._tracer = None
         self._handlers = {
             0: self._on_request,
             1: self._on_response,
@@ -48,9 +51,40 @@ class AsyncSession(object):
         """
         request_id = self._next_request_id
         self._next_request_id = request_id + 1
+        if self._metrics is not None:
+            response_cb = self._metrics.time_request(method, response_cb)
+            self._metrics.add_pending_requests(len(self._pending_requests) + 1)
         self._msgpack_stream.send([0, request_id, method, args])
         self._pending_requests[request_id] = response_cb
 
+    def notify(self, method, args):
+        """Send a msgpack-rpc notification to Nvim.
+
+        Unlike requests, notifications are not answered, so there's nothing
+        to wait for. Errors are only reported by Nvim itself.
+        """
+        if self._metrics is not None:
+            self._metrics.add_notification('out-notification', method)
+        self._msgpack_stream.send([2, method, args])
+
+    def expect(self, response_cb):
+        """Reserve a request id for a response produced locally.
+
+        No request is sent. `response_cb` is called like a response callback
+        of `request` once `post_response` is called with the returned id.
+        """
+        request_id = self._next_request_id
+        self._next_request_id = request_id + 1
+        self._pending_requests[request_id] = response_cb
+        return request_id
+
+    def post_response(self, request_id, error, result):
+        """Post the response for an id reserved with `expect`.
+
+        Like `post`, this can be called from other threads.
+        """
+        self._msgpack_stream.post((1, request_id, error, result,))
+
     def run(self, request_cb, notification_cb):
         """Run the event loop to receive requests and notifications from Nvim.
 
@@ -68,36 +102,69 @@ class AsyncSession(object):
         """Stop the event loop."""
         self._msgpack_stream.stop()
 
+    def set_metrics(self, metrics):
+        """Record messages handled by this session in `metrics`.
+
+        The metrics are also passed to the msgpack stream. Pass None to
+        disable recording.
+        """
+        self._metrics = metrics
+        self._msgpack_stream.set_metrics(metrics)
+
+    def set_watchdog(self, watchdog):
+        """Report messages dispatched to `watchdog`(None to disable)."""
+        self._watchdog = watchdog
+
+    def set_tracer(self, tracer):
+        """Add the messages of this session to a `Tracer`.
+
+        The tracer is also passed to the msgpack stream, which adds the
+        message events. Pass None to disable tracing.
+        """
+        self._tracer = tracer
+        self._msgpack_stream.set_tracer(tracer)
+
     def _on_message(self, msg):
+        metrics, watchdog = self._metrics, self._watchdog
+        if metrics is not None:
+            started = metrics.clock()
+        if watchdog is not None:
+            watchdog.enter(msg)
         try:
             self._handlers.get(msg[0], self._on_invalid_message)(msg)
         except Exception:
             err_str = format_exc(5)
             warn(err_str)
             self._msgpack_stream.send([1, 0, err_str, None])
+        finally:
+            if watchdog is not None:
+                watchdog.leave()
+            if metrics is not None:
+                metrics.loop_lag.add(metrics.clock() - started)
 
     def _on_request(self, msg):
         # request
         #   - msg[1]: id
         #   - msg[2]: method name
         #   - msg[3]: arguments
-        debug('received request: %s, %s', msg[2], msg[3])
-        self._request_cb(msg[2], msg[3], Response(self._msgpack_stream,
-                                                  msg[1]))
+        response = Response(self._msgpack_stream, msg[1])
+        if self._metrics is not None:
+            response.time(self._metrics, msg[2])
+        self._request_cb(msg[2], msg[3], response)
 
     def _on_response(self, msg):
         # response to a previous request:
         #   - msg[1]: the id
         #   - msg[2]: error(if any)
         #   - msg[3]: result(if not errored)
-        debug('received response: %s, %s', msg[2], msg[3])
         self._pending_requests.pop(msg[1])(msg[2], msg[3])
 
     def _on_notification(self, msg):
         # notification/event
         #   - msg[1]: event name
         #   - msg[2]: arguments
-        debug('received notification: %s, %s', msg[1], msg[2])
+        if self._metrics is not None:
+            self._metrics.add_notification('notification', msg[1])
         self._notification_cb(msg[1], msg[2])
 
     def _on_invalid_message(self, msg):
@@ -118,6 +185,11 @@ class Response(object):
         """Initialize the Response instance."""
         self._msgpack_stream = msgpack_stream
         self._request_id = request_id
+        self._timing = None
+
+    def time(self, metrics, method):
+        """Record the time until the response is sent in `metrics`."""
+        self._timing = (metrics, method, metrics.clock(),)
 
     def send(self, value, error=False):
         """Send the response.
@@ -128,5 +200,9 @@ class Response(object):
             resp = [1, self._request_id, value, None]
         else:
             resp = [1, self._request_id, None, value]
-        debug('sending response to request %d: %s', self._request_id, resp)
+        if self._timing:
+            metrics, method, started = self._timing
+            metrics.add_latency('request', method, metrics.clock() - started)
+            if error:
+                metrics.errors += 1
         self._msgpack_stream.send(resp)
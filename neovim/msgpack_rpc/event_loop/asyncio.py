@@ -24,6 +24,12 @@ except ImportError:
 from .base import BaseEventLoop
 
 
+# With `BufferedProtocol`(python 3.7+), socket transports read into a buffer
+# provided by the protocol instead of allocating a new bytes object for each
+# read
+Protocol = getattr(asyncio, 'BufferedProtocol', asyncio.Protocol)
+
+
 loop_cls = asyncio.SelectorEventLoop
 if os.name == 'nt':
     # On windows use ProactorEventLoop which support pipes and is backed by the
@@ -31,10 +37,14 @@ if os.name == 'nt':
     loop_cls = asyncio.ProactorEventLoop
 
 
-class AsyncioEventLoop(BaseEventLoop, asyncio.Protocol,
+class AsyncioEventLoop(BaseEventLoop, Protocol,
                        asyncio.SubprocessProtocol):
 
-    """`BaseEventLoop` subclass that uses `asyncio` as a backend."""
+    """`BaseEventLoop` subclass that uses `asyncio` as a backend.
+
+    Data read into the `read_size` buffer is passed to the data callback as
+    a memoryview, which is only valid until the callback returns.
+    """
 
     def connection_made(self, transport):
         """Used to signal `asyncio.Protocol` of a successful connection."""
@@ -51,7 +61,16 @@ class AsyncioEventLoop(BaseEventLoop, asyncio.Protocol,
         if self._on_data:
             self._on_data(data)
             return
-        self._queued_data.append(data)
+        # copy, `data` may be a view of the read buffer
+        self._queued_data.append(bytes(data))
+
+    def get_buffer(self, sizehint):
+        """Used by `asyncio.BufferedProtocol` to get the read buffer."""
+        return self._read_view
+
+    def buffer_updated(self, nbytes):
+        """Used to signal `asyncio.BufferedProtocol` of incoming data."""
+        self.data_received(self._read_view[:nbytes])
 
     def pipe_connection_lost(self, exc):
         """Used to signal `asyncio.SubprocessProtocol` of a lost connection."""
@@ -73,6 +92,7 @@ class AsyncioEventLoop(BaseEventLoop, asyncio.Protocol,
     def _init(self):
         self._loop = loop_cls()
         self._queued_data = deque()
+        self._read_view = memoryview(bytearray(self.read_size))
         self._fact = lambda: self
 
     def _connect_tcp(self, address, port):
@@ -14,6 +14,10 @@ debug, info, warn = (logger.debug, logger.info, logger.warn,)
 default_int_handler = signal.getsignal(signal.SIGINT)
 
 
+# Size of the reads done by backends that read into a preallocated buffer
+DEFAULT_READ_SIZE = 256 * 1024
+
+
 class BaseEventLoop(object):
 
     """Abstract base class for all event loops.
@@ -51,10 +55,10 @@ class BaseEventLoop(object):
     - `_teardown_signals()`: Removes signal listeners set by `_setup_signals`
     """
 
-    def __init__(self, transport_type, *args):
+    def __init__(self, transport_type, *args, **kwargs):
         """Initialize and connect the event loop instance.
 
-        The only arguments are the transport type and transport-specific
+        The arguments are the transport type and transport-specific
         configuration, like this:
 
         >>> BaseEventLoop('tcp', '127.0.0.1', 7450)
@@ -77,8 +81,14 @@ class BaseEventLoop(object):
         This calls the implementation-specific initialization
         `_init`, one of the `_connect_*` methods(based on `transport_type`)
         and `_start_reading()`
+
+        The `read_size` keyword argument sets the size of the buffer used by
+        backends that read into a preallocated buffer(currently asyncio on
+        python 3.7+), others read in chunks of the size chosen by the event
+        loop library.
         """
         self._transport_type = transport_type
+        self.read_size = kwargs.get('read_size', DEFAULT_READ_SIZE)
         self._signames = dict((k, v) for v, k in signal.__dict__.items()
                               if v.startswith('SIG'))
         self._on_data = None
@@ -109,13 +119,10 @@ class BaseEventLoop(object):
 
     def send(self, data):
         """Queue `data` for sending to Nvim."""
-        debug("Sending '%s'", data)
         self._send(data)
 
     def interrupt(self):
         """Stop the event loop from another thread."""
-        debug('Interrupted event loop from thread %s',
-              threading.current_thread())
         self._interrupt()
 
     def run(self, data_cb):
@@ -130,18 +137,20 @@ class BaseEventLoop(object):
                 self._error = None
             raise err
         self._on_data = data_cb
-        self._setup_signals([signal.SIGINT, signal.SIGTERM])
-        debug('Entering event loop')
+        # Signal handlers can only be installed by the main thread, loops
+        # running in other threads(eg: plugin host workers) don't handle them
+        main_thread = _in_main_thread()
+        if main_thread:
+            self._setup_signals([signal.SIGINT, signal.SIGTERM])
         self._run()
-        debug('Exited event loop')
-        self._teardown_signals()
-        signal.signal(signal.SIGINT, default_int_handler)
+        if main_thread:
+            self._teardown_signals()
+            signal.signal(signal.SIGINT, default_int_handler)
         self._on_data = None
 
     def stop(self):
         """Stop the event loop."""
         self._stop()
-        debug('Stopped event loop')
 
     def _on_signal(self, signum):
         msg = 'Received {0}'.format(self._signames[signum])
@@ -164,3 +173,10 @@ class BaseEventLoop(object):
 
     def _on_interrupt(self):
         self.stop()
+
+
+def _in_main_thread():
+    if hasattr(threading, 'main_thread'):
+        return threading.current_thread() is threading.main_thread()
+    # python2
+    return isinstance(threading.current_thread(), threading._MainThread)
@@ -0,0 +1,44 @@
+"""Dispatch of greenlet switch events to several tracers.
+
+`greenlet.settrace` installs a single trace function, and each function that
+replaces it can only restore the previous one, which drops any tracer
+installed in between if they are not removed in the reverse order. Tracers
+added with `add_tracer`(eg: the handler `Profiler` and the plugin host
+`PluginStats`) share a single trace function and can be removed in any
+order.
+"""
+import greenlet
+
+
+__all__ = ('add_tracer', 'remove_tracer')
+
+
+_tracers = []
+# trace function installed before the first tracer was added
+_previous = None
+
+
+def add_tracer(tracer):
+    """Call `tracer(event, args)` for every greenlet switch or throw."""
+    global _previous
+    if not _tracers:
+        _previous = greenlet.settrace(_trace)
+    _tracers.append(tracer)
+
+
+def remove_tracer(tracer):
+    """Stop calling a tracer added with `add_tracer`."""
+    global _previous
+    if tracer not in _tracers:
+        return
+    _tracers.remove(tracer)
+    if not _tracers:
+        greenlet.settrace(_previous)
+        _previous = None
+
+
+def _trace(event, args):
+    for tracer in tuple(_tracers):
+        tracer(event, args)
+    if _previous is not None:
+        _previous(event, args)
@@ -0,0 +1,185 @@
+"""Instrumentation of the msgpack-rpc layers.
+
+Metrics are disabled by default. When enabled with `Session.enable_metrics`
+(or the `NVIM_PYTHON_METRICS` environment variable), the session layers
+record:
+
+- per-method latency histograms of requests sent to Nvim('out-request') and
+  of requests handled for Nvim('request'), measured until the response is
+  sent
+- per-method counts of notifications in both directions
+- bytes read from and written to the `MsgpackStream`
+- the current and maximum number of requests waiting for a response, and
+  the length of the internal message queues
+- a histogram of the time taken to dispatch each message, during which the
+  event loop is blocked('loop_lag')
+
+When disabled, each layer only checks a `None` attribute per message.
+"""
+import bisect
+import json
+import time
+
+
+__all__ = ('Metrics', 'Histogram')
+
+
+# Upper bounds(in seconds) of the latency histogram buckets. The last bucket
+# counts everything above one minute.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1, 2.5, 5, 10, 60)
+
+
+class Histogram(object):
+
+    """Latency histogram with fixed, roughly logarithmic buckets."""
+
+    __slots__ = ('count', 'total', 'min', 'max', 'buckets')
+
+    def __init__(self):
+        """Initialize an empty histogram."""
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def add(self, value):
+        """Record a latency of `value` seconds."""
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.buckets[bisect.bisect_left(BUCKETS, value)] += 1
+
+    def percentile(self, p):
+        """Return the upper bound of the bucket containing percentile `p`."""
+        if not self.count:
+            return None
+        rank = self.count * p / 100.0
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        """Return the histogram as a JSON-serializable dict."""
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': dict((str(bound), count) for bound, count in
+                            zip(BUCKETS + ('inf',), self.buckets) if count),
+        }
+
+
+class Metrics(object):
+
+    """Counters and histograms collected by the msgpack-rpc layers."""
+
+    def __init__(self, clock=time.time):
+        """Initialize empty metrics, using `clock` for timestamps."""
+        self.clock = clock
+        self.gauges = {}
+        self.reset()
+
+    def reset(self):
+        """Clear all recorded values."""
+        self.started = self.clock()
+        self.latency = {}
+        self.notifications = {}
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.messages_in = 0
+        self.messages_out = 0
+        self.max_pending_requests = 0
+        self.loop_lag = Histogram()
+
+    def add_latency(self, kind, method, seconds):
+        """Record the latency of a request of `kind` to `method`."""
+        key = (kind, _name(method),)
+        histogram = self.latency.get(key)
+        if histogram is None:
+            histogram = self.latency[key] = Histogram()
+        histogram.add(seconds)
+
+    def time_request(self, method, response_cb):
+        """Wrap the `response_cb` of a request to `method` to measure it."""
+        started = self.clock()
+
+        def timed_response_cb(err, rv):
+            self.add_latency('out-request', method, self.clock() - started)
+            if err:
+                self.errors += 1
+            response_cb(err, rv)
+        return timed_response_cb
+
+    def add_notification(self, kind, method):
+        """Count a notification of `kind` to `method`."""
+        key = (kind, _name(method),)
+        self.notifications[key] = self.notifications.get(key, 0) + 1
+
+    def add_pending_requests(self, count):
+        """Record the number of requests waiting for a response."""
+        if count > self.max_pending_requests:
+            self.max_pending_requests = count
+
+    def to_dict(self):
+        """Return a JSON-serializable snapshot of the metrics.
+
+        Rates are averages(per second) since the metrics were reset, and
+        `gauges` has the current value of each registered gauge.
+        """
+        elapsed = max(self.clock() - self.started, 1e-9)
+        methods = {}
+        for (kind, method), histogram in self.latency.items():
+            entry = histogram.to_dict()
+            entry['rate'] = histogram.count / elapsed
+            methods.setdefault(kind, {})[method] = entry
+        for (kind, method), count in self.notifications.items():
+            methods.setdefault(kind, {})[method] = {
+                'count': count,
+                'rate': count / elapsed,
+            }
+        gauges = dict((name, gauge()) for name, gauge in self.gauges.items())
+        gauges['max_pending_requests'] = self.max_pending_requests
+        return {
+            'elapsed': elapsed,
+            'errors': self.errors,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'messages_in': self.messages_in,
+            'messages_out': self.messages_out,
+            'bytes_in_rate': self.bytes_in / elapsed,
+            'bytes_out_rate': self.bytes_out / elapsed,
+            'gauges': gauges,
+            'methods': methods,
+            'loop_lag': self.loop_lag.to_dict(),
+        }
+
+    def dump(self, f=None, **kwargs):
+        """Dump the metrics as JSON to the file object `f`.
+
+        If `f` is None, return the JSON string instead. Extra keyword
+        arguments are passed to `json.dumps`.
+        """
+        data = json.dumps(self.to_dict(), sort_keys=True, **kwargs)
+        if f is None:
+            return data
+        f.write(data)
+
+
+def _name(method):
+    if isinstance(method, bytes) and not isinstance(method, str):
+        return method.decode('utf-8', 'replace')
+    return method
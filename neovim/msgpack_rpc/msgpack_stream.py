@@ -2,29 +2,58 @@
 import logging
 from collections import deque
 
-from msgpack import Packer, Unpacker
+from msgpack import BufferFull, Packer, Unpacker
+
+from .recorder import IN, OUT
 
 
 logger = logging.getLogger(__name__)
 debug, info, warn = (logger.debug, logger.info, logger.warn,)
 
 
+# Maximum size of a message received from Nvim. Messages are buffered until
+# they can be unpacked, so this bounds the memory used by a single message.
+DEFAULT_MAX_BUFFER_SIZE = 256 * 1024 * 1024
+
+# Messages whose arguments(or result) are or contain an array with at least
+# `STREAM_MIN_ITEMS` items(like the lines of a buffer) are packed and sent in
+# chunks of about `STREAM_CHUNK_SIZE` bytes
+STREAM_MIN_ITEMS = 4096
+STREAM_CHUNK_SIZE = 256 * 1024
+
+_ARRAYS = (list, tuple,)
+
+
 class MsgpackStream(object):
 
     """Two-way msgpack stream that wraps a event loop byte stream.
 
     This wraps the event loop interface for reading/writing bytes and
     exposes an interface for reading/writing msgpack documents.
+
+    Received data is buffered until complete messages can be unpacked. If a
+    message doesn't fit in `max_buffer_size` bytes(0 for the msgpack limit),
+    or the data can't be unpacked, the stream is unusable: the event loop is
+    stopped and `run` raises an `IOError` from then on.
     """
 
-    def __init__(self, event_loop):
+    def __init__(self, event_loop, max_buffer_size=DEFAULT_MAX_BUFFER_SIZE):
         """Wrap `event_loop` on a msgpack-aware interface."""
         self._event_loop = event_loop
         self._posted = deque()
         self._packer = Packer(use_bin_type=True)
-        self._unpacker = Unpacker()
+        self.max_buffer_size = max_buffer_size
+        self._unpacker = Unpacker(max_buffer_size=max_buffer_size)
+        # `Unpacker.tell`(msgpack 0.5+) is used to find the size of messages
+        self._tell = getattr(self._unpacker, 'tell', None)
+        self._received = 0
+        self._message_offset = 0
+        self._error = None
         self._message_cb = None
         self._stopped = False
+        self._metrics = None
+        self._recorder = None
+        self._tracer = None
 
     def post(self, msg):
         """Post `msg` to the read queue of the `MsgpackStream` instance.
@@ -36,9 +65,44 @@ class MsgpackStream(object):
         self._event_loop.interrupt()
 
     def send(self, msg):
-        """Queue `msg` for sending to Nvim."""
-        debug('sent %s', msg)
-        self._event_loop.send(self._packer.pack(msg))
+        """Queue `msg` for sending to Nvim.
+
+        Messages with large arrays are sent in chunks, so the whole message
+        is never packed in a single buffer.
+        """
+        if _has_large_array(msg[-1]):
+            size = self._send_chunks(msg)
+        else:
+            data = self._packer.pack(msg)
+            size = len(data)
+            self._write(data)
+        if self._metrics is not None:
+            self._metrics.bytes_out += size
+            self._metrics.messages_out += 1
+        if self._tracer is not None:
+            self._tracer.message(OUT, msg, size)
+
+    def _write(self, data):
+        if self._recorder is not None:
+            self._recorder.record(OUT, data)
+        self._event_loop.send(data)
+
+    def _send_chunks(self, msg):
+        pieces = []
+        pending = size = 0
+        for piece in _pack_pieces(self._packer, msg, 2):
+            pieces.append(piece)
+            pending += len(piece)
+            if pending >= STREAM_CHUNK_SIZE:
+                self._write(pieces[0] if len(pieces) == 1 else
+                            b''.join(pieces))
+                size += pending
+                pieces = []
+                pending = 0
+        if pieces:
+            self._write(b''.join(pieces))
+            size += pending
+        return size
 
     def run(self, message_cb):
         """Run the event loop to receive messages from Nvim.
@@ -53,24 +117,137 @@ class MsgpackStream(object):
     def stop(self):
         """Stop the event loop."""
         self._stopped = True
+        if self._recorder is not None:
+            self._recorder.flush()
         self._event_loop.stop()
 
     def _run(self):
         self._stopped = False
         while not self._stopped:
+            if self._error is not None:
+                raise self._error
             if self._posted:
-                self._message_cb(self._posted.popleft())
+                msg = self._posted.popleft()
+                if self._tracer is not None:
+                    self._tracer.message(IN, msg)
+                self._message_cb(msg)
                 continue
             self._event_loop.run(self._on_data)
 
+    def set_metrics(self, metrics):
+        """Count bytes and messages in `metrics`(None to disable)."""
+        self._metrics = metrics
+
+    def set_recorder(self, recorder):
+        """Record the traffic with a `Recorder`(None to stop recording)."""
+        self._recorder = recorder
+
+    def set_tracer(self, tracer):
+        """Add the messages sent and received to a `Tracer`(or None)."""
+        self._tracer = tracer
+
     def _on_data(self, data):
-        self._unpacker.feed(data)
+        # `data` may be a memoryview of a buffer reused by the event loop,
+        # which is only valid until this returns
+        if self._error is not None:
+            # can't find where the next message starts
+            return
+        metrics = self._metrics
+        if metrics is not None:
+            metrics.bytes_in += len(data)
+        if self._recorder is not None:
+            self._recorder.record(IN, data)
+        tracer = self._tracer
+        if tracer is not None:
+            tracer.add('data-in', None, None, len(data))
+        unpacker, tell = self._unpacker, self._tell
+        try:
+            unpacker.feed(data)
+        except BufferFull:
+            self._fail_too_large()
+            return
+        self._received += len(data)
         while True:
             try:
-                debug('waiting for message...')
-                msg = next(self._unpacker)
-                debug('received message: %s', msg)
-                self._message_cb(msg)
+                msg = next(unpacker)
             except StopIteration:
-                debug('unpacker needs more data...')
                 break
+            except ValueError as err:
+                self._fail('received invalid msgpack data: {0}'.format(err))
+                return
+            size = None
+            if tell is not None:
+                offset = tell()
+                size = offset - self._message_offset
+                self._message_offset = offset
+            if metrics is not None:
+                metrics.messages_in += 1
+            if tracer is not None:
+                tracer.message(IN, msg, size)
+            self._message_cb(msg)
+        if (tell is not None and self.max_buffer_size and
+                self._received - self._message_offset > self.max_buffer_size):
+            # msgpack parses incomplete messages as data arrives, so its
+            # buffer only bounds the part of a message that wasn't parsed yet
+            self._fail_too_large()
+
+    def _fail_too_large(self):
+        self._fail('received a message larger than {0} bytes'.format(
+            self.max_buffer_size))
+
+    def _fail(self, error):
+        warn('closing the msgpack stream, %s', error)
+        self._error = IOError(error)
+        self._unpacker = self._tell = None
+        self._event_loop.stop()
+
+
+def _has_large_array(obj):
+    """Return True if `obj` is or directly contains a large array."""
+    if type(obj) not in _ARRAYS:
+        return False
+    if len(obj) >= STREAM_MIN_ITEMS:
+        return True
+    for item in obj:
+        if type(item) in _ARRAYS and len(item) >= STREAM_MIN_ITEMS:
+            return True
+    return False
+
+
+def _pack_pieces(packer, obj, depth):
+    """Pack `obj` into pieces that concatenated form its msgpack encoding.
+
+    Arrays with `STREAM_MIN_ITEMS` or more items are packed in slices, and
+    arrays up to `depth` levels deep are split into their items.
+    """
+    if type(obj) in _ARRAYS:
+        count = len(obj)
+        if count >= STREAM_MIN_ITEMS:
+            yield packer.pack_array_header(count)
+            start, step = 0, 256
+            while start < count:
+                items = obj[start:start + step]
+                data = packer.pack(items)
+                # drop the array header of the slice
+                yield data[_array_header_size(len(items)):]
+                start += len(items)
+                # aim for pieces of `STREAM_CHUNK_SIZE` bytes
+                step = max(1, min(step * 2,
+                                  step * STREAM_CHUNK_SIZE // len(data)))
+            return
+        if depth:
+            yield packer.pack_array_header(count)
+            for item in obj:
+                for piece in _pack_pieces(packer, item, depth - 1):
+                    yield piece
+            return
+    yield packer.pack(obj)
+
+
+def _array_header_size(count):
+    # fixarray, array 16 or array 32
+    if count < 16:
+        return 1
+    if count < 0x10000:
+        return 3
+    return 5
@@ -0,0 +1,210 @@
+"""Profiling of request/notification handlers running in greenlets.
+
+A single `cProfile.Profile` can't be used with `Session`, since handlers
+switch greenlets while waiting for responses and their frames get mixed in
+the same profile. `Profiler` follows greenlet switches(see
+`neovim.msgpack_rpc.greenlet_trace`) and only enables the profile of a
+handler while its greenlet is running. For each handler(by method name) it
+records:
+
+- `count`: number of calls
+- `wall`: total time from start to end
+- `compute`: time spent running in the handler greenlet
+- `cpu`: process CPU time spent running in the handler greenlet
+- `blocked`: time spent switched out, waiting for responses from Nvim(or
+  for other handlers to yield)
+
+The profiles of each handler can be written as `pstats` files and in the
+collapsed stack format used by flame graph tools.
+"""
+import cProfile
+import logging
+import os
+import pstats
+import re
+import time
+
+from .greenlet_trace import add_tracer, remove_tracer
+
+
+__all__ = ('Profiler',)
+
+
+logger = logging.getLogger(__name__)
+debug, info, warn = (logger.debug, logger.info, logger.warn,)
+
+
+try:
+    cpu_clock = time.process_time
+except AttributeError:
+    # python 2, `time.clock` measures CPU time on unix
+    cpu_clock = time.clock
+
+
+class _Run(object):
+
+    """State of a handler greenlet while it's running."""
+
+    __slots__ = ('name', 'started', 'switched_in', 'cpu_in', 'compute', 'cpu',
+                 'profile')
+
+    def __init__(self, name, clock):
+        self.name = name
+        self.started = clock()
+        self.switched_in = None
+        self.cpu_in = None
+        self.compute = 0.0
+        self.cpu = 0.0
+        self.profile = cProfile.Profile()
+
+
+class Profiler(object):
+
+    """Per-handler profiler for `Session` greenlets."""
+
+    def __init__(self, clock=time.time):
+        """Initialize an inactive profiler."""
+        self.clock = clock
+        self.handlers = {}
+        self._runs = {}
+        self._stats = {}
+        self._active = False
+
+    def start(self):
+        """Start following greenlet switches."""
+        if not self._active:
+            add_tracer(self._trace)
+            self._active = True
+
+    def stop(self):
+        """Stop following greenlet switches."""
+        if self._active:
+            remove_tracer(self._trace)
+            self._active = False
+
+    def reset(self):
+        """Discard the collected data."""
+        self.handlers = {}
+        self._stats = {}
+
+    def handler_started(self, gr, name):
+        """Register `gr` as the greenlet of a handler for `name`.
+
+        Must be called before switching to `gr` for the first time.
+        """
+        if self._active:
+            if isinstance(name, bytes) and not isinstance(name, str):
+                name = name.decode('utf-8', 'replace')
+            self._runs[gr] = _Run(name, self.clock)
+
+    def handler_finished(self, gr):
+        """Record the data of a handler, called by `gr` before it ends."""
+        run = self._runs.pop(gr, None)
+        if run is None:
+            return
+        self._switched_out(run)
+        wall = self.clock() - run.started
+        totals = self.handlers.get(run.name)
+        if totals is None:
+            totals = self.handlers[run.name] = {
+                'count': 0, 'wall': 0.0, 'compute': 0.0, 'cpu': 0.0,
+                'blocked': 0.0,
+            }
+        totals['count'] += 1
+        totals['wall'] += wall
+        totals['compute'] += run.compute
+        totals['cpu'] += run.cpu
+        totals['blocked'] += max(0.0, wall - run.compute)
+        try:
+            profile_stats = pstats.Stats(run.profile)
+        except TypeError:
+            # nothing was recorded
+            return
+        stats = self._stats.get(run.name)
+        if stats is None:
+            self._stats[run.name] = profile_stats
+        else:
+            stats.add(profile_stats)
+
+    def stats(self, name):
+        """Return the `pstats.Stats` of the handler for `name`, or None."""
+        return self._stats.get(name)
+
+    def dump(self, directory):
+        """Write `<name>.pstats` and `<name>.collapsed` for each handler.
+
+        Return the list of written files.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        files = []
+        for name, stats in self._stats.items():
+            base = os.path.join(directory, re.sub(r'[^\w.-]', '_', name))
+            stats.dump_stats(base + '.pstats')
+            with open(base + '.collapsed', 'w') as f:
+                for stack, value in collapsed_stacks(stats, name):
+                    f.write('{0} {1}\n'.format(stack, value))
+            files.extend([base + '.pstats', base + '.collapsed'])
+        return files
+
+    def _trace(self, event, args):
+        if event in ('switch', 'throw'):
+            origin, target = args
+            run = self._runs.get(origin)
+            if run is not None:
+                self._switched_out(run)
+            run = self._runs.get(target)
+            if run is not None:
+                run.switched_in = self.clock()
+                run.cpu_in = cpu_clock()
+                run.profile.enable()
+
+    def _switched_out(self, run):
+        if run.switched_in is None:
+            return
+        run.profile.disable()
+        run.compute += self.clock() - run.switched_in
+        run.cpu += cpu_clock() - run.cpu_in
+        run.switched_in = None
+
+
+def collapsed_stacks(stats, root, max_depth=64):
+    """Yield `(stack, microseconds)` pairs for a `pstats.Stats` instance.
+
+    cProfile only records the callers of each function, so stacks are
+    rebuilt by walking the call graph from the functions without callers.
+    The own time of a function is split among the paths that reach it in
+    proportion to the number of calls from each caller, which is exact for
+    trees and an approximation otherwise.
+    """
+    callees = {}
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        for caller, caller_stats in callers.items():
+            callees.setdefault(caller, []).append((func, caller_stats[0]))
+    roots = [func for func, value in stats.stats.items() if not value[4]]
+
+    def label(func):
+        filename, line, name = func
+        if filename == '~':
+            return name
+        return '{0} ({1}:{2})'.format(name, os.path.basename(filename), line)
+
+    def walk(func, path, share, depth):
+        cc, nc, tt, ct, callers = stats.stats[func]
+        path = path + [label(func)]
+        value = int(tt * share * 1e6)
+        if value:
+            yield ';'.join(path), value
+        if depth >= max_depth:
+            return
+        for callee, calls in callees.get(func, ()):
+            if label(callee) in path:
+                # recursion
+                continue
+            fraction = min(1.0, float(calls) / (stats.stats[callee][1] or 1))
+            for item in walk(callee, path, share * fraction, depth + 1):
+                yield item
+
+    for func in roots:
+        for item in walk(func, [root], 1.0, 0):
+            yield item
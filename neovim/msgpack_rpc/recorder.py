@@ -0,0 +1,95 @@
+"""Recording of the raw msgpack traffic of a session.
+
+A recording file starts with the `MAGIC` header, followed by one frame for
+each chunk of data read or written by a `MsgpackStream`:
+
+- 1 byte: direction, `b'<'` for data read from Nvim or `b'>'` for data sent
+- 8 bytes: little-endian double with the time since the recording started
+- 4 bytes: little-endian unsigned length of the data
+- the data
+
+Data sent is one msgpack message per frame(except for messages with large
+arrays, which are sent in chunks), while data read is recorded in the chunks
+returned by the event loop, which may contain partial or several messages.
+Files are only appended to, and truncated frames at the end of a file are
+ignored when reading it.
+
+Recordings can be replayed with `benchmark/replay.py`.
+"""
+import atexit
+import os
+import struct
+import time
+
+
+__all__ = ('Recorder', 'read_recording', 'IN', 'OUT')
+
+
+MAGIC = b'NVIMREC1'
+IN = b'<'
+OUT = b'>'
+FRAME_HEADER = struct.Struct('<cdI')
+
+
+class Recorder(object):
+
+    """Append-only writer of recording files.
+
+    If the file already has frames, new frames are appended with timestamps
+    relative to the start of this recorder.
+    """
+
+    def __init__(self, path, clock=time.time):
+        """Open(or create) the recording file at `path`."""
+        self.path = path
+        self._clock = clock
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        self._started = clock()
+
+    def record(self, direction, data):
+        """Record `data`, read from(`IN`) or sent to(`OUT`) Nvim."""
+        self._file.write(FRAME_HEADER.pack(direction,
+                                           self._clock() - self._started,
+                                           len(data)))
+        self._file.write(data)
+
+    def flush(self):
+        """Flush recorded frames to the file."""
+        self._file.flush()
+
+    def close(self):
+        """Close the recording file."""
+        self._file.close()
+
+
+def read_recording(path):
+    """Iterate over the `(direction, timestamp, data)` frames in `path`."""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{0} is not a recording file'.format(path))
+        while True:
+            header = f.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                return
+            direction, timestamp, length = FRAME_HEADER.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                # truncated frame
+                return
+            yield direction, timestamp, data
+
+
+def recorder_from_environment():
+    """Return a `Recorder` for `$NVIM_PYTHON_RECORD_FILE`, or None.
+
+    The process id is appended to the file name, so every process started
+    with the variable set gets its own recording.
+    """
+    path = os.environ.get('NVIM_PYTHON_RECORD_FILE', '').strip()
+    if not path:
+        return None
+    recorder = Recorder('{0}_{1}'.format(path, os.getpid()))
+    atexit.register(recorder.flush)
+    return recorder
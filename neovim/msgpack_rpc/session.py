@@ -4,11 +4,26 @@ from collections import deque
 
 import greenlet
 
+from .metrics import Metrics
+from .profiler import Profiler
+from .trace import Tracer
+from .watchdog import Watchdog
+
 
 logger = logging.getLogger(__name__)
 debug, info, warn = (logger.debug, logger.info, logger.warn,)
 
 
+class ErrorResponse(Exception):
+
+    """Raised by request handlers to respond with a given error.
+
+    The response to requests whose handler raises other exceptions is the
+    `repr` of the exception. `ErrorResponse(error)` sends `error` verbatim
+    instead.
+    """
+
+
 class Session(object):
 
     """Msgpack-rpc session layer that uses coroutines for a synchronous API.
@@ -22,9 +37,115 @@ class Session(object):
         """Wrap `async_session` on a synchronous msgpack-rpc interface."""
         self._async_session = async_session
         self._greenlets = set()
+        self._deferred = {}
+        self._handler_data = {}
+        self._data = {}
+        self._notification_handlers = {}
         self._request_cb = self._notification_cb = None
         self._pending_messages = deque()
         self._is_running = False
+        self._profiler = None
+        # Number of calls to `request`, `pipeline` and `wait_for`, each of
+        # which waits for a response
+        self.request_count = 0
+
+    @property
+    def metrics(self):
+        """The `Metrics` recorded for this session, or None if disabled."""
+        return self._async_session._metrics
+
+    def enable_metrics(self, metrics=None):
+        """Start recording metrics(see `neovim.msgpack_rpc.metrics`).
+
+        If `metrics` is None, a new `Metrics` instance is created. Gauges for
+        the pending requests, queued messages and running handlers are added
+        to it. Return the `Metrics` instance.
+        """
+        if metrics is None:
+            metrics = Metrics()
+        async_session = self._async_session
+        metrics.gauges.update({
+            'pending_requests': lambda: len(async_session._pending_requests),
+            'pending_messages': lambda: len(self._pending_messages),
+            'running_handlers': lambda: len(self._greenlets),
+            'posted_messages':
+                lambda: len(async_session._msgpack_stream._posted),
+        })
+        async_session.set_metrics(metrics)
+        return metrics
+
+    def disable_metrics(self):
+        """Stop recording metrics."""
+        self._async_session.set_metrics(None)
+
+    @property
+    def watchdog(self):
+        """The running `Watchdog`, or None if disabled."""
+        return self._async_session._watchdog
+
+    def enable_watchdog(self, threshold=0.5, report=None):
+        """Start a `Watchdog` for handlers that block the event loop.
+
+        Dispatches running for more than `threshold` seconds are logged and
+        passed to `report`(see `neovim.msgpack_rpc.watchdog`). Return the
+        `Watchdog` instance.
+        """
+        self.disable_watchdog()
+        watchdog = Watchdog(threshold, report=report)
+        watchdog.start()
+        self._async_session.set_watchdog(watchdog)
+        return watchdog
+
+    def disable_watchdog(self):
+        """Stop the watchdog."""
+        watchdog = self._async_session._watchdog
+        if watchdog:
+            self._async_session.set_watchdog(None)
+            watchdog.stop()
+
+    @property
+    def profiler(self):
+        """The `Profiler` of the handler greenlets, or None if disabled."""
+        return self._profiler
+
+    def enable_profiler(self, profiler=None):
+        """Start profiling handlers(see `neovim.msgpack_rpc.profiler`).
+
+        If `profiler` is None, a new `Profiler` is created. Return the
+        `Profiler` instance.
+        """
+        if profiler is None:
+            profiler = Profiler()
+        self.disable_profiler()
+        profiler.start()
+        self._profiler = profiler
+        return profiler
+
+    def disable_profiler(self):
+        """Stop profiling handlers."""
+        if self._profiler:
+            self._profiler.stop()
+            self._profiler = None
+
+    @property
+    def tracer(self):
+        """The `Tracer` of this session, or None if disabled."""
+        return self._async_session._tracer
+
+    def enable_tracer(self, tracer=None):
+        """Start adding messages to a `Tracer`(see `neovim.msgpack_rpc.trace`).
+
+        If `tracer` is None, a new `Tracer` with the default size is created.
+        Return the `Tracer` instance.
+        """
+        if tracer is None:
+            tracer = Tracer()
+        self._async_session.set_tracer(tracer)
+        return tracer
+
+    def disable_tracer(self):
+        """Stop tracing messages."""
+        self._async_session.set_tracer(None)
 
     def post(self, name, *args):
         """Simple wrapper around `AsyncSession.post`."""
@@ -38,10 +159,11 @@ class Session(object):
         """
         if self._is_running:
             raise Exception('Event loop already running')
-        if self._pending_messages:
-            return self._pending_messages.popleft()
-        self._async_session.run(self._enqueue_request_and_stop,
-                                self._enqueue_notification_and_stop)
+        while not self._pending_messages:
+            # The loop may also be stopped by notifications consumed by
+            # handlers registered with `add_notification_handler`
+            self._async_session.run(self._enqueue_request_and_stop,
+                                    self._enqueue_notification_and_stop)
         return self._pending_messages.popleft()
 
     def request(self, method, *args):
@@ -58,6 +180,7 @@ class Session(object):
         - Run the loop until the response is available
         - Put requests/notifications received while waiting into a queue
         """
+        self.request_count += 1
         if self._is_running:
             err, rv = self._yielding_request(method, args)
         else:
@@ -67,6 +190,131 @@ class Session(object):
             raise self.error_wrapper(err)
         return rv
 
+    def notify(self, method, *args):
+        """Send a msgpack-rpc notification to Nvim without waiting.
+
+        This is a simple wrapper around `AsyncSession.notify`. Since no
+        response is expected, it never blocks or yields.
+        """
+        self._async_session.notify(method, args)
+
+    def wait_for(self, start):
+        """Wait for a result produced outside of the event loop thread.
+
+        `start` is called with a `resolve(error, result)` function, which may
+        be called once from any thread. Like `request`, this yields to the
+        parent greenlet when the event loop is running(or blocks otherwise)
+        until `resolve` is called, then returns `result` or raises `error`.
+        """
+        self.request_count += 1
+        if self._is_running:
+            gr = greenlet.getcurrent()
+            parent = gr.parent
+
+            def response_cb(err, rv):
+                self._resume(gr, err, rv)
+        else:
+            result = []
+            parent = None
+
+            def response_cb(err, rv):
+                result.extend([err, rv])
+                self.stop()
+
+        request_id = self._async_session.expect(response_cb)
+        start(lambda err, rv: self._async_session.post_response(request_id,
+                                                                err, rv))
+        if parent:
+            err, rv = parent.switch()
+        else:
+            self._async_session.run(self._enqueue_request,
+                                    self._enqueue_notification)
+            err, rv = result
+        if err:
+            raise self.error_wrapper(err)
+        return rv
+
+    def pipeline(self, calls):
+        """Send several msgpack-rpc requests and block until all are answered.
+
+        `calls` is a sequence of `(method, args)` pairs. Every request is
+        written before waiting for the first response, so the whole batch
+        costs a single round trip. Like `request`, this yields to the parent
+        greenlet when the event loop is running and blocks otherwise.
+
+        Return a list of `(error, result)` pairs in the same order as `calls`.
+        `error` is None for successful requests, or the exception created by
+        `error_wrapper`, in which case the remaining requests are not affected.
+        """
+        if not calls:
+            return []
+        self.request_count += 1
+        if self._is_running:
+            results = self._yielding_pipeline(calls)
+        else:
+            results = self._blocking_pipeline(calls)
+        rv = []
+        for err, result in results:
+            if err:
+                info("'Received error: %s", err)
+                err = self.error_wrapper(err)
+            rv.append((err, result,))
+        return rv
+
+    def defer(self, callback):
+        """Call `callback` when the running request/notification handler ends.
+
+        The callback runs in the handler greenlet before the response is sent,
+        so it may perform requests. Return False if not called from a handler,
+        in which case `callback` is not scheduled.
+        """
+        gr = greenlet.getcurrent()
+        if gr not in self._greenlets:
+            return False
+        self._deferred.setdefault(gr, []).append(callback)
+        return True
+
+    def handler_data(self):
+        """Return a dict for data attached to the running handler.
+
+        The dict is shared by everything that uses the session(including
+        `SessionFilter` instances) while the handler runs, and discarded when
+        it ends. Greenlets started by a handler(directly or not) use the dict
+        of the handler. Outside handlers, a single dict is returned, which
+        lives as long as the session.
+        """
+        gr = greenlet.getcurrent()
+        while gr is not None and gr not in self._greenlets:
+            gr = gr.parent
+        if gr is None:
+            return self._data
+        data = self._handler_data.get(gr)
+        if data is None:
+            data = self._handler_data[gr] = {}
+        return data
+
+    def add_notification_handler(self, name, callback):
+        """Consume notifications named `name` with `callback(args)`.
+
+        Matching notifications are not queued or passed to the notification
+        callback of `run`. The callback is invoked directly from the event
+        loop as soon as the notification is received(even while waiting for
+        a response), so it must not send requests.
+        """
+        if not isinstance(name, bytes):
+            name = name.encode('utf-8')
+        self._notification_handlers.setdefault(name, []).append(callback)
+
+    def remove_notification_handler(self, name, callback):
+        """Remove a callback added with `add_notification_handler`."""
+        if not isinstance(name, bytes):
+            name = name.encode('utf-8')
+        callbacks = self._notification_handlers.get(name, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+        if not callbacks:
+            self._notification_handlers.pop(name, None)
+
     def run(self, request_cb, notification_cb):
         """Run the event loop to receive requests and notifications from Nvim.
 
@@ -94,11 +342,9 @@ class Session(object):
         parent = gr.parent
 
         def response_cb(err, rv):
-            debug('response is available for greenlet %s, switching back', gr)
-            gr.switch(err, rv)
+            self._resume(gr, err, rv)
 
         self._async_session.request(method, args, response_cb)
-        debug('yielding from greenlet %s to wait for response', gr)
         return parent.switch()
 
     def _blocking_request(self, method, args):
@@ -113,6 +359,49 @@ class Session(object):
                                 self._enqueue_notification)
         return result
 
+    def _yielding_pipeline(self, calls):
+        gr = greenlet.getcurrent()
+        parent = gr.parent
+
+        def on_complete(results):
+            self._resume(gr, results)
+
+        self._send_pipeline(calls, on_complete)
+        return parent.switch()
+
+    def _blocking_pipeline(self, calls):
+        result = []
+
+        def on_complete(results):
+            result.extend(results)
+            self.stop()
+
+        self._send_pipeline(calls, on_complete)
+        self._async_session.run(self._enqueue_request,
+                                self._enqueue_notification)
+        return result
+
+    def _send_pipeline(self, calls, on_complete):
+        results = [None] * len(calls)
+        remaining = [len(calls)]
+
+        def response_cb(index):
+            def cb(err, rv):
+                results[index] = (err, rv,)
+                remaining[0] -= 1
+                if not remaining[0]:
+                    on_complete(results)
+            return cb
+
+        for index, (method, args) in enumerate(calls):
+            self._async_session.request(method, args, response_cb(index))
+
+    def _resume(self, gr, *args):
+        watchdog = self._async_session._watchdog
+        if watchdog is not None:
+            watchdog.handler_resumed(gr)
+        gr.switch(*args)
+
     def _enqueue_request_and_stop(self, name, args, response):
         self._enqueue_request(name, args, response)
         self.stop()
@@ -125,40 +414,120 @@ class Session(object):
         self._pending_messages.append(('request', name, args, response,))
 
     def _enqueue_notification(self, name, args):
+        if self._consume_notification(name, args):
+            return
         self._pending_messages.append(('notification', name, args,))
 
+    def _consume_notification(self, name, args):
+        callbacks = self._notification_handlers.get(name)
+        if not callbacks:
+            return False
+        for callback in list(callbacks):
+            try:
+                callback(args)
+            except Exception as err:
+                warn("error caught while consuming notification '%s %s': %s",
+                     name, args, err)
+        return True
+
+    def _run_deferred(self, gr, failed=False):
+        # When the handler failed, errors of the deferred callbacks are only
+        # logged, so they don't replace the handler's exception
+        while gr in self._deferred:
+            callbacks = self._deferred.pop(gr)
+            for callback in callbacks:
+                if not failed:
+                    callback()
+                    continue
+                try:
+                    callback()
+                except Exception as err:
+                    warn('error caught while running a deferred callback of '
+                         'a failed handler: %s', err)
+
     def _on_request(self, name, args, response):
+        profiler = self._profiler
+        tracer = self._async_session._tracer
+        watchdog = self._async_session._watchdog
+
         def handler():
             try:
-                rv = self._request_cb(name, args)
-                debug('greenlet %s finished executing, ' +
-                      'sending %s as response', gr, rv)
+                try:
+                    rv = self._request_cb(name, args)
+                except Exception:
+                    self._run_deferred(gr, failed=True)
+                    raise
+                else:
+                    self._run_deferred(gr)
+                finally:
+                    if profiler:
+                        profiler.handler_finished(gr)
+                    if watchdog is not None:
+                        watchdog.handler_finished(gr)
+                if tracer is not None:
+                    tracer.add('handler-end', None, name, None)
                 response.send(rv)
             except Exception as err:
+                if tracer is not None:
+                    tracer.add('handler-error', None, name, None)
                 warn("error caught while processing request '%s %s': %s", name,
                      args, err)
-                response.send(repr(err), error=True)
-            debug('greenlet %s is now dying...', gr)
+                if isinstance(err, ErrorResponse):
+                    response.send(err.args[0], error=True)
+                else:
+                    response.send(repr(err), error=True)
             self._greenlets.remove(gr)
+            self._handler_data.pop(gr, None)
 
         # Create a new greenlet to handle the request
         gr = greenlet.greenlet(handler)
-        debug('received rpc request, greenlet %s will handle it', gr)
         self._greenlets.add(gr)
+        if profiler:
+            profiler.handler_started(gr, name)
+        if watchdog is not None:
+            watchdog.handler_started(gr, 'request', name)
+        if tracer is not None:
+            tracer.add('handler-start', None, name, None)
         gr.switch()
 
     def _on_notification(self, name, args):
+        if self._consume_notification(name, args):
+            return
+
+        profiler = self._profiler
+        tracer = self._async_session._tracer
+        watchdog = self._async_session._watchdog
+
         def handler():
             try:
-                self._notification_cb(name, args)
-                debug('greenlet %s finished executing', gr)
+                try:
+                    self._notification_cb(name, args)
+                except Exception:
+                    self._run_deferred(gr, failed=True)
+                    raise
+                else:
+                    self._run_deferred(gr)
+                finally:
+                    if profiler:
+                        profiler.handler_finished(gr)
+                    if watchdog is not None:
+                        watchdog.handler_finished(gr)
+                if tracer is not None:
+                    tracer.add('handler-end', None, name, None)
             except Exception as e:
+                if tracer is not None:
+                    tracer.add('handler-error', None, name, None)
                 warn("error caught while processing notification '%s %s': %s",
                      name, args, e)
-            debug('greenlet %s is now dying...', gr)
             self._greenlets.remove(gr)
+            self._handler_data.pop(gr, None)
 
         gr = greenlet.greenlet(handler)
-        debug('received rpc notification, greenlet %s will handle it', gr)
         self._greenlets.add(gr)
+        if profiler:
+            profiler.handler_started(gr, name)
+        if watchdog is not None:
+            watchdog.handler_started(gr, 'notification', name)
+        if tracer is not None:
+            tracer.add('handler-start', None, name, None)
         gr.switch()
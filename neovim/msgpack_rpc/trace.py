@@ -0,0 +1,149 @@
+"""Ring buffer of msgpack-rpc trace events.
+
+The msgpack-rpc layers don't log each message: even with logging disabled,
+calling the logging functions costs about as much as handling a small
+message. Instead, when a `Tracer` is set with `Session.enable_tracer`(or the
+`NVIM_PYTHON_TRACE` environment variable), the layers add one event per
+message to a bounded buffer that keeps the most recent events, so they can
+be dumped after an incident. When disabled, each layer only checks a `None`
+attribute per message.
+
+Events are `(timestamp, event, request_id, method, size)` tuples, where
+`event` is one of:
+
+- 'data-in': bytes read from the event loop(`size`)
+- 'request-out', 'response-out', 'notification-out': message sent, with
+  its packed `size`
+- 'request-in', 'response-in', 'notification-in', 'invalid-in': message
+  received, with its packed `size`(msgpack 0.5+), or posted from another
+  thread
+- 'handler-start', 'handler-end', 'handler-error': request and
+  notification handlers running in `Session` greenlets
+
+`request_id`, `method` and `size` are None when they don't apply. Messages
+are only referenced by their id and method name, arguments are not kept.
+
+`LoggingTracer` also logs every event at the debug level, for the cases
+where a full log of the messages is wanted.
+"""
+import atexit
+import json
+import logging
+import os
+import time
+from collections import deque
+
+from .recorder import IN, OUT
+
+
+__all__ = ('Tracer', 'LoggingTracer')
+
+
+logger = logging.getLogger(__name__)
+debug, info, warn = (logger.debug, logger.info, logger.warn,)
+
+
+FIELDS = ('time', 'event', 'request_id', 'method', 'size')
+
+# Event names by direction and message type
+_MESSAGE_EVENTS = {
+    IN: {0: 'request-in', 1: 'response-in', 2: 'notification-in'},
+    OUT: {0: 'request-out', 1: 'response-out', 2: 'notification-out'},
+}
+
+
+class Tracer(object):
+
+    """Bounded buffer of the last `size` trace events."""
+
+    def __init__(self, size=4096, clock=time.time):
+        """Initialize an empty buffer, using `clock` for timestamps."""
+        self.clock = clock
+        self.count = 0
+        self._events = deque(maxlen=size)
+
+    def add(self, event, request_id=None, method=None, size=None):
+        """Add an event to the buffer, discarding the oldest if full."""
+        self.count += 1
+        self._events.append((self.clock(), event, request_id, method, size,))
+
+    def message(self, direction, msg, size=None):
+        """Add the event for a msgpack-rpc message in `direction`.
+
+        `direction` is `recorder.IN` or `recorder.OUT`.
+        """
+        try:
+            kind = msg[0]
+            event = _MESSAGE_EVENTS[direction][kind]
+        except (TypeError, IndexError, KeyError):
+            self.add('invalid-in', None, None, size)
+            return
+        if kind == 0:
+            self.add(event, msg[1], msg[2], size)
+        elif kind == 1:
+            self.add(event, msg[1], None, size)
+        else:
+            self.add(event, None, msg[1], size)
+
+    def clear(self):
+        """Discard the buffered events."""
+        self._events.clear()
+
+    def events(self):
+        """Return the buffered events as a list of dicts, oldest first."""
+        rv = []
+        for event in list(self._events):
+            event = dict(zip(FIELDS, event))
+            method = event['method']
+            if isinstance(method, bytes) and not isinstance(method, str):
+                event['method'] = method.decode('utf-8', 'replace')
+            rv.append(event)
+        return rv
+
+    def dump(self, f=None):
+        """Dump the buffered events as JSON lines to the file object `f`.
+
+        If `f` is None, return the JSON lines as a string instead.
+        """
+        data = ''.join(json.dumps(event, sort_keys=True) + '\n'
+                       for event in self.events())
+        if f is None:
+            return data
+        f.write(data)
+
+
+class LoggingTracer(Tracer):
+
+    """`Tracer` that also logs every event at the debug level."""
+
+    def add(self, event, request_id=None, method=None, size=None):
+        """Add and log an event."""
+        super(LoggingTracer, self).add(event, request_id, method, size)
+        debug('%s: id=%s method=%s size=%s', event, request_id, method, size)
+
+
+def tracer_from_environment():
+    """Return a `Tracer` configured by `$NVIM_PYTHON_TRACE`, or None.
+
+    The variable is the number of events to keep, or 'log' to log every
+    event with a `LoggingTracer`(keeping the default number of events). If
+    `$NVIM_PYTHON_TRACE_FILE` is also set, the events are dumped to it(with
+    the process id appended to the name) when the process exits.
+    """
+    value = os.environ.get('NVIM_PYTHON_TRACE', '').strip()
+    if not value:
+        return None
+    if value == 'log':
+        tracer = LoggingTracer()
+    else:
+        tracer = Tracer(int(value))
+    path = os.environ.get('NVIM_PYTHON_TRACE_FILE', '').strip()
+    if path:
+        atexit.register(_dump_to_file, tracer,
+                        '{0}_{1}'.format(path, os.getpid()))
+    return tracer
+
+
+def _dump_to_file(tracer, path):
+    with open(path, 'w') as f:
+        tracer.dump(f)
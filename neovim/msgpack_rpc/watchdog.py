@@ -0,0 +1,191 @@
+"""Detection of handlers that block the event loop.
+
+Messages are dispatched by `AsyncSession` from the event loop thread, and
+the loop can't read or write anything until the dispatch returns(for
+requests and notifications, until the handler greenlet finishes or yields
+waiting for a response). `Watchdog` runs a thread that checks how long the
+current dispatch has been running. When it exceeds the threshold, the stack
+of the event loop thread(which is the stack of the running handler
+greenlet) is captured and reported along with the message being handled.
+
+Responses resume the handler that is waiting for them, so stalls while
+handling a response are reported with the request or notification that
+started that handler(see `Watchdog.handler_resumed`).
+"""
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+
+__all__ = ('Watchdog', 'Stall')
+
+
+logger = logging.getLogger(__name__)
+debug, info, warn = (logger.debug, logger.info, logger.warn,)
+
+
+class Stall(object):
+
+    """Record of a dispatch that exceeded the watchdog threshold."""
+
+    __slots__ = ('message', 'started', 'duration', 'stack', 'finished')
+
+    def __init__(self, message, started, duration, stack):
+        self.message = message
+        self.started = started
+        self.duration = duration
+        self.stack = stack
+        self.finished = False
+
+    def to_dict(self):
+        """Return the stall as a JSON-serializable dict."""
+        return {
+            'message': self.message,
+            'started': self.started,
+            'duration': self.duration,
+            'stack': self.stack,
+            'finished': self.finished,
+        }
+
+
+class Watchdog(object):
+
+    """Thread that reports dispatches running longer than `threshold`.
+
+    Stalls are logged as warnings and, if `report` is set, passed to it(from
+    the watchdog thread) as `Stall` instances, both when detected and again
+    when finished. The last `keep` stalls are available in `stalls`.
+
+    `Session` calls `handler_started` and `handler_finished` around each
+    handler greenlet, and `handler_resumed` before switching to a handler
+    waiting for a response.
+    """
+
+    def __init__(self, threshold=0.5, interval=None, report=None, keep=20,
+                 clock=time.time):
+        """Initialize the watchdog, `start` must be called to run it."""
+        self.threshold = threshold
+        self.interval = interval or threshold / 4.0
+        self.report = report
+        self.clock = clock
+        self.stalls = deque(maxlen=keep)
+        self.stall_count = 0
+        self._loop_thread = None
+        self._busy_since = None
+        self._message = None
+        self._handler = None
+        self._handlers = {}
+        self._depth = 0
+        self._stall = None
+        self._reported = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the watchdog thread."""
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._watch,
+                                        name='nvim-python-watchdog')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the watchdog thread."""
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def enter(self, msg):
+        """Called by the event loop thread before dispatching `msg`."""
+        self._depth += 1
+        if self._depth == 1:
+            self._loop_thread = threading.current_thread().ident
+            self._message = msg
+            self._handler = None
+            self._busy_since = self.clock()
+
+    def handler_started(self, gr, kind, name):
+        """Record the request or notification handled by greenlet `gr`."""
+        self._handlers[gr] = describe_call(kind, name)
+
+    def handler_resumed(self, gr):
+        """Called before the dispatched message resumes greenlet `gr`."""
+        if self._handler is None:
+            self._handler = self._handlers.get(gr)
+
+    def handler_finished(self, gr):
+        """Forget the handler of greenlet `gr`."""
+        self._handlers.pop(gr, None)
+
+    def leave(self):
+        """Called by the event loop thread after dispatching a message."""
+        self._depth -= 1
+        if self._depth:
+            return
+        started, self._busy_since = self._busy_since, None
+        stall = self._stall
+        if stall is not None:
+            self._stall = None
+            if stall.started == started:
+                stall.duration = self.clock() - stall.started
+            # else the dispatch ended while the stall was being reported
+            stall.finished = True
+            warn('event loop stall finished after %.3fs while handling %s',
+                 stall.duration, stall.message)
+            if self.report:
+                self.report(stall)
+
+    def _watch(self):
+        while True:
+            self._stopped.wait(self.interval)
+            if self._stopped.is_set():
+                return
+            started = self._busy_since
+            message, handler = self._message, self._handler
+            if started is None or started == self._reported:
+                continue
+            duration = self.clock() - started
+            if duration < self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if self._busy_since != started:
+                # finished while capturing
+                continue
+            stall = Stall(handler or describe(message), started, duration,
+                          ''.join(traceback.format_stack(frame))
+                          if frame else '')
+            self._reported = started
+            self._stall = stall
+            self.stalls.append(stall)
+            self.stall_count += 1
+            warn('event loop blocked for %.3fs while handling %s:\n%s',
+                 duration, stall.message, stall.stack)
+            if self.report:
+                self.report(stall)
+
+
+def describe(msg):
+    """Return a short description of a msgpack-rpc message."""
+    if not msg:
+        return None
+    kind = {0: 'request', 1: 'response', 2: 'notification'}.get(msg[0])
+    if kind == 'request':
+        name = msg[2]
+    elif kind == 'notification':
+        name = msg[1]
+    elif kind == 'response':
+        return 'response to request {0}'.format(msg[1])
+    else:
+        return 'invalid message'
+    return describe_call(kind, name)
+
+
+def describe_call(kind, name):
+    """Return a short description of a request or notification."""
+    if isinstance(name, bytes) and not isinstance(name, str):
+        name = name.decode('utf-8', 'replace')
+    return '{0} {1}'.format(kind, name)
@@ -0,0 +1,64 @@
+import logging
+import os.path
+
+from ..compat import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+debug, info, warn = (logger.debug, logger.info, logger.warn,)
+
+
+class CodeCache(object):
+    """
+    LRU cache of code objects compiled by the script host.
+
+    Code objects are keyed by their source, compile mode and file name, so
+    files are read on every call but only compiled when their contents
+    change. The cache is kept in memory only: code objects loaded from a
+    shared directory would be executed without any way to verify them.
+    """
+    def __init__(self, max_size=512):
+        self.max_size = max_size
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+        }
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def compile(self, source, filename='<string>', mode='exec'):
+        """Return the code object for `source`, compiling it if needed."""
+        key = (mode, filename, source,)
+        code = self._get(key)
+        if code is None:
+            code = compile(source, filename, mode)
+            self._put(key, code)
+        return code
+
+    def compile_file(self, path):
+        """Return the code object for the file at `path`."""
+        path = os.path.abspath(path)
+        with open(path) as f:
+            return self.compile(f.read(), path)
+
+    def clear(self):
+        """Remove all code objects from memory."""
+        self._entries.clear()
+
+    def _get(self, key):
+        code = self._entries.pop(key, None)
+        if code is None:
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        self._entries[key] = code
+        return code
+
+    def _put(self, key, code):
+        self._entries[key] = code
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.stats['evictions'] += 1
@@ -0,0 +1,192 @@
+import inspect
+import logging
+import os
+import os.path
+import sys
+import tempfile
+from imp import find_module, load_module
+
+from msgpack import packb, unpackb
+
+from ..api.metadata import cache_directory
+
+
+logger = logging.getLogger(__name__)
+debug, info, warn = (logger.debug, logger.info, logger.warn,)
+
+
+class PluginManifest(object):
+    """
+    Persistent record of the handlers and features of each plugin class found
+    in the runtime directories, keyed by module path and modification time.
+
+    When the entry of a module is up to date and all of its plugin classes
+    allow it, the plugin host can register their handlers without importing
+    the module(see `LazyPlugin`).
+    """
+    def __init__(self, directory=None):
+        self.directory = directory or cache_directory()
+        self.entries = {}
+        self.updated = {}
+        if self.directory:
+            self.path = os.path.join(
+                self.directory,
+                'plugins-py{0}.msgpack'.format(sys.version_info[0]))
+            self._read()
+
+    def lookup(self, pathname):
+        """Return the up to date entry for the module at `pathname`."""
+        entry = self.entries.get(pathname)
+        if entry and entry['mtime'] == module_mtime(pathname):
+            self.updated[pathname] = entry
+            return entry
+        return None
+
+    def add_module(self, pathname, name, directory, plugins):
+        """Add an entry for the module at `pathname`, which was imported.
+
+        `plugins` are the descriptions(see `describe_plugin`) of the plugins
+        installed from the module.
+        """
+        self.updated[pathname] = {
+            'mtime': module_mtime(pathname),
+            'name': name,
+            'directory': directory,
+            'plugins': plugins,
+        }
+
+    def save(self):
+        """Save the entries recorded since initialization.
+
+        Entries of modules that weren't loaded by this host are kept, since
+        the manifest is shared by plugin host processes(eg: workers).
+        """
+        if not self.directory:
+            return
+        entries = dict(self.entries)
+        entries.update(self.updated)
+        if entries == self.entries:
+            return
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(packb(entries, use_bin_type=True))
+                os.rename(tmp_path, self.path)
+            except Exception:
+                os.unlink(tmp_path)
+                raise
+            self.entries = entries
+            debug('saved plugin manifest with %d modules', len(self.entries))
+        except Exception as err:
+            warn('failed to save plugin manifest: %s', err)
+
+    def _read(self):
+        try:
+            with open(self.path, 'rb') as f:
+                self.entries = _unpackb(f.read())
+        except Exception as err:
+            debug('plugin manifest not loaded: %s', err)
+
+
+class LazyPlugin(object):
+    """
+    Plugin class described by a manifest entry. The module is only imported,
+    and the class instantiated, when one of its handlers is first called.
+
+    Since the constructor doesn't run at startup, this is only done for
+    plugin classes that set the `lazy` attribute to True, so plugins that
+    define commands, autocmds or subscriptions when constructed keep working.
+    """
+    def __init__(self, host, entry, description):
+        self.host = host
+        self.entry = entry
+        self.description = description
+        self.instance = None
+
+    @property
+    def name(self):
+        return self.description['class']
+
+    def load(self):
+        if self.instance is None:
+            module = import_module(self.entry['name'],
+                                   self.entry['directory'])
+            plugin_class = getattr(module, self.name)
+            debug('lazily instantiating %s', self.name)
+            self.instance = plugin_class(self.host.nvim)
+            self.host.installed_plugins.append(self.instance)
+            self.host.invalidate_handler_index()
+        return self.instance
+
+    def handler(self, method_name):
+        return LazyHandler(self, method_name)
+
+
+class LazyHandler(object):
+    """Handler that loads its `LazyPlugin` before being called."""
+    def __init__(self, plugin, method_name):
+        self.plugin = plugin
+        self.method_name = method_name
+
+    def __call__(self, *args):
+        return getattr(self.plugin.load(), self.method_name)(*args)
+
+
+def describe_plugin(plugin_class, plugin):
+    methods = [name for name, _ in inspect.getmembers(plugin, inspect.ismethod)
+               if not name.startswith('__')]
+    return {
+        'class': plugin_class.__name__,
+        'events': [name for name in methods if name.startswith('on_')],
+        'provides': list(getattr(plugin, 'provides', None) or []),
+        'methods': methods,
+        'lazy': bool(getattr(plugin_class, 'lazy', False)),
+    }
+
+
+def is_lazy(entry):
+    """Return True if the plugins of a manifest entry can be loaded lazily."""
+    if not entry['plugins']:
+        # Modules without plugin classes may install handlers when imported
+        return False
+    return all(description.get('lazy') for description in entry['plugins'])
+
+
+def _unpackb(data):
+    # Strings were packed as str, so they are unpacked as unicode
+    try:
+        return unpackb(data, raw=False)
+    except TypeError:
+        # msgpack < 0.5.2
+        return unpackb(data, encoding='utf-8')
+
+
+def module_mtime(pathname):
+    mtime = os.path.getmtime(pathname)
+    if os.path.isdir(pathname):
+        # Packages: take any file changed in the top-level directory
+        for name in os.listdir(pathname):
+            mtime = max(mtime, os.path.getmtime(os.path.join(pathname, name)))
+    return mtime
+
+
+_modules = {}
+
+
+def import_module(name, directory):
+    key = (name, directory,)
+    if key not in _modules:
+        _modules[key] = _import(name, directory)
+    return _modules[key]
+
+
+def _import(name, directory):
+    file, pathname, description = find_module(name, [directory])
+    try:
+        return load_module(name, file, pathname, description)
+    finally:
+        if file:
+            file.close()
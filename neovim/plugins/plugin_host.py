@@ -3,25 +3,98 @@ import logging
 import os
 import os.path
 import sys
+import time
+from functools import partial
 from imp import find_module, load_module
 from traceback import format_exc
 
+from .manifest import LazyPlugin, PluginManifest, describe_plugin, is_lazy
+from .stats import PluginStats, plugin_name
+from .workers import WorkerPool
 from ..compat import IS_PYTHON3
 
+try:
+    from importlib.machinery import all_suffixes
+    from importlib.util import spec_from_file_location
+    MODULE_SUFFIXES = all_suffixes()
+except ImportError:
+    from imp import get_suffixes
+    spec_from_file_location = None
+    MODULE_SUFFIXES = [suffix for suffix, _, _ in get_suffixes()]
+
 
 logger = logging.getLogger(__name__)
 debug, info, warn = (logger.debug, logger.info, logger.warn,)
 
 
 class RedirectStream(object):
-    def __init__(self, redirect_handler):
-        self.redirect_handler = redirect_handler
+    """
+    File-like object that redirects output to Nvim through `method`
+    (vim_out_write or vim_err_write).
+
+    Output is buffered and sent as notifications, which don't wait for a
+    response, whenever a newline is written, `buffer_size` characters are
+    buffered, the running handler returns or `flush` is called. Outside of
+    handlers, output is sent as soon as it is written. At most `rate_limit`
+    characters per second are sent: when the limit is exceeded the excess
+    output is dropped from the last complete line that fits, and the number
+    of dropped characters is reported once output is allowed again.
+    """
+    def __init__(self, nvim, method, buffer_size=4096, rate_limit=65536):
+        self.nvim = nvim
+        self.method = method
+        self.buffer_size = buffer_size
+        self.rate_limit = rate_limit
+        self.dropped = 0
+        self._buffer = []
+        self._buffered = 0
+        self._flush_scheduled = False
+        self._allowance = rate_limit
+        self._last_check = time.time()
 
     def write(self, data):
-        self.redirect_handler(data)
+        if not data:
+            return
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.buffer_size or '\n' in data:
+            self.flush()
+        elif not self._flush_scheduled:
+            self._flush_scheduled = self.nvim.session.defer(self.flush)
+            if not self._flush_scheduled:
+                # Not called from a handler
+                self.flush()
 
     def writelines(self, seq):
-        self.redirect_handler('\n'.join(seq))
+        self.write('\n'.join(seq))
+
+    def flush(self):
+        self._flush_scheduled = False
+        if not self._buffer:
+            return
+        data = ''.join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        now = time.time()
+        self._allowance = min(
+            self.rate_limit,
+            self._allowance + (now - self._last_check) * self.rate_limit)
+        self._last_check = now
+        allowed = int(self._allowance)
+        if len(data) > allowed:
+            # Don't cut lines, Nvim would join the rest of a cut line with the
+            # next output
+            allowed = data.rfind('\n', 0, allowed) + 1
+            self.dropped += len(data) - allowed
+            data = data[:allowed]
+            if not data:
+                return
+        elif self.dropped:
+            data = '[{0} characters of output dropped]\n{1}'.format(
+                self.dropped, data)
+            self.dropped = 0
+        self._allowance -= len(data)
+        self.nvim.session.notify(self.method, data)
 
 
 class PluginHost(object):
@@ -29,143 +102,238 @@ class PluginHost(object):
     Class that transforms the python interpreter into a plugin host for
     Neovim. It takes care of discovering plugins and routing events/calls
     sent by Neovim to the appropriate handlers(registered by plugins)
+
+    The handlers of discovered plugins are recorded in a `PluginManifest`.
+    Plugin modules that didn't change since the manifest was saved, and whose
+    plugin classes set `lazy = True`, are not imported at startup, only when
+    one of their handlers is first called.
+
+    If `workers` is set, plugin modules are loaded by worker processes
+    instead(see `WorkerPool`). `only` restricts the plugin modules loaded by
+    the host to the given names, which is how workers are started.
+
+    If `profile` is set to a directory, handlers are profiled and the
+    'python_host_profile' request writes the profiles to it. If `stats` is
+    True, the resources used by each plugin are returned by the 'host_stats'
+    request(see `PluginStats`), including memory if `memory_stats` is True.
+    When the session has a `Tracer`, the 'python_host_trace' request returns
+    its events.
     """
-    def __init__(self, nvim, preloaded=[]):
+    def __init__(self, nvim, preloaded=[], snapshot_current=False,
+                 manifest=None, only=None, workers=None, profile=None,
+                 stats=False, memory_stats=False):
         self.nvim = nvim
+        self.only = only
+        self.workers = workers
+        self.profile = profile
+        self.pool = None
+        self.snapshot_current = snapshot_current
         self.method_handlers = {}
         self.event_handlers = {}
         self.discovered_plugins = list(preloaded)
+        self.lazy_plugins = []
         self.installed_plugins = []
+        self.manifest = manifest or PluginManifest()
+        # Module path of each discovered plugin class, and name/directory of
+        # each imported module, for recording them in the manifest
+        self.plugin_paths = {}
+        self.plugin_modules = {}
+        self.handler_index = {}
+        # Number of requests/notifications dispatched, by method name
+        self.dispatch_counts = {}
+        if profile:
+            nvim.session.enable_profiler()
+            self.method_handlers[b'python_host_profile'] = self.dump_profile
+        self.stats = None
+        if stats:
+            session = getattr(nvim.session, 'wrapped_session', nvim.session)
+            self.stats = PluginStats(session, memory=memory_stats)
+            self.method_handlers[b'host_stats'] = self.host_stats
+        if nvim.session.tracer is not None:
+            self.method_handlers[b'python_host_trace'] = self.dump_trace
 
     def __enter__(self):
         nvim = self.nvim
-        info('install import hook/path')
-        self.hook = path_hook(nvim)
-        sys.path_hooks.append(self.hook)
-        nvim.VIM_SPECIAL_PATH = '_vim_path_'
-        sys.path.append(nvim.VIM_SPECIAL_PATH)
+        info('install import hook')
+        # Workers are notified of 'runtimepath' changes by the pool
+        self.finder = VimPathFinder(nvim, watch=self.only is None)
+        sys.meta_path.append(self.finder)
         info('redirect sys.stdout and sys.stderr')
         self.saved_stdout = sys.stdout
         self.saved_stderr = sys.stderr
-        sys.stdout = RedirectStream(lambda data: nvim.out_write(data))
-        sys.stderr = RedirectStream(lambda data: nvim.err_write(data))
+        sys.stdout = RedirectStream(nvim, 'vim_out_write')
+        sys.stderr = RedirectStream(nvim, 'vim_err_write')
         debug('installing plugins')
         self.install_plugins()
+        if self.pool:
+            info('starting plugin workers')
+            self.pool.start()
         return self
 
     def __exit__(self, type, value, traceback):
+        if self.pool:
+            self.pool.stop()
+        if self.stats:
+            self.stats.close()
         for plugin in self.installed_plugins:
-            if hasattr(plugin, 'on_teardown'):
-                plugin.teardown()
-        nvim = self.nvim
-        info('uninstall import hook/path')
-        sys.path.remove(nvim.VIM_SPECIAL_PATH)
-        sys.path_hooks.remove(self.hook)
+            # Not named `on_*`, which would register an event handler
+            if hasattr(plugin, 'shutdown'):
+                plugin.shutdown()
+        info('uninstall import hook')
+        sys.meta_path.remove(self.finder)
+        self.finder.close()
         info('restore sys.stdout and sys.stderr')
+        sys.stdout.flush()
+        sys.stderr.flush()
         sys.stdout = self.saved_stdout
         sys.stderr = self.saved_stderr
 
     def discover_plugins(self):
-        loaded = set()
-        for directory in discover_runtime_directories(self.nvim):
-            for name in os.listdir(directory):
-                if not name.startswith(b'nvim_'):
-                    continue
-                name = os.path.splitext(name)[0]
-                if name in loaded:
-                    continue
-                loaded.add(name)
-                try:
-                    discovered = find_module(name, [directory])
-                except:
-                    err_str = format_exc(5)
-                    warn('error while searching module %s: %s', name, err_str)
-                    continue
-                debug('discovered %s', name)
-                try:
-                    file, pathname, description = discovered
-                    module = load_module(name, file, pathname, description)
-                    for name, value in inspect.getmembers(module,
+        if self.workers:
+            # Plugins are loaded by the worker processes
+            modules = [module_name(name) for name, _ in
+                       discover_plugin_modules(self.nvim)]
+            self.pool = WorkerPool(self, modules, self.workers)
+            return
+        for name, directory in discover_plugin_modules(self.nvim):
+            if self.only is not None and module_name(name) not in self.only:
+                continue
+            try:
+                discovered = find_module(name, [directory])
+            except:
+                err_str = format_exc(5)
+                warn('error while searching module %s: %s', name, err_str)
+                continue
+            debug('discovered %s', name)
+            file, pathname, description = discovered
+            entry = self.manifest.lookup(pathname)
+            if entry and is_lazy(entry):
+                # Up to date manifest, import only when a handler is used
+                if file:
+                    file.close()
+                for plugin_description in entry['plugins']:
+                    self.lazy_plugins.append(
+                        LazyPlugin(self, entry, plugin_description))
+                debug('registered %s from manifest', name)
+                continue
+            try:
+                module = load_module(name, file, pathname, description)
+                self.plugin_modules[pathname] = (name, directory,)
+                for cls_name, value in inspect.getmembers(module,
                                                           inspect.isclass):
-                        if name.startswith('Nvim'):
-                            self.discovered_plugins.append(value)
-                    debug('loaded %s', name)
-                except:
-                    err_str = format_exc(5)
-                    warn('error while loading module %s: %s', name, err_str)
-                    continue
-                finally:
+                    if cls_name.startswith('Nvim'):
+                        self.discovered_plugins.append(value)
+                        self.plugin_paths[value] = pathname
+                debug('loaded %s', name)
+            except:
+                err_str = format_exc(5)
+                warn('error while loading module %s: %s', name, err_str)
+                continue
+            finally:
+                if file:
                     file.close()
 
     def install_plugins(self):
         self.discover_plugins()
-        nvim = self.nvim
-        features = nvim.metadata['features']
+        features = self.nvim.metadata['features']
         registered = set()
+        descriptions = dict((pathname, []) for pathname in self.plugin_modules)
         for plugin_class in self.discovered_plugins:
             cls_name = plugin_class.__name__
+            pathname = self.plugin_paths.get(plugin_class)
             debug('inspecting class %s', plugin_class.__name__)
             try:
                 plugin = plugin_class(self.nvim)
             except:
                 err_str = format_exc(5)
                 warn('constructor for %s failed: %s', cls_name, err_str)
+                # Don't record the module, so it is imported again(and the
+                # error reported) by the next host
+                descriptions.pop(pathname, None)
                 continue
-            methods = inspect.getmembers(plugin, inspect.ismethod)
-            debug('registering event handlers for %s', plugin_class.__name__)
-            for method_name, method in methods:
-                if not method_name.startswith('on_'):
-                    continue
-                # event handler
-                # Store all handlers with bytestring keys, since thats how
-                # msgpack will deserialize method names
-                event_name = method_name[3:].encode('utf-8')
-                debug('registering %s event handler', event_name)
-                if event_name not in self.event_handlers:
-                    self.event_handlers[event_name] = [method]
-                else:
-                    self.event_handlers[event_name].append(
-                        method.__get__(plugin, plugin_class))
-
-            if hasattr(plugin, 'provides') and plugin.provides:
-                for feature_name in plugin.provides:
-                    if feature_name in registered:
-                        raise Exception('A plugin already provides %s' %
-                                        feature_name)
-                    for method_name in features[feature_name]:
-                        # encode for the same reason as above
-                        enc_name = method_name.encode('utf-8')
-                        self.method_handlers[enc_name] = getattr(
-                            # Python 3 attributes need to be unicode instances
-                            # so use `method_name` here
-                            plugin, method_name)
-                    debug('registered %s as a %s provider',
-                          plugin_class.__name__,
-                          feature_name)
-                    nvim.register_provider(feature_name)
-                    registered.add(feature_name)
+            description = describe_plugin(plugin_class, plugin)
+            self.register_plugin(description,
+                                 partial(getattr, plugin),
+                                 features, registered)
             self.installed_plugins.append(plugin)
+            if pathname in descriptions:
+                descriptions[pathname].append(description)
+        for lazy_plugin in self.lazy_plugins:
+            self.register_plugin(lazy_plugin.description,
+                                 lazy_plugin.handler,
+                                 features, registered)
+        for pathname, plugins in descriptions.items():
+            name, directory = self.plugin_modules[pathname]
+            self.manifest.add_module(pathname, name, directory, plugins)
+        self.manifest.save()
+        self.build_handler_index()
+
+    def register_plugin(self, description, get_handler, features,
+                        registered):
+        cls_name = description['class']
+        debug('registering event handlers for %s', cls_name)
+        for method_name in description['events']:
+            # event handler
+            # Store all handlers with bytestring keys, since thats how
+            # msgpack will deserialize method names
+            event_name = method_name[3:].encode('utf-8')
+            debug('registering %s event handler', event_name)
+            self.event_handlers.setdefault(event_name, []).append(
+                get_handler(method_name))
+        for feature_name in description['provides']:
+            if feature_name in registered:
+                raise Exception('A plugin already provides %s' %
+                                feature_name)
+            for method_name in features[feature_name]:
+                # encode for the same reason as above
+                enc_name = method_name.encode('utf-8')
+                # Python 3 attributes need to be unicode instances so use
+                # `method_name` here
+                self.method_handlers[enc_name] = get_handler(method_name)
+            debug('registered %s as a %s provider', cls_name, feature_name)
+            self.nvim.register_provider(feature_name)
+            registered.add(feature_name)
 
-    def search_handler_for(self, name):
+    def build_handler_index(self):
+        """
+        Map the (encoded) name of every public method of the installed
+        plugins to its handler, so requests are dispatched with a single
+        lookup. Names missing from the index have no handler.
+        """
+        index = {}
         for plugin in self.installed_plugins:
             methods = inspect.getmembers(plugin, inspect.ismethod)
             for method_name, method in methods:
-                if method_name == name:
-                    return method
+                if not method_name.startswith('__'):
+                    index.setdefault(method_name.encode('utf-8'), method)
+        for lazy_plugin in self.lazy_plugins:
+            if lazy_plugin.instance is not None:
+                continue
+            for method_name in lazy_plugin.description['methods']:
+                index.setdefault(method_name.encode('utf-8'),
+                                 lazy_plugin.handler(method_name))
+        self.handler_index = index
+
+    def invalidate_handler_index(self):
+        """Rebuild the handler index after plugins are (re)loaded."""
+        debug('rebuilding handler index')
+        self.build_handler_index()
 
     def on_request(self, name, args):
         handler = self.method_handlers.get(name, None)
         if not handler:
-            handler = self.search_handler_for(name)
-            if handler:
-                self.method_handlers[name] = handler
-            else:
+            handler = self.handler_index.get(name, None)
+            if not handler:
                 msg = 'no method handlers for "%s" were found' % name
                 debug(msg)
                 raise Exception(msg)
 
+        self.dispatch_counts[name] = self.dispatch_counts.get(name, 0) + 1
         debug("running method handler for '%s %s'", name, args)
-        rv = handler(*args)
+        if self.stats:
+            rv = self.stats.call(plugin_name(handler), name, handler, args)
+        else:
+            rv = handler(*args)
         debug("method handler for '%s %s' returns: %s", name, args, rv)
         return rv
 
@@ -175,58 +343,181 @@ class PluginHost(object):
             debug("no event handlers registered for %s", name)
             return
 
+        self.dispatch_counts[name] = self.dispatch_counts.get(name, 0) + 1
         debug('running event handlers for %s', name)
-        for handler in handlers:
-            handler(*args)
+        current = self.nvim.current
+        if self.snapshot_current:
+            # Fetch current-* values in one round trip, handlers can read them
+            # through `nvim.current.attached`
+            current.attach(current.snapshot())
+        try:
+            for handler in handlers:
+                if self.stats:
+                    self.stats.call(plugin_name(handler), name, handler,
+                                    args)
+                else:
+                    handler(*args)
+        finally:
+            current.detach()
+
+    def host_stats(self):
+        """
+        Return the resources used by each plugin and handler(see
+        `PluginStats`) and the number of dispatches by method name.
+        """
+        rv = self.stats.to_dict()
+        rv['dispatch_counts'] = dict(
+            (name.decode('utf-8') if isinstance(name, bytes) else name, count)
+            for name, count in self.dispatch_counts.items())
+        return rv
+
+    def dump_profile(self, directory=None):
+        """
+        Write the handler profiles collected so far to `directory`(default
+        is the `profile` directory) and return the handler times.
+        """
+        profiler = self.nvim.session.profiler
+        if isinstance(directory, bytes) and not isinstance(directory, str):
+            directory = directory.decode('utf-8')
+        files = profiler.dump(directory or self.profile)
+        info('wrote %d profile files', len(files))
+        return profiler.handlers
+
+    def dump_trace(self):
+        """Return the msgpack-rpc events kept by the session `Tracer`."""
+        return self.nvim.session.tracer.events()
 
     def run(self):
+        if self.pool:
+            self.pool.run()
+            return
         self.nvim.session.run(self.on_request, self.on_notification)
 
 
-# This was copied/adapted from nvim-python help
-def path_hook(nvim):
-    def _get_paths():
-        return discover_runtime_directories(nvim)
+class VimPathFinder(object):
+    """
+    Meta path finder for top-level modules in the pythonx/python{2,3}
+    directories of 'runtimepath'(submodules are found through the `__path__`
+    of their packages by the standard machinery).
 
-    def _find_module(fullname, oldtail, path):
-        idx = oldtail.find('.')
-        if idx > 0:
-            name = oldtail[:idx]
-            tail = oldtail[idx+1:]
-            fmr = find_module(name, path)
-            module = load_module(fullname[:-len(oldtail)] + name, *fmr)
-            return _find_module(fullname, tail, module.__path__)
-        else:
-            fmr = find_module(fullname, path)
-            return load_module(fullname, *fmr)
+    The directories are listed once and merged into a single name -> location
+    index, so lookups don't perform any RPC or filesystem access. The index
+    is rebuilt after 'runtimepath' changes(reported by an OptionSet autocmd
+    in the 'nvim-python-runtimepath' augroup, when supported by Nvim and
+    `watch` is True) or `invalidate_caches` is called.
+    """
+    group = 'nvim-python-runtimepath'
+    notification = 'nvim-python-runtimepath-changed'
 
-    class VimModuleLoader(object):
-        def __init__(self, module):
-            self.module = module
+    def __init__(self, nvim, watch=True):
+        self.nvim = nvim
+        self.watch = watch
+        self._index = None
+        nvim.session.add_notification_handler(self.notification,
+                                              self._on_runtimepath_changed)
+        if not watch:
+            return
+        nvim.command(
+            'if exists("##OptionSet") | '
+            'augroup {0} | exe "autocmd!" | '
+            'exe "autocmd OptionSet runtimepath call rpcnotify({1}, \'{2}\')"'
+            ' | augroup END | endif'.format(self.group, nvim.channel_id,
+                                            self.notification))
 
-        def load_module(self, fullname, path=None):
-            return self.module
+    def invalidate_caches(self):
+        self._index = None
+
+    def close(self):
+        """Delete the autocmd and stop handling its notifications."""
+        self.nvim.session.remove_notification_handler(
+            self.notification, self._on_runtimepath_changed)
+        if not self.watch:
+            return
+        self.nvim.command('exe "silent! autocmd! {0}" | silent! augroup! {0}'
+                          .format(self.group))
+
+    def find_spec(self, fullname, path=None, target=None):
+        # python 3.4+
+        entry = path is None and self._get_index().get(fullname)
+        if not entry:
+            return None
+        filename, package_dir = entry
+        if package_dir:
+            return spec_from_file_location(
+                fullname, filename, submodule_search_locations=[package_dir])
+        return spec_from_file_location(fullname, filename)
+
+    def find_module(self, fullname, path=None):
+        # python 2 and python 3 before 3.4
+        if path is None and fullname in self._get_index():
+            return self
+
+    def load_module(self, fullname):
+        if fullname in sys.modules:
+            return sys.modules[fullname]
+        filename, package_dir = self._get_index()[fullname]
+        directory = os.path.dirname(package_dir or filename)
+        file, pathname, description = find_module(fullname, [directory])
+        try:
+            return load_module(fullname, file, pathname, description)
+        finally:
+            if file:
+                file.close()
+
+    def _on_runtimepath_changed(self, args):
+        debug("'runtimepath' changed, invalidating module index")
+        self.invalidate_caches()
+
+    def _get_index(self):
+        if self._index is None:
+            index = {}
+            for directory in discover_runtime_directories(self.nvim):
+                if IS_PYTHON3:
+                    directory = os.fsdecode(directory)
+                for name in os.listdir(directory):
+                    entry = _module_entry(directory, name)
+                    if entry:
+                        index.setdefault(entry[0], entry[1:])
+            debug('indexed %d modules in runtime directories', len(index))
+            self._index = index
+        return self._index
+
+
+def _module_entry(directory, name):
+    path = os.path.join(directory, name)
+    if os.path.isdir(path):
+        for suffix in MODULE_SUFFIXES:
+            init = os.path.join(path, '__init__' + suffix)
+            if os.path.isfile(init):
+                return (name, init, path,)
+        return None
+    for suffix in MODULE_SUFFIXES:
+        if name.endswith(suffix) and '.' not in name[:-len(suffix)]:
+            return (name[:-len(suffix)], path, None,)
+    return None
+
+
+def discover_plugin_modules(nvim):
+    """Return (name, directory) pairs of nvim_* modules in 'runtimepath'."""
+    rv = []
+    loaded = set()
+    for directory in discover_runtime_directories(nvim):
+        for name in os.listdir(directory):
+            if not name.startswith(b'nvim_'):
+                continue
+            name = os.path.splitext(name)[0]
+            if name in loaded:
+                continue
+            loaded.add(name)
+            # `imp.find_module` requires str names and paths
+            rv.append((module_name(name), module_name(directory),))
+    return rv
 
-    class VimPathFinder(object):
-        @classmethod
-        def find_module(cls, fullname, path=None):
-            try:
-                return VimModuleLoader(
-                    _find_module(fullname, fullname, path or _get_paths()))
-            except ImportError:
-                return None
-
-        @classmethod
-        def load_module(cls, fullname, path=None):
-            return _find_module(fullname, fullname, path or _get_paths())
-
-    def hook(path):
-        if path == nvim.VIM_SPECIAL_PATH:
-            return VimPathFinder
-        else:
-            raise ImportError
 
-    return hook
+def module_name(name):
+    if IS_PYTHON3 and isinstance(name, bytes):
+        return name.decode('utf-8')
+    return name
 
 
 def discover_runtime_directories(nvim):
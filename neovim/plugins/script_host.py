@@ -1,13 +1,47 @@
 import imp
 import logging
+import os
 import sys
+import types
 
+from .code_cache import CodeCache
 from ..api.common import SessionHook
 
 
 logger = logging.getLogger(__name__)
 debug, warn = (logger.debug, logger.warn,)
 
+# Parameters for batching `python_do_range` requests. The first batch has a
+# fixed number of lines, the next ones are sized by the average line length
+# to transfer approximately PYDO_BATCH_BYTES at a time.
+PYDO_INITIAL_BATCH = 5000
+PYDO_MIN_BATCH = 100
+PYDO_MAX_BATCH = 100000
+PYDO_BATCH_BYTES = 512 * 1024
+PYDO_RUN_GAP = 8
+# Batches smaller than this are always processed serially
+PYDO_PARALLEL_MIN_BATCH = 1000
+
+# Modules without side effects outside of the transformed line, which can be
+# used in parallel `python_do_range` workers
+PURE_MODULES = frozenset(['re', 'string', 'math', 'cmath', 'decimal',
+                          'fractions', 'itertools', 'functools', 'operator',
+                          'collections', 'datetime', 'json', 'base64',
+                          'binascii', 'hashlib', 'textwrap', 'unicodedata',
+                          'difflib'])
+
+# Builtins with side effects outside of the transformed line, which can't be
+# used in parallel `python_do_range` workers
+IMPURE_BUILTINS = frozenset(['print', 'input', 'raw_input', 'open', 'file',
+                             'exec', 'execfile', 'eval', 'compile',
+                             '__import__', 'reload', 'globals', 'locals',
+                             'vars', 'exit', 'quit', 'help'])
+
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+
 
 class ScriptHost(object):
     """
@@ -23,14 +57,22 @@ class ScriptHost(object):
         # it seems some plugins assume 'sys' is already imported, so do it now
         exec('import sys', self.module.__dict__)
         sys.modules['vim'] = nvim.with_hook(LegacyEvalHook())
+        # Number of processes used by `python_do_range`, parallel execution
+        # is disabled unless NVIM_PYTHON_PYDO_PROCESSES is set
+        try:
+            self.pydo_processes = int(
+                os.environ.get('NVIM_PYTHON_PYDO_PROCESSES', '0'))
+        except ValueError:
+            self.pydo_processes = 0
+        self._pydo_pool = None
+        # compiled code of executed/evaluated strings and files
+        self.code_cache = CodeCache()
 
     def python_execute(self, script):
-        exec(script, self.module.__dict__)
+        exec(self.code_cache.compile(script), self.module.__dict__)
 
     def python_execute_file(self, file_path):
-        with open(file_path) as f:
-            script = compile(f.read(), file_path, 'exec')
-            exec(script, self.module.__dict__)
+        exec(self.code_cache.compile_file(file_path), self.module.__dict__)
 
     def python_do_range(self, start, stop, code):
         nvim = self.nvim
@@ -47,26 +89,198 @@ class ScriptHost(object):
         exec(function_def, self.module.__dict__)
         # get the function
         function = self.module.__dict__[fname]
+        transform = self._pydo_transform(function, function_def)
+        # Resolve the buffer once, it can't change while the code runs
+        buf = nvim.current.buffer
+        session = nvim.session
+        batch_size = PYDO_INITIAL_BATCH
+        lines = []
+        if start <= stop:
+            lines = buf.get_line_slice(start,
+                                       min(start + batch_size - 1, stop),
+                                       True, True)
         while start <= stop:
-            # Process batches of 5000 to avoid the overhead of making multiple
-            # API calls for every line. Assuming an average line length of 100
-            # bytes, approximately 488 kilobytes will be transferred per batch,
-            # which can be done very quickly in a single API call.
             sstart = start
-            sstop = min(start + 5000, stop)
-            lines = nvim.current.buffer.get_line_slice(sstart, sstop, True, True)
-            for i, line in enumerate(lines):
-                linenr = i + sstart + 1
-                result = str(function(line, linenr))
-                if result:
-                    lines[i] = result
-            start = sstop + 1
-            nvim.current.buffer.set_line_slice(sstart, sstop, True, True, lines)
+            start += len(lines)
+            changed = transform(sstart, lines)
+            # Only send back the runs of lines that were modified
+            calls = []
+            for first, last in _runs(changed):
+                calls.append(('buffer_set_line_slice',
+                              (buf, sstart + first, sstart + last, True, True,
+                               lines[first:last + 1]),))
+            if start <= stop:
+                # Fetch the next batch in the same round trip. Batches are
+                # sized to transfer approximately PYDO_BATCH_BYTES, based
+                # on the line length observed in the current one.
+                size = sum(len(line) for line in lines) + len(lines)
+                batch_size = int(PYDO_BATCH_BYTES * len(lines) / (size or 1))
+                batch_size = max(PYDO_MIN_BATCH,
+                                 min(PYDO_MAX_BATCH, batch_size))
+                calls.append(('buffer_get_line_slice',
+                              (buf, start, min(start + batch_size - 1, stop),
+                               True, True),))
+            results = session.pipeline(calls)
+            for err, _ in results:
+                if err:
+                    raise err
+            if start <= stop:
+                lines = results[-1][1]
+                if not lines:
+                    break
         # delete the function
         del self.module.__dict__[fname]
 
     def python_eval(self, expr):
-        return eval(expr, self.module.__dict__)
+        code = self.code_cache.compile(expr, mode='eval')
+        return eval(code, self.module.__dict__)
+
+    def shutdown(self):
+        """Stop the `:pydo` worker processes, called by the plugin host."""
+        if self._pydo_pool:
+            self._pydo_pool.close()
+            self._pydo_pool.join()
+            self._pydo_pool = None
+
+    def python_code_cache_stats(self):
+        stats = dict(self.code_cache.stats)
+        stats['size'] = len(self.code_cache)
+        return stats
+
+    def _pydo_transform(self, function, function_def):
+        """Return a function that applies `function` to a batch of lines.
+
+        The returned function modifies the batch in place and returns the
+        sorted indexes of the lines that changed. When parallel execution is
+        enabled and `function` only depends on builtins and `PURE_MODULES`,
+        large batches are split among a pool of processes.
+
+        The processes are spawned rather than forked(python 3.4+ only), so
+        they don't share the msgpack-rpc channel state, and their stdout is
+        redirected to stderr.
+        """
+        def serial(start, lines):
+            return _pydo_lines(function, start, lines)
+
+        if self.pydo_processes < 2:
+            return serial
+        modules = _pure_globals(function.__code__, self.module.__dict__)
+        if modules is None:
+            debug('pydo code depends on the host state, running serially')
+            return serial
+        if not self._pydo_pool:
+            import multiprocessing
+            if not hasattr(multiprocessing, 'get_context'):
+                debug('parallel pydo requires python 3.4+, running serially')
+                return serial
+            context = multiprocessing.get_context('spawn')
+            self._pydo_pool = context.Pool(self.pydo_processes,
+                                           _pydo_worker_init)
+        pool = self._pydo_pool
+        chunks = self.pydo_processes * 4
+
+        def parallel(start, lines):
+            if len(lines) < PYDO_PARALLEL_MIN_BATCH:
+                return serial(start, lines)
+            size = -(-len(lines) // chunks)
+            jobs = [(function_def, modules, i, start, lines[i:i + size])
+                    for i in range(0, len(lines), size)]
+            changed = []
+            for chunk in pool.map(_pydo_chunk, jobs):
+                for i, result in chunk:
+                    lines[i] = result
+                    changed.append(i)
+            return changed
+        return parallel
+
+
+def _pydo_lines(function, start, lines):
+    """Apply a `:pydo` function to `lines`, returning the changed indexes."""
+    changed = []
+    for i, line in enumerate(lines):
+        result = function(line, i + start + 1)
+        if result is None:
+            continue
+        result = str(result)
+        if result and result != line:
+            lines[i] = result
+            changed.append(i)
+    return changed
+
+
+_pydo_functions = {}
+
+
+def _pydo_worker_init():
+    """Redirect the stdout of a pool process, the msgpack-rpc channel."""
+    sys.stdout.flush()
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+
+
+def _pydo_chunk(job):
+    """Process a chunk of a `:pydo` batch in a worker process.
+
+    The function is defined from its source(code objects can't be pickled)
+    in a namespace containing the modules it references, and cached for the
+    next chunks.
+    """
+    function_def, modules, offset, start, lines = job
+    key = (function_def, modules)
+    function = _pydo_functions.get(key)
+    if not function:
+        namespace = {'__builtins__': builtins}
+        for name, module_name in modules:
+            __import__(module_name)
+            namespace[name] = sys.modules[module_name]
+        exec(function_def, namespace)
+        function = namespace['_vim_pydo']
+        _pydo_functions.clear()
+        _pydo_functions[key] = function
+    changed = _pydo_lines(function, start + offset, lines)
+    return [(offset + i, lines[i]) for i in changed]
+
+
+def _pure_globals(code, namespace):
+    """Check if `code` can run outside of the host process.
+
+    Return a tuple of `(name, module_name)` pairs for the global names bound
+    to modules in `namespace`, or None if `code`(or a nested code object)
+    references any other global, a module not in `PURE_MODULES` or a builtin
+    with side effects.
+    """
+    modules = set()
+    codes = [code]
+    while codes:
+        code = codes.pop()
+        for name in code.co_names:
+            value = namespace.get(name)
+            if isinstance(value, types.ModuleType):
+                if value.__name__ not in PURE_MODULES:
+                    return None
+                modules.add((name, value.__name__,))
+            elif name in namespace or name in IMPURE_BUILTINS:
+                # attribute names also appear in `co_names`, so this may
+                # reject some pure code, but never accepts impure code
+                return None
+        codes.extend(c for c in code.co_consts
+                     if isinstance(c, types.CodeType))
+    return tuple(sorted(modules))
+
+
+def _runs(indexes):
+    """Group sorted `indexes` into `(first, last)` pairs of consecutive runs.
+
+    Runs separated by fewer than PYDO_RUN_GAP unchanged lines are merged, so
+    sparse changes don't turn into one request per line.
+    """
+    runs = []
+    for i in indexes:
+        if runs and i - runs[-1][1] <= PYDO_RUN_GAP:
+            runs[-1][1] = i
+        else:
+            runs.append([i, i])
+    return runs
 
 
 class LegacyEvalHook(SessionHook):
@@ -0,0 +1,178 @@
+import logging
+import time
+
+import greenlet
+
+from ..msgpack_rpc.greenlet_trace import add_tracer, remove_tracer
+
+try:
+    import tracemalloc
+except ImportError:
+    # python < 3.4
+    tracemalloc = None
+
+_reset_peak = getattr(tracemalloc, 'reset_peak', None)
+
+
+logger = logging.getLogger(__name__)
+debug, info, warn = (logger.debug, logger.info, logger.warn,)
+
+
+try:
+    cpu_clock = time.process_time
+except AttributeError:
+    # python 2, `time.clock` measures CPU time on unix
+    cpu_clock = time.clock
+
+
+class _Call(object):
+    __slots__ = ('totals', 'started', 'switched_in', 'cpu_in', 'memory_in',
+                 'requests_in', 'cpu', 'memory', 'peak_memory', 'rpcs')
+
+    def __init__(self, totals):
+        self.totals = totals
+        self.started = time.time()
+        self.switched_in = None
+        self.cpu = 0.0
+        self.memory = 0
+        self.peak_memory = 0
+        self.rpcs = 0
+
+
+class PluginStats(object):
+    """
+    Accounting of the resources used by plugin handlers, by plugin class and
+    by handler(method or event name).
+
+    Handlers run in greenlets that switch out while waiting for responses
+    from Nvim, so greenlet switches are followed(see
+    `neovim.msgpack_rpc.greenlet_trace`) to only account CPU time, memory
+    and requests of `session` while the handler is running. For each plugin
+    and handler, the following totals are kept:
+
+    - `count`: number of invocations
+    - `wall`: time from start to end of the invocations
+    - `cpu`: process CPU time spent running the handler greenlet
+    - `rpcs`: number of times the handler waited for Nvim(each request,
+      pipeline or `wait_for`, see `Session.request_count`)
+    - `memory`: net memory allocated while running(only if `memory` is True
+      and `tracemalloc` is available, which starts tracing)
+    - `max_memory`: largest net allocation of a single invocation
+    - `peak_memory`: largest amount of memory allocated at once by a single
+      invocation(python 3.9+, where `tracemalloc.reset_peak` exists)
+    """
+    def __init__(self, session, memory=False):
+        self.session = session
+        self.memory = bool(memory and tracemalloc)
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.plugins = {}
+        self.handlers = {}
+        self._running = {}
+        add_tracer(self._trace)
+
+    def close(self):
+        """Stop following greenlet switches."""
+        remove_tracer(self._trace)
+
+    def call(self, plugin, name, handler, args):
+        """Call `handler` with `args`, accounting it to `plugin` and `name`."""
+        gr = greenlet.getcurrent()
+        call = _Call((self._totals(self.plugins, plugin),
+                      self._totals(self.handlers,
+                                   '{0}.{1}'.format(plugin, _str(name)))))
+        outer = self._running.get(gr)
+        if outer is not None:
+            # nested call in the same greenlet
+            self._switched_out(outer)
+        self._running[gr] = call
+        self._switched_in(call)
+        try:
+            return handler(*args)
+        finally:
+            self._switched_out(call)
+            if outer is not None:
+                self._running[gr] = outer
+                self._switched_in(outer)
+            else:
+                del self._running[gr]
+            wall = time.time() - call.started
+            for totals in call.totals:
+                totals['count'] += 1
+                totals['wall'] += wall
+                totals['cpu'] += call.cpu
+                totals['rpcs'] += call.rpcs
+                if self.memory:
+                    totals['memory'] += call.memory
+                    totals['max_memory'] = max(totals['max_memory'],
+                                               call.memory)
+                    totals['peak_memory'] = max(totals['peak_memory'],
+                                                call.peak_memory)
+
+    def to_dict(self):
+        """Return the totals by plugin and by handler."""
+        return {
+            'plugins': self.plugins,
+            'handlers': self.handlers,
+            'memory': self.memory,
+        }
+
+    def _totals(self, mapping, key):
+        totals = mapping.get(key)
+        if totals is None:
+            totals = mapping[key] = {'count': 0, 'wall': 0.0, 'cpu': 0.0,
+                                     'rpcs': 0}
+            if self.memory:
+                totals['memory'] = 0
+                totals['max_memory'] = 0
+                totals['peak_memory'] = 0
+        return totals
+
+    def _trace(self, event, args):
+        if event in ('switch', 'throw'):
+            origin, target = args
+            call = self._running.get(origin)
+            if call is not None and not origin.dead:
+                self._switched_out(call)
+            call = self._running.get(target)
+            if call is not None:
+                self._switched_in(call)
+
+    def _switched_in(self, call):
+        call.switched_in = True
+        call.cpu_in = cpu_clock()
+        call.requests_in = self.session.request_count
+        if self.memory:
+            if _reset_peak:
+                _reset_peak()
+            call.memory_in = tracemalloc.get_traced_memory()[0]
+
+    def _switched_out(self, call):
+        if not call.switched_in:
+            return
+        call.switched_in = False
+        call.cpu += cpu_clock() - call.cpu_in
+        call.rpcs += self.session.request_count - call.requests_in
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            call.memory += current - call.memory_in
+            if _reset_peak:
+                call.peak_memory = max(call.peak_memory, peak - call.memory_in)
+
+
+def plugin_name(handler):
+    """Return the name of the plugin class that owns `handler`."""
+    plugin = getattr(handler, 'plugin', None)
+    if plugin is not None and hasattr(plugin, 'description'):
+        # LazyHandler
+        return plugin.name
+    owner = getattr(handler, '__self__', None)
+    if owner is not None:
+        return type(owner).__name__
+    return getattr(handler, '__name__', repr(handler))
+
+
+def _str(name):
+    if isinstance(name, bytes) and not isinstance(name, str):
+        return name.decode('utf-8', 'replace')
+    return name
@@ -0,0 +1,319 @@
+import logging
+import sys
+import threading
+import time
+from traceback import format_exc
+
+from ..api import NvimError
+from ..msgpack_rpc import spawn_session
+from ..msgpack_rpc.session import ErrorResponse
+
+
+logger = logging.getLogger(__name__)
+debug, info, warn = (logger.debug, logger.info, logger.warn,)
+
+
+# Notification posted to sessions(from any thread) to run a function in a
+# greenlet of the session's event loop. It is never sent to another process.
+CALL = 'nvim-python-worker-call'
+# Notification sent by workers after installing their plugins, with the
+# names of the requests and events they handle
+READY = 'nvim-python-worker-ready'
+
+
+class WorkerError(Exception):
+    """Error response received from a worker process."""
+    def __init__(self, error):
+        super(WorkerError, self).__init__(error)
+        self.error = error
+
+
+class WorkerPool(object):
+    """
+    Runs plugin modules in worker processes, so independent plugins don't
+    share an interpreter(and a GIL) and a crashed plugin doesn't take the
+    whole host down.
+
+    Each worker is a python process running its own `PluginHost` over stdio,
+    restricted to a subset of the plugin modules. From the worker's point of
+    view, the pool is Nvim: requests and notifications sent by the worker
+    are forwarded to Nvim, and requests/notifications sent by Nvim to methods
+    or events handled by a worker are forwarded to it. Forwarded messages
+    are passed through without applying session hooks, so buffers, windows
+    and tabpages remain as msgpack ext objects.
+
+    The session of each worker runs in a separate thread, messages are
+    exchanged with the main event loop through `Session.post` and
+    `Session.wait_for`. Workers that exit are restarted. Requests for the
+    methods of a worker that isn't running fail immediately.
+
+    Requests received before all workers are ready wait until the workers
+    are ready, exit or `start_timeout` seconds elapse.
+
+    Error responses are forwarded as sent by Nvim or the worker, except that
+    errors raised by the main session are converted back to `[type,
+    message]` pairs before being sent to workers.
+
+    `workers` is either 'plugin', for one worker per plugin module, or the
+    number of workers the plugin modules are distributed among.
+    """
+    start_timeout = 10
+
+    def __init__(self, host, modules, workers='plugin'):
+        self.host = host
+        session = host.nvim.session
+        self.session = getattr(session, 'wrapped_session', session)
+        if workers == 'plugin':
+            shards = [[module] for module in modules]
+        else:
+            count = int(workers)
+            shards = [modules[i::count] for i in range(count)]
+        self.workers = [Worker(self, shard) for shard in shards if shard]
+        self.method_routes = {}
+        self.event_routes = {}
+        # Workers that weren't ready since the pool started
+        self.starting = set(self.workers)
+        self._ready_waiters = []
+        self._start_timer = None
+        self._request_cb = self._notification_cb = None
+
+    def start(self):
+        # Workers don't watch 'runtimepath' since the autocmd notifies the
+        # main channel, the notification is forwarded to them instead
+        self.session.add_notification_handler(
+            self.host.finder.notification, self._on_runtimepath_changed)
+        self._start_timer = threading.Timer(
+            self.start_timeout, lambda: self.call(self._start_timed_out))
+        self._start_timer.daemon = True
+        self._start_timer.start()
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self):
+        if self._start_timer:
+            self._start_timer.cancel()
+        self.session.remove_notification_handler(
+            self.host.finder.notification, self._on_runtimepath_changed)
+        for worker in self.workers:
+            worker.stop()
+
+    def run(self):
+        session = self.host.nvim.session
+        self._request_cb, self._notification_cb = session.filter_callbacks(
+            self.host.on_request, self.host.on_notification)
+        self.session.run(self._on_request, self._on_notification)
+
+    def call(self, fn):
+        """Run `fn` in a greenlet of the main event loop(thread-safe)."""
+        self.session.post(CALL, fn)
+
+    def forward_request(self, name, args, resolve):
+        """Send a request from a worker to Nvim.
+
+        `resolve` is called with an `(error, result)` pair as the result.
+        """
+        try:
+            resolve(None, (None, self.session.request(name, *args),))
+        except Exception as err:
+            resolve(None, ([0, _error_message(err)], None,))
+
+    def forward_notification(self, name, args):
+        self.session.notify(name, *args)
+
+    def worker_ready(self, worker, methods, events):
+        info('worker %s is ready', worker)
+        self._remove_routes(worker)
+        for name in methods:
+            self.method_routes.setdefault(name, worker)
+        for name in events:
+            self.event_routes.setdefault(name, []).append(worker)
+        self._started(worker)
+
+    def worker_exited(self, worker):
+        # The method routes are kept until the worker is ready again, so its
+        # requests fail instead of waiting or reaching the host
+        if worker in self.starting:
+            warn('%s exited before being ready', worker)
+            self._started(worker)
+
+    def _on_request(self, name, args):
+        host = self.host
+        if name in host.method_handlers or name in host.handler_index:
+            return self._request_cb(name, args)
+        # Requests may arrive before all workers are ready
+        if name not in self.method_routes and self.starting:
+            self.session.wait_for(self._wait_ready)
+        worker = self.method_routes.get(name)
+        if not worker:
+            return self._request_cb(name, args)
+        return worker.request(name, args)
+
+    def _on_notification(self, name, args):
+        if name == CALL.encode('utf-8'):
+            args[0]()
+            return
+        for worker in self.event_routes.get(name, ()):
+            worker.notify(name, args)
+        self._notification_cb(name, args)
+
+    def _on_runtimepath_changed(self, args):
+        for worker in self.workers:
+            worker.notify(self.host.finder.notification, args)
+
+    def _started(self, worker):
+        self.starting.discard(worker)
+        if not self.starting:
+            waiters = self._ready_waiters
+            self._ready_waiters = []
+            for resolve in waiters:
+                resolve(None, None)
+
+    def _start_timed_out(self):
+        for worker in list(self.starting):
+            warn('%s not ready after %s seconds', worker, self.start_timeout)
+            self._started(worker)
+
+    def _wait_ready(self, resolve):
+        if self.starting:
+            self._ready_waiters.append(resolve)
+        else:
+            resolve(None, None)
+
+    def _remove_routes(self, worker):
+        for name, route in list(self.method_routes.items()):
+            if route is worker:
+                del self.method_routes[name]
+        for workers in self.event_routes.values():
+            if worker in workers:
+                workers.remove(worker)
+
+
+class Worker(object):
+    """A worker process and the thread running its session."""
+    restart_delay = 1
+
+    def __init__(self, pool, modules):
+        self.pool = pool
+        self.modules = modules
+        self.session = None
+        self.pending = {}
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def __repr__(self):
+        return '<Worker {0}>'.format(', '.join(self.modules))
+
+    def argv(self):
+        return [sys.executable, '-c',
+                'from neovim.plugins.workers import worker_main; '
+                'worker_main()'] + list(self.modules)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+        session = self.session
+        if session:
+            session.post(CALL, session.stop)
+
+    def request(self, name, args):
+        """Forward a request to the worker process(main thread).
+
+        Error responses of the worker are sent to Nvim unchanged.
+        """
+        def start(resolve):
+            key = object()
+            self.pending[key] = resolve
+
+            def call():
+                err = rv = None
+                try:
+                    rv = self.session.request(name, *args)
+                except WorkerError as e:
+                    err = e.error
+                if self.pending.pop(key, None):
+                    resolve(None, (err, rv,))
+
+            if not self._post(call):
+                self.pending.pop(key, None)
+                resolve(None, ('{0} is not running'.format(self), None,))
+
+        err, rv = self.pool.session.wait_for(start)
+        if err:
+            raise ErrorResponse(err)
+        return rv
+
+    def notify(self, name, args):
+        """Forward a notification to the worker process(main thread)."""
+        self._post(lambda: self.session.notify(name, *args))
+
+    def _post(self, fn):
+        session = self.session
+        if session is None:
+            return False
+        session.post(CALL, fn)
+        return True
+
+    def _run(self):
+        while not self.stopped:
+            try:
+                info('starting %s', self)
+                session = spawn_session(self.argv())
+                session.error_wrapper = WorkerError
+                self.session = session
+                session.run(self._on_request, self._on_notification)
+            except Exception:
+                warn('%s exited: %s', self, format_exc(5))
+            self.session = None
+            pending = self.pending
+            self.pending = {}
+            for resolve in pending.values():
+                resolve(None, ('{0} exited'.format(self), None,))
+            self.pool.call(lambda: self.pool.worker_exited(self))
+            if not self.stopped:
+                time.sleep(self.restart_delay)
+
+    def _on_request(self, name, args):
+        # A plugin in the worker is calling the Nvim API
+        session = self.session
+        err, rv = session.wait_for(lambda resolve: self.pool.call(
+            lambda: self.pool.forward_request(name, args, resolve)))
+        if err:
+            raise ErrorResponse(err)
+        return rv
+
+    def _on_notification(self, name, args):
+        if name == CALL.encode('utf-8'):
+            args[0]()
+        elif name == READY.encode('utf-8'):
+            self.pool.call(lambda: self.pool.worker_ready(self, *args))
+        else:
+            self.pool.call(
+                lambda: self.pool.forward_notification(name, args))
+
+
+def _error_message(err):
+    """Return the message of an error raised by a session request."""
+    if isinstance(err, NvimError) and len(err.args) == 1:
+        # Keep the message sent by Nvim
+        return err.args[0]
+    return str(err)
+
+
+def worker_main():
+    """Entry point of worker processes.
+
+    The names of the plugin modules loaded by the worker are passed as
+    command line arguments.
+    """
+    from .. import setup_logging, stdio_session
+    from ..api import Nvim
+    from .plugin_host import PluginHost
+    setup_logging('worker')
+    nvim = Nvim.from_session(stdio_session())
+    with PluginHost(nvim, only=sys.argv[1:]) as host:
+        methods = list(host.method_handlers) + list(host.handler_index)
+        nvim.session.notify(READY, methods, list(host.event_handlers))
+        host.run()
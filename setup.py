@@ -7,6 +7,10 @@ install_requires = [
     'msgpack-python',
 ]
 
+if sys.version_info < (2, 7):
+    # OrderedDict was added to the collections module on 2.7
+    install_requires.append('ordereddict')
+
 if sys.version_info < (3, 4):
     # trollius is just a backport of 3.4 asyncio module
     install_requires.append('trollius')
@@ -3,17 +3,26 @@ import os
 import sys
 
 import neovim
+from neovim import msgpack_rpc
 
 from nose.tools import eq_ as eq
 
 
-session = None
+def new_session(**kwargs):
+    """Create a session to the Nvim used by the tests.
+
+    With `NVIM_SPAWN_ARGV`, a new Nvim instance is spawned. Keyword arguments
+    are passed to `neovim.msgpack_rpc.session`.
+    """
+    if 'NVIM_SPAWN_ARGV' in os.environ:
+        argv = json.loads(os.environ['NVIM_SPAWN_ARGV'])
+        return msgpack_rpc.session('spawn', argv, **kwargs)
+    return msgpack_rpc.session('socket', os.environ['NVIM_LISTEN_ADDRESS'],
+                               **kwargs)
+
+
+session = new_session()
 vim = None
-if 'NVIM_SPAWN_ARGV' in os.environ:
-    argv = json.loads(os.environ['NVIM_SPAWN_ARGV'])
-    session = neovim.spawn_session(argv)
-else:
-    session = neovim.socket_session(os.environ['NVIM_LISTEN_ADDRESS'])
 
 vim = neovim.Nvim.from_session(session)
 
@@ -1,6 +1,7 @@
 import os
 from nose.tools import with_setup, eq_ as eq, ok_ as ok
 from common import vim, cleanup
+from neovim.api import Buffer
 
 
 @with_setup(setup=cleanup)
@@ -51,6 +52,17 @@ def test_get_set_del_slice():
     eq(vim.current.buffer[:], [''])
 
 
+@with_setup(setup=cleanup)
+def test_large_slice():
+    # large line lists are sent in chunks
+    lines = ['line {0}'.format(i) for i in range(100000)]
+    vim.current.buffer[:] = lines
+    eq(len(vim.current.buffer), 100000)
+    eq(vim.current.buffer[:], lines)
+    vim.current.buffer[1:-1] = tuple(lines[:5000])
+    eq(vim.current.buffer[:], lines[:1] + lines[:5000] + lines[-1:])
+
+
 @with_setup(setup=cleanup)
 def test_vars():
     vim.current.buffer.vars['python'] = [1, 2, {'3': 1}]
@@ -127,3 +139,15 @@ def test_get_exceptions():
         ok(False)
     except vim.error:
         pass
+
+
+@with_setup(setup=cleanup)
+def test_api_bindings():
+    buffer = vim.current.buffer
+    buffer.api.set_line(0, 'abc')
+    eq(buffer.api.get_line(0), 'abc')
+    eq(buffer.api.line_count(), 1)
+    # Bindings are passed to objects created directly
+    eq(Buffer(vim.session, buffer.code_data, vim.bindings).api.line_count(),
+       1)
+    ok(not hasattr(Buffer(vim.session, buffer.code_data), 'api'))
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
-from nose.tools import with_setup, eq_ as eq
-from common import vim, cleanup
+import greenlet
+from nose.tools import with_setup, eq_ as eq, ok_ as ok
+from common import vim, cleanup, new_session
 
 cid = vim.channel_id
 
@@ -73,3 +74,58 @@ def test_recursion():
 
     vim.session.post('setup3')
     vim.session.run(request_cb, notification_cb)
+
+
+@with_setup(setup=cleanup)
+def test_deferred_error():
+    def notification_cb(name, args):
+        eq(name, 'setup4')
+        cmd = 'let g:result = rpcrequest(%d, "client-call4")' % cid
+        try:
+            vim.command(cmd)
+            ok(False)
+        except vim.error as err:
+            # The handler's error isn't replaced by the deferred one
+            ok('handler error' in str(err))
+        vim.session.stop()
+
+    def request_cb(name, args):
+        def deferred():
+            raise Exception('deferred error')
+        vim.session.defer(deferred)
+        raise Exception('handler error')
+
+    vim.session.post('setup4')
+    vim.session.run(request_cb, notification_cb)
+
+
+@with_setup(setup=cleanup)
+def test_handler_data():
+    outside = vim.session.handler_data()
+    ok(vim.session.handler_data() is outside)
+    data = []
+
+    def notification_cb(name, args):
+        data.append(vim.session.handler_data())
+        # Greenlets started by the handler share its data
+        child = greenlet.greenlet(vim.session.handler_data).switch()
+        ok(child is data[0])
+        vim.session.stop()
+
+    vim.session.post('setup5')
+    vim.session.run(None, notification_cb)
+    ok(data[0] is not outside)
+    ok(greenlet.greenlet(vim.session.handler_data).switch() is outside)
+
+
+def test_max_buffer_size():
+    session = new_session(max_buffer_size=1024)
+    eq(len(session.request('vim_eval', 'repeat("x", 10)')), 10)
+    for _ in range(2):
+        # the session can't be used after receiving a large message
+        try:
+            session.request('vim_eval', 'repeat("x", 4096)')
+            ok(False)
+        except IOError as err:
+            ok('larger than 1024 bytes' in str(err) or
+               'invalid msgpack data' in str(err))
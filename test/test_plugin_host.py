@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import sys
+import tempfile
+
+import greenlet
+from nose.tools import eq_ as eq, ok_ as ok
+
+from neovim.msgpack_rpc.profiler import Profiler
+from neovim.plugins.manifest import (LazyHandler, PluginManifest,
+                                     describe_plugin, is_lazy)
+from neovim.plugins.plugin_host import PluginHost, RedirectStream
+from neovim.plugins.stats import PluginStats
+
+
+class FakeSession(object):
+    tracer = None
+    request_count = 0
+
+    def __init__(self):
+        self.notifications = []
+        self.notification_handlers = {}
+        self.deferred = None
+
+    def notify(self, method, *args):
+        self.notifications.append((method,) + args)
+
+    def add_notification_handler(self, name, callback):
+        self.notification_handlers.setdefault(name, []).append(callback)
+
+    def remove_notification_handler(self, name, callback):
+        self.notification_handlers[name].remove(callback)
+
+    def defer(self, callback):
+        if self.deferred is None:
+            # not running a handler
+            return False
+        self.deferred.append(callback)
+        return True
+
+    def run_handler(self, handler):
+        self.deferred = []
+        try:
+            handler()
+        finally:
+            for callback in self.deferred:
+                callback()
+            self.deferred = None
+
+
+class FakeNvim(object):
+    metadata = {'features': {}}
+    channel_id = 1
+
+    def __init__(self, runtime_paths=()):
+        self.session = FakeSession()
+        self.runtime_paths = list(runtime_paths)
+        self.commands = []
+
+    def command(self, command):
+        self.commands.append(command)
+
+    def list_runtime_paths(self):
+        return self.runtime_paths
+
+
+def test_redirect_partial_line_outside_handler():
+    nvim = FakeNvim()
+    stream = RedirectStream(nvim, 'vim_out_write')
+    stream.write('partial')
+    eq(nvim.session.notifications, [('vim_out_write', 'partial')])
+
+
+def test_redirect_partial_line_in_handler():
+    nvim = FakeNvim()
+    stream = RedirectStream(nvim, 'vim_out_write')
+
+    def handler():
+        stream.write('a')
+        stream.write('b')
+        eq(nvim.session.notifications, [])
+
+    nvim.session.run_handler(handler)
+    eq(nvim.session.notifications, [('vim_out_write', 'ab')])
+
+
+def test_redirect_rate_limit():
+    nvim = FakeNvim()
+    stream = RedirectStream(nvim, 'vim_out_write', rate_limit=10)
+    stream.write('12345\n67890\nabc\n')
+    # only complete lines are sent
+    eq(nvim.session.notifications, [('vim_out_write', '12345\n')])
+    eq(stream.dropped, 10)
+    stream.write('too long to fit\n')
+    eq(len(nvim.session.notifications), 1)
+    eq(stream.dropped, 26)
+    # a second later, the dropped output is reported
+    stream._last_check -= 1
+    stream.write('x\n')
+    eq(nvim.session.notifications[1],
+       ('vim_out_write', '[26 characters of output dropped]\nx\n'))
+    eq(stream.dropped, 0)
+
+
+PLUGIN_MODULE = """
+class NvimPlugin(object):
+    lazy = {lazy}
+
+    def __init__(self, nvim):
+        if {fail}:
+            raise Exception('constructor failed')
+
+    def {method}(self):
+        return 'called'
+"""
+
+
+def with_plugin(name, lazy=False, fail=False):
+    """Call the test with a manifest and a runtime path with one plugin."""
+    def decorator(test):
+        def wrapper():
+            root = tempfile.mkdtemp()
+            try:
+                os.mkdir(os.path.join(root, 'pythonx'))
+                path = os.path.join(root, 'pythonx', 'nvim_' + name + '.py')
+                with open(path, 'w') as f:
+                    f.write(PLUGIN_MODULE.format(lazy=lazy, fail=fail,
+                                                 method=name))
+                cache = os.path.join(root, 'cache')
+                test(root.encode('utf-8'), cache, os.path.realpath(path))
+            finally:
+                shutil.rmtree(root)
+        wrapper.__name__ = test.__name__
+        return wrapper
+    return decorator
+
+
+def new_host(root, cache):
+    host = PluginHost(FakeNvim([root]), manifest=PluginManifest(cache))
+    host.install_plugins()
+    return host
+
+
+def recorded(cache):
+    return dict((os.path.realpath(path), entry) for path, entry
+                in PluginManifest(cache).entries.items())
+
+
+@with_plugin('manifest_eager')
+def test_manifest_eager(root, cache, path):
+    host = new_host(root, cache)
+    eq(len(host.installed_plugins), 1)
+    entry = recorded(cache)[path]
+    eq(entry['plugins'][0]['methods'], ['manifest_eager'])
+    # Plugins that aren't lazy are always constructed at startup
+    host = new_host(root, cache)
+    eq(len(host.installed_plugins), 1)
+    eq(host.lazy_plugins, [])
+
+
+@with_plugin('manifest_lazy', lazy=True)
+def test_manifest_lazy(root, cache, path):
+    host = new_host(root, cache)
+    eq(len(host.installed_plugins), 1)
+    host = new_host(root, cache)
+    eq(len(host.installed_plugins), 0)
+    eq(len(host.lazy_plugins), 1)
+    ok(isinstance(host.handler_index[b'manifest_lazy'], LazyHandler))
+    # The plugin is constructed by the first call
+    eq(host.on_request(b'manifest_lazy', []), 'called')
+    eq(len(host.installed_plugins), 1)
+    # and the index rebuilt with the methods of the instance
+    handler = host.handler_index[b'manifest_lazy']
+    ok(handler.__self__ is host.installed_plugins[0])
+    eq(host.on_request(b'manifest_lazy', []), 'called')
+
+
+@with_plugin('manifest_fail', lazy=True, fail=True)
+def test_manifest_constructor_error(root, cache, path):
+    host = new_host(root, cache)
+    eq(host.installed_plugins, [])
+    # Modules aren't recorded until their plugins are installed
+    ok(path not in recorded(cache))
+
+
+def test_manifest_without_plugins():
+    # Modules without plugin classes are always imported
+    ok(not is_lazy({'plugins': []}))
+    ok(is_lazy({'plugins': [{'lazy': True}]}))
+
+
+def test_manifest_save_error():
+    cache = tempfile.mkdtemp()
+    try:
+        manifest = PluginManifest(cache)
+        manifest.add_module(cache, 'module', cache, [])
+        # The manifest can't replace a directory
+        os.mkdir(manifest.path)
+        manifest.save()
+        eq(os.listdir(cache), [os.path.basename(manifest.path)])
+        eq(manifest.entries, {})
+    finally:
+        shutil.rmtree(cache)
+
+
+def test_finder_teardown():
+    nvim = FakeNvim()
+    saved_path = list(sys.path)
+    with PluginHost(nvim, manifest=PluginManifest(None)) as host:
+        finder = host.finder
+        ok(finder in sys.meta_path)
+        eq(len(nvim.session.notification_handlers[finder.notification]), 1)
+        ok('augroup nvim-python-runtimepath' in nvim.commands[0])
+    ok(finder not in sys.meta_path)
+    eq(sys.path, saved_path)
+    eq(nvim.session.notification_handlers[finder.notification], [])
+    ok('augroup! nvim-python-runtimepath' in nvim.commands[-1])
+
+
+def test_plugin_shutdown():
+    class Plugin(object):
+        stopped = False
+
+        def shutdown(self):
+            self.stopped = True
+
+    plugin = Plugin()
+    # Not registered as a handler of the 'teardown' event
+    eq(describe_plugin(Plugin, plugin)['events'], [])
+    with PluginHost(FakeNvim(), manifest=PluginManifest(None)) as host:
+        host.installed_plugins.append(plugin)
+    ok(plugin.stopped)
+
+
+def test_stats():
+    session = FakeSession()
+    saved_trace = greenlet.gettrace()
+    profiler = Profiler()
+    profiler.start()
+    stats = PluginStats(session)
+    # Tracers can be removed in any order
+    profiler.stop()
+
+    def handler():
+        # Other greenlet switches are not requests
+        greenlet.greenlet(lambda: None).switch()
+        session.request_count += 1
+        main.switch()
+        return 'result'
+
+    main = greenlet.getcurrent()
+    gr = greenlet.greenlet(
+        lambda: stats.call('Plugin', b'method', handler, []))
+    gr.switch()
+    ok(not gr.dead)
+    # Requests made by other handlers are not counted
+    session.request_count += 1
+    eq(gr.switch(), 'result')
+    stats.close()
+    eq(greenlet.gettrace(), saved_trace)
+    totals = stats.to_dict()['handlers']['Plugin.method']
+    eq(totals['count'], 1)
+    eq(totals['rpcs'], 1)
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import os
+import tempfile
 from nose.tools import with_setup, eq_ as eq, ok_ as ok
 from common import vim, cleanup
 
@@ -31,12 +32,56 @@ def host_teardown():
     ok(not vim.eval('has("python")'))
 
 
+def parallel_host_setup():
+    vim.command('let $NVIM_PYTHON_PYDO_PROCESSES = "2"')
+    host_setup()
+
+
+def parallel_host_teardown():
+    host_teardown()
+    vim.command('let $NVIM_PYTHON_PYDO_PROCESSES = ""')
+
+
+def stats_host_setup():
+    vim.command('let $NVIM_PYTHON_HOST_STATS = "1"')
+    host_setup()
+
+
+def stats_host_teardown():
+    host_teardown()
+    vim.command('let $NVIM_PYTHON_HOST_STATS = ""')
+
+
+profile_dir = tempfile.mkdtemp()
+
+
+def profile_host_setup():
+    vim.command('let $NVIM_PYTHON_PROFILE = "{0}"'.format(profile_dir))
+    host_setup()
+
+
+def profile_host_teardown():
+    host_teardown()
+    vim.command('let $NVIM_PYTHON_PROFILE = ""')
+
+
 @with_setup(setup=host_setup, teardown=host_teardown)
 def test_python_command():
     vim.command('python vim.command("let set_by_python = [100,0]")')
     eq(vim.vars['set_by_python'], [100, 0])
 
 
+@with_setup(setup=host_setup, teardown=host_teardown)
+def test_code_cache():
+    vim.command('let g:cached = 0')
+    stats = vim.eval('rpcrequest(g:pyhost_id, "python_code_cache_stats")')
+    for _ in range(3):
+        vim.command('python vim.vars["cached"] = vim.vars["cached"] + 1')
+    eq(vim.vars['cached'], 3)
+    updated = vim.eval('rpcrequest(g:pyhost_id, "python_code_cache_stats")')
+    eq(updated['hits'] - stats['hits'], 2)
+
+
 @with_setup(setup=host_setup, teardown=host_teardown)
 def test_python_nested_commands():
     nested = """python vim.command('python vim.command("python vim.command(\\'let set_by_nested_python = 555\\')")')"""
@@ -64,6 +109,60 @@ def test_pydo():
     eq(vim.current.buffer[:], ['1', '2', 'ghi'])
 
 
+@with_setup(setup=host_setup, teardown=host_teardown)
+def test_pydo_batches():
+    # enough lines for several batches, changing only some of them
+    vim.current.buffer[:] = [str(i) for i in range(12000)]
+    vim.command('2,11999pydo return "x" if linenr % 1000 == 0 else None')
+    expected = [str(i) for i in range(12000)]
+    for i in range(999, 11999, 1000):
+        expected[i] = 'x'
+    eq(vim.current.buffer[:], expected)
+
+
+@with_setup(setup=host_setup, teardown=host_teardown)
+def test_pydo_empty_range():
+    vim.current.buffer[:] = ['abc', 'def']
+    vim.eval('rpcrequest(g:pyhost_id, "python_do_range", 2, 1, "return 1")')
+    eq(vim.current.buffer[:], ['abc', 'def'])
+
+
+@with_setup(setup=parallel_host_setup, teardown=parallel_host_teardown)
+def test_pydo_parallel():
+    vim.current.buffer[:] = [str(i) for i in range(12000)]
+    vim.command('python import re')
+    # pure code is split among the worker processes
+    vim.command('%pydo return re.sub("0", "x", line)')
+    eq(vim.current.buffer[:], [str(i).replace('0', 'x') for i in range(12000)])
+    # code using vim runs serially in the host
+    vim.command('%pydo vim.vars["pydo_last"] = linenr')
+    eq(vim.vars['pydo_last'], 12000)
+
+
+@with_setup(setup=profile_host_setup, teardown=profile_host_teardown)
+def test_profile():
+    vim.command('python sum(range(1000))')
+    vim.command('python vim.eval("1")')
+    handlers = vim.eval('rpcrequest(g:pyhost_id, "python_host_profile")')
+    eq(handlers['python_execute']['count'], 2)
+    ok(handlers['python_execute']['blocked'] > 0)
+    ok(os.path.exists(os.path.join(profile_dir, 'python_execute.pstats')))
+    ok(os.path.exists(os.path.join(profile_dir, 'python_execute.collapsed')))
+
+
+@with_setup(setup=stats_host_setup, teardown=stats_host_teardown)
+def test_host_stats():
+    vim.command('python sum(range(1000))')
+    vim.command('python vim.eval("1")')
+    stats = vim.eval('rpcrequest(g:pyhost_id, "host_stats")')
+    execute = stats['handlers']['ScriptHost.python_execute']
+    # includes the `python import vim` from the setup
+    eq(execute['count'], 3)
+    eq(execute['rpcs'], 1)
+    ok(stats['plugins']['ScriptHost']['count'] >= 3)
+    eq(stats['dispatch_counts']['python_execute'], 3)
+
+
 @with_setup(setup=host_setup, teardown=host_teardown)
 def test_pyeval():
     vim.command('let python_expr = pyeval("[1, 2, 3]")')
@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
-import os, tempfile
+import json, os, tempfile, time
 from nose.tools import with_setup, eq_ as eq, ok_ as ok
 from common import vim, cleanup
+from neovim.api import SessionHook
+from neovim.api.eval_cache import EvalCache
+from neovim.msgpack_rpc.trace import Tracer
 
 
 @with_setup(setup=cleanup)
@@ -122,3 +125,241 @@ def test_tabpages():
     vim.current.tabpage = vim.tabpages[1]
     eq(vim.tabpages[1], vim.current.tabpage)
     eq(vim.windows[1], vim.current.window)
+
+
+@with_setup(setup=cleanup)
+def test_current_snapshot():
+    vim.current.line = 'abc'
+    vim.command('tabnew')
+    vim.current.line = 'def'
+    snapshot = vim.current.snapshot()
+    eq(snapshot.line, 'def')
+    eq(snapshot.buffer, vim.current.buffer)
+    eq(snapshot.window, vim.current.window)
+    eq(snapshot.tabpage, vim.current.tabpage)
+    eq(snapshot.tabpage, vim.tabpages[1])
+    vim.current.tabpage = vim.tabpages[0]
+    # The snapshot is not updated
+    eq(snapshot.line, 'def')
+    eq(vim.current.line, 'abc')
+
+
+@with_setup(setup=cleanup)
+def test_current_attach():
+    snapshot = vim.current.snapshot()
+    vim.current.attach(snapshot)
+    # Attached snapshots are shared by all hooked instances of the session
+    hooked = vim.with_hook(SessionHook())
+    eq(hooked.current.attached, snapshot)
+    hooked.current.detach()
+    eq(vim.current.attached, None)
+
+
+@with_setup(setup=cleanup)
+def test_vars_many():
+    vim.vars.set_many({'a': 1, 'b': [2, 3], 'c': 'd'})
+    eq(vim.eval('g:a'), 1)
+    eq(vim.vars.get_many(['a', 'b', 'c']), {'a': 1, 'b': [2, 3], 'c': 'd'})
+    eq(vim.vars.get_many(['a', 'missing'], default=None),
+       {'a': 1, 'missing': None})
+    try:
+        vim.vars.get_many(['missing'])
+        ok(False)
+    except vim.error:
+        pass
+
+
+@with_setup(setup=cleanup)
+def test_vars_write_behind():
+    vim.vars.set_write_behind()
+    try:
+        vim.vars['wb'] = 1
+        vim.vars['wb'] = 2
+        eq(vim.vars['wb'], 2)
+        eq(vim.eval('exists("g:wb")'), 0)
+        vim.vars.flush()
+        eq(vim.eval('g:wb'), 2)
+        del vim.vars['wb']
+        ok('wb' not in vim.vars)
+        try:
+            vim.vars['wb']
+            ok(False)
+        except vim.error:
+            pass
+        eq(vim.eval('exists("g:wb")'), 1)
+        # Only the requested keys are read from the pending writes
+        vim.command('let g:b = 2')
+        vim.vars['a'] = 1
+        del vim.vars['b']
+        eq(vim.vars.get_many(['a']), {'a': 1})
+    finally:
+        vim.vars.set_write_behind(False)
+    eq(vim.eval('exists("g:wb")'), 0)
+
+
+@with_setup(setup=cleanup)
+def test_api_bindings():
+    vim.api.set_current_line('abc')
+    eq(vim.api.get_current_line(), 'abc')
+    eq(vim.api.eval('1 + 1'), 2)
+    try:
+        vim.api.eval()
+        ok(False)
+    except TypeError:
+        pass
+
+
+@with_setup(setup=cleanup)
+def test_eval_cached():
+    cache = EvalCache(vim)
+    try:
+        vim.vars['cached'] = 1
+        eq(cache.eval('g:cached', ['User']), 1)
+        vim.vars['cached'] = 2
+        eq(cache.eval('g:cached', ['User']), 1)
+        vim.command('doautocmd User CacheTest')
+        eq(cache.eval('g:cached', ['User']), 2)
+        eq(cache.stats['hits'], 1)
+        eq(cache.stats['misses'], 2)
+        eq(cache.stats['invalidations'], 1)
+        # Autocmds removed from the group are restored by the next evaluation
+        vim.command('autocmd! {0}'.format(EvalCache.group))
+        cache.invalidate()
+        eq(len(cache), 0)
+        eq(cache.eval('g:cached', ['User']), 2)
+        vim.vars['cached'] = 3
+        vim.command('doautocmd User CacheTest')
+        eq(cache.eval('g:cached', ['User']), 3)
+    finally:
+        cache.close()
+    eq(vim.eval('exists("#{0}")'.format(EvalCache.group)), 0)
+
+
+@with_setup(setup=cleanup)
+def test_eval_cached_changedtick():
+    cache = vim.eval_cache
+    # Shared by all instances of the session
+    ok(vim.with_hook(SessionHook()).eval_cache is cache)
+    try:
+        vim.current.buffer[:] = ['a']
+        eq(vim.eval_cached('getline(1)', ['changedtick']), 'a')
+        eq(vim.eval_cached('getline(1)', ['changedtick']), 'a')
+        vim.current.buffer[:] = ['b']
+        vim.command('doautocmd TextChanged')
+        eq(vim.eval_cached('getline(1)', ['changedtick']), 'b')
+        # Changes made by the handler itself are invalidated explicitly
+        vim.current.buffer[:] = ['c']
+        cache.invalidate('changedtick')
+        eq(vim.eval_cached('getline(1)', ['changedtick']), 'c')
+        eq(cache.stats['hits'], 1)
+        eq(cache.stats['invalidations'], 2)
+        # Cached lists and dicts are returned as copies
+        vim.eval_cached('[1, {"a": 2}]').append(3)
+        eq(vim.eval_cached('[1, {"a": 2}]'), [1, {'a': 2}])
+    finally:
+        cache.close()
+    ok(vim.eval_cache is not cache)
+    vim.eval_cache.close()
+
+
+@with_setup(setup=cleanup)
+def test_commands():
+    errors = vim.commands(['let g:c1 = 1', 'invalid-command', 'let g:c2 = 2'])
+    eq(len(errors), 3)
+    ok(errors[0] is None and errors[2] is None)
+    ok(isinstance(errors[1], vim.error))
+    eq(vim.vars.get_many(['c1', 'c2']), {'c1': 1, 'c2': 2})
+
+
+@with_setup(setup=cleanup)
+def test_batch():
+    with vim.batch() as batch:
+        batch.command('let g:b1 = 1')
+        batch.command('invalid-command')
+        batch.request('vim_set_var', 'b2', 2)
+        batch.request('vim_eval', 'g:b1 + 1')
+    eq(len(batch.errors), 1)
+    eq(batch.results[3], (None, 2))
+    eq(vim.vars['b2'], 2)
+
+
+@with_setup(setup=cleanup)
+def test_metrics():
+    metrics = vim.session.enable_metrics()
+    try:
+        vim.command('let g:metrics_test = 1')
+        vim.vars['metrics_test']
+        data = json.loads(metrics.dump())
+        eq(data['methods']['out-request']['vim_command']['count'], 1)
+        eq(data['methods']['out-request']['vim_get_var']['count'], 1)
+        ok(data['bytes_out'] > 0 and data['bytes_in'] > 0)
+        eq(data['gauges']['pending_requests'], 0)
+        eq(data['gauges']['max_pending_requests'], 1)
+    finally:
+        vim.session.disable_metrics()
+    eq(vim.session.metrics, None)
+
+
+@with_setup(setup=cleanup)
+def test_tracer():
+    tracer = vim.session.enable_tracer(Tracer(size=4))
+    try:
+        for i in range(3):
+            vim.vars['trace_test'] = i
+        events = tracer.events()
+        # only the last events are kept
+        eq(len(events), 4)
+        ok(tracer.count > 4)
+        request = [e for e in events if e['event'] == 'request-out'][-1]
+        eq(request['method'], 'vim_set_var')
+        ok(request['size'] > 0)
+        eq(events[-1]['event'], 'response-in')
+        eq(events[-1]['request_id'], request['request_id'])
+        eq(len(tracer.dump().splitlines()), 4)
+    finally:
+        vim.session.disable_tracer()
+    eq(vim.session.tracer, None)
+
+
+@with_setup(setup=cleanup)
+def test_watchdog():
+    stalls = []
+
+    def on_notification(name, args):
+        started = time.time()
+        while time.time() - started < 0.3:
+            pass
+        vim.session.stop()
+
+    watchdog = vim.session.enable_watchdog(0.05, stalls.append)
+    try:
+        vim.session.post('busy')
+        vim.session.run(None, on_notification)
+    finally:
+        vim.session.disable_watchdog()
+    eq(watchdog.stall_count, 1)
+    eq(stalls[0].message, 'notification busy')
+    ok('on_notification' in stalls[0].stack)
+    ok(stalls[-1].finished and stalls[-1].duration >= 0.3)
+
+
+@with_setup(setup=cleanup)
+def test_watchdog_resumed_handler():
+    stalls = []
+
+    def on_notification(name, args):
+        vim.eval('1')
+        # Blocks while handling the response to `vim_eval`
+        started = time.time()
+        while time.time() - started < 0.3:
+            pass
+        vim.session.stop()
+
+    watchdog = vim.session.enable_watchdog(0.05, stalls.append)
+    try:
+        vim.session.post('resumed')
+        vim.session.run(None, on_notification)
+    finally:
+        vim.session.disable_watchdog()
+    eq(watchdog.stall_count, 1)
+    eq(stalls[0].message, 'notification resumed')
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+from nose.tools import eq_ as eq, ok_ as ok
+
+from neovim.api import NvimError
+from neovim.msgpack_rpc.session import ErrorResponse
+from neovim.plugins.workers import CALL, WorkerError, WorkerPool
+
+
+# Functions posted to the fake sessions, run while waiting for a result
+posted = []
+
+
+class FakeSession(object):
+    def __init__(self, responses=None):
+        self.responses = responses or {}
+        self.requests = []
+        self.notifications = []
+        self.notification_handlers = {}
+
+    def post(self, name, fn):
+        eq(name, CALL)
+        posted.append(fn)
+
+    def wait_for(self, start):
+        result = []
+        start(lambda err, rv: result.append((err, rv,)))
+        while not result and posted:
+            posted.pop(0)()
+        ok(result, 'wait_for would block')
+        err, rv = result[0]
+        if err:
+            raise Exception(err)
+        return rv
+
+    def request(self, name, *args):
+        self.requests.append((name,) + args)
+        rv = self.responses[name]
+        if isinstance(rv, Exception):
+            raise rv
+        return rv
+
+    def notify(self, name, *args):
+        self.notifications.append((name,) + args)
+
+    def add_notification_handler(self, name, callback):
+        self.notification_handlers.setdefault(name, []).append(callback)
+
+    def remove_notification_handler(self, name, callback):
+        self.notification_handlers[name].remove(callback)
+
+    def filter_callbacks(self, request_cb, notification_cb):
+        return request_cb, notification_cb
+
+    def run(self, request_cb, notification_cb):
+        self.callbacks = (request_cb, notification_cb,)
+
+
+class FakeNvim(object):
+    def __init__(self, responses=None):
+        self.session = FakeSession(responses)
+
+
+class FakeFinder(object):
+    notification = 'runtimepath-changed'
+
+
+class FakeHost(object):
+    def __init__(self, responses=None):
+        self.nvim = FakeNvim(responses)
+        self.finder = FakeFinder()
+        self.method_handlers = {b'local': lambda: 'local'}
+        self.handler_index = {}
+        self.requests = []
+        self.notifications = []
+
+    def on_request(self, name, args):
+        self.requests.append(name)
+        if name in self.method_handlers:
+            return self.method_handlers[name]()
+        raise Exception('no handler')
+
+    def on_notification(self, name, args):
+        self.notifications.append(name)
+
+
+def new_pool(modules, responses=None):
+    del posted[:]
+    pool = WorkerPool(FakeHost(responses), modules)
+    for worker in pool.workers:
+        worker.session = FakeSession()
+    pool.run()
+    return pool
+
+
+def request(pool, name, *args):
+    return pool.session.callbacks[0](name, list(args))
+
+
+def notify(pool, name, *args):
+    pool.session.callbacks[1](name, list(args))
+    run_posted()
+
+
+def run_posted():
+    while posted:
+        posted.pop(0)()
+
+
+def test_routes():
+    pool = new_pool(['a', 'b'])
+    a, b = pool.workers
+    a.session.responses[b'a_method'] = 'a'
+    b.session.responses[b'b_method'] = 'b'
+    pool.worker_ready(a, [b'a_method'], [b'event'])
+    pool.worker_ready(b, [b'b_method'], [b'event'])
+    eq(request(pool, b'a_method', 1), 'a')
+    eq(request(pool, b'b_method'), 'b')
+    eq(a.session.requests, [(b'a_method', 1)])
+    eq(request(pool, b'local'), 'local')
+    notify(pool, b'event', 2)
+    eq(a.session.notifications, [(b'event', 2)])
+    eq(b.session.notifications, [(b'event', 2)])
+    # Events are also dispatched to the host
+    eq(pool.host.notifications, [b'event'])
+
+
+def test_runtimepath_changed():
+    pool = new_pool(['a', 'b'])
+    pool._on_runtimepath_changed([])
+    run_posted()
+    for worker in pool.workers:
+        eq(worker.session.notifications, [('runtimepath-changed',)])
+
+
+def test_worker_error():
+    pool = new_pool(['a'])
+    worker = pool.workers[0]
+    worker.session.responses[b'fail'] = WorkerError("Exception('failed',)")
+    pool.worker_ready(worker, [b'fail'], [])
+    try:
+        request(pool, b'fail')
+        ok(False)
+    except ErrorResponse as err:
+        # Sent to Nvim as sent by the worker
+        eq(err.args[0], "Exception('failed',)")
+
+
+def test_forward_error():
+    pool = new_pool(['a'], {
+        b'vim_eval': NvimError(b'E121: Undefined variable'),
+        b'vim_get_current_line': 'line',
+    })
+    worker = pool.workers[0]
+    eq(worker._on_request(b'vim_get_current_line', []), 'line')
+    try:
+        worker._on_request(b'vim_eval', ['g:undefined'])
+        ok(False)
+    except ErrorResponse as err:
+        # Sent to the worker like Nvim errors
+        eq(err.args[0], [0, b'E121: Undefined variable'])
+
+
+def test_exit_before_ready():
+    pool = new_pool(['a', 'b'])
+    a, b = pool.workers
+    pool.worker_ready(a, [b'a_method'], [])
+    # The request waits for the remaining worker, which exits
+    pool.call(lambda: pool.worker_exited(b))
+    try:
+        request(pool, b'b_method')
+        ok(False)
+    except Exception as err:
+        eq(str(err), 'no handler')
+    eq(pool.host.requests, [b'b_method'])
+    eq(pool.starting, set())
+
+
+def test_exit_after_ready():
+    pool = new_pool(['a'])
+    worker = pool.workers[0]
+    pool.worker_ready(worker, [b'a_method'], [])
+    worker.session = None
+    pool.worker_exited(worker)
+    try:
+        request(pool, b'a_method')
+        ok(False)
+    except ErrorResponse as err:
+        eq(err.args[0], '<Worker a> is not running')
+    eq(pool.host.requests, [])
+
+
+def test_start_timeout():
+    pool = new_pool(['a'])
+    pool._start_timed_out()
+    # Requests no longer wait for the worker
+    eq(request(pool, b'local'), 'local')
+    try:
+        request(pool, b'unknown')
+        ok(False)
+    except Exception as err:
+        eq(str(err), 'no handler')